@@ -0,0 +1,164 @@
+"""Per-client rate limiting and admission control for expensive work
+
+Requests are sorted into lanes by route. Each lane has a token bucket per
+client: a client may burst up to `burst` requests and is then held to `rate`
+requests per second, getting 429 with Retry-After beyond that. Buckets are
+kept in LRU order and the least recently seen clients are forgotten past
+max_clients, so memory stays bounded however many addresses show up.
+
+Separately, an AdmissionGate caps how many expensive computations run at
+once. Further ones wait in a bounded queue; when the queue is full, or a
+waiter is not admitted within the timeout, the request is shed. Cheap lanes
+never pass through the gate, so lookups and health checks are not queued
+behind scans.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, Optional
+
+from fastapi.responses import JSONResponse
+
+
+class RateLimiter:
+    """Token buckets of one lane, keyed by client"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = 10000):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        # client -> (tokens, monotonic time they were counted), least recently seen first
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def acquire(self, client: str) -> float:
+        """Take a token for client: 0 if it may proceed now, else seconds until it may"""
+        now = time.monotonic()
+        bucket = self.buckets.pop(client, None)
+        tokens = self.burst if bucket is None else min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[client] = (tokens, now)
+        while len(self.buckets) > self.max_clients:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+class Overloaded(Exception):
+    """The admission gate shed a request; reason is "queue_full" or "timeout" """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionGate:
+    """At most limit concurrent holders, with at most queue more waiting in order"""
+
+    def __init__(self, limit: int, queue: int, timeout: float):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold a slot for the duration of the block; raises Overloaded when shed"""
+        if self.active < self.limit:
+            self.active += 1
+        elif len(self._waiters) >= self.queue:
+            raise Overloaded("queue_full")
+        else:
+            # Freed slots are handed to waiters directly, so active stays counted
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, self.timeout)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    # Handed a slot just as it gave up: pass it on
+                    self._release()
+                else:
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    raise Overloaded("timeout") from None
+                raise
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class RateLimitMiddleware:
+    """Answer 429 to clients over their lane's rate before the request is routed
+
+    lane_of(method, path) names the lane of a request; lanes without a
+    limiter (and CORS preflights) pass straight through. Clients are
+    identified by peer address. Behind proxy_hops trusted proxies that each
+    append the address they saw to client_header (X-Forwarded-For style),
+    the client is the proxy_hops-th address from the right: entries further
+    left were written by the client and can be forged, so they are never
+    used. Requests carrying fewer entries than that did not come through
+    the proxies and fall back to the peer address. on_limited(lane) is
+    called for every rejected request.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiters: Dict[str, RateLimiter],
+        lane_of: Callable[[str, str], Optional[str]],
+        client_header: str = "",
+        proxy_hops: int = 0,
+        on_limited: Optional[Callable[[str], None]] = None,
+    ):
+        self.app = app
+        self.limiters = limiters
+        self.lane_of = lane_of
+        self.client_header = client_header.lower().encode("latin-1")
+        self.proxy_hops = proxy_hops if client_header else 0
+        self.on_limited = on_limited
+
+    def client_of(self, scope) -> str:
+        if self.proxy_hops:
+            # Repeated headers are one list, in the order they were sent
+            hops = [
+                address.strip()
+                for name, value in scope["headers"] if name == self.client_header
+                for address in value.decode("latin-1").split(",")
+            ]
+            if len(hops) >= self.proxy_hops and hops[-self.proxy_hops]:
+                return hops[-self.proxy_hops]
+        client = scope.get("client")
+        return client[0] if client else ""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] != "OPTIONS":
+            lane = self.lane_of(scope["method"], scope["path"])
+            limiter = self.limiters.get(lane)
+            wait = limiter.acquire(self.client_of(scope)) if limiter is not None else 0
+            if wait:
+                if self.on_limited is not None:
+                    self.on_limited(lane)
+                headers = {"Retry-After": str(math.ceil(wait))}
+                response = JSONResponse({"detail": "Too many requests"}, status_code=429, headers=headers)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -0,0 +1,207 @@
+"""Compressed row bitmaps for low-cardinality filter predicates
+
+Follows the roaring layout: row numbers are split into 2^16-row chunks and
+each non-empty chunk is stored either as a sorted uint16 array (sparse) or a
+1024-word uint64 bitset (dense), whichever is smaller. Empty chunks take no
+space at all, and AND/OR/ANDNOT work chunk by chunk on numpy arrays.
+"""
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+WORDS_PER_CHUNK = CHUNK_SIZE // 64
+# Past this many rows a chunk is cheaper as a bitset than as an array
+ARRAY_LIMIT = 4096
+
+
+def _popcount(words: np.ndarray) -> int:
+    if hasattr(np, "bitwise_count"):
+        return int(np.bitwise_count(words).sum())
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+
+def _to_words(container: np.ndarray) -> np.ndarray:
+    if container.dtype == np.uint64:
+        return container
+    words = np.zeros(WORDS_PER_CHUNK, dtype=np.uint64)
+    values = container.astype(np.uint64)
+    np.bitwise_or.at(words, (values >> np.uint64(6)).astype(np.intp), np.uint64(1) << (values & np.uint64(63)))
+    return words
+
+
+def _to_array(words: np.ndarray) -> np.ndarray:
+    bits = np.unpackbits(words.view(np.uint8), bitorder="little")
+    return np.flatnonzero(bits).astype(np.uint16)
+
+
+def _normalize(container: np.ndarray) -> Optional[np.ndarray]:
+    """Pick the cheaper representation; None for an empty chunk"""
+    if container.dtype == np.uint16:
+        return container if len(container) else None
+    count = _popcount(container)
+    if count == 0:
+        return None
+    return _to_array(container) if count <= ARRAY_LIMIT else container
+
+
+class Bitmap:
+    """Set of row numbers with roaring-style chunked containers"""
+
+    __slots__ = ("containers",)
+
+    def __init__(self, containers: Optional[Dict[int, np.ndarray]] = None):
+        self.containers: Dict[int, np.ndarray] = containers or {}
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[int]) -> "Bitmap":
+        rows = np.unique(rows.astype(np.int64) if isinstance(rows, np.ndarray) else np.fromiter(rows, dtype=np.int64))
+        bitmap = cls()
+        if not len(rows):
+            return bitmap
+        keys = rows >> CHUNK_BITS
+        boundaries = np.flatnonzero(np.diff(keys)) + 1
+        for chunk in np.split(rows, boundaries):
+            key = int(chunk[0] >> CHUNK_BITS)
+            container = (chunk & (CHUNK_SIZE - 1)).astype(np.uint16)
+            bitmap.containers[key] = container if len(container) <= ARRAY_LIMIT else _to_words(container)
+        return bitmap
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "Bitmap":
+        bitmap = cls()
+        for start in range(0, len(mask), CHUNK_SIZE):
+            chunk = mask[start:start + CHUNK_SIZE]
+            if not chunk.any():
+                continue
+            packed = np.zeros(CHUNK_SIZE // 8, dtype=np.uint8)
+            bits = np.packbits(chunk, bitorder="little")
+            packed[:len(bits)] = bits
+            container = _normalize(packed.view(np.uint64))
+            if container is not None:
+                bitmap.containers[start >> CHUNK_BITS] = container
+        return bitmap
+
+    def __len__(self):
+        return sum(len(c) if c.dtype == np.uint16 else _popcount(c) for c in self.containers.values())
+
+    def __contains__(self, row: int):
+        container = self.containers.get(row >> CHUNK_BITS)
+        if container is None:
+            return False
+        low = row & (CHUNK_SIZE - 1)
+        if container.dtype == np.uint16:
+            i = np.searchsorted(container, low)
+            return bool(i < len(container) and container[i] == low)
+        return bool((int(container[low >> 6]) >> (low & 63)) & 1)
+
+    def add(self, row: int):
+        key, low = row >> CHUNK_BITS, row & (CHUNK_SIZE - 1)
+        container = self.containers.get(key)
+        if container is None:
+            self.containers[key] = np.array([low], dtype=np.uint16)
+        elif container.dtype == np.uint16:
+            i = int(np.searchsorted(container, low))
+            if i < len(container) and container[i] == low:
+                return
+            container = np.insert(container, i, np.uint16(low))
+            self.containers[key] = container if len(container) <= ARRAY_LIMIT else _to_words(container)
+        else:
+            container[low >> 6] |= np.uint64(1 << (low & 63))
+
+    def discard(self, row: int):
+        key, low = row >> CHUNK_BITS, row & (CHUNK_SIZE - 1)
+        container = self.containers.get(key)
+        if container is None:
+            return
+        if container.dtype == np.uint16:
+            i = int(np.searchsorted(container, low))
+            if i < len(container) and container[i] == low:
+                container = np.delete(container, i)
+        else:
+            container[low >> 6] &= ~np.uint64(1 << (low & 63))
+            if not container[low >> 6]:
+                container = _normalize(container)
+        if container is None or not len(container):
+            del self.containers[key]
+        else:
+            self.containers[key] = container
+
+    def copy(self) -> "Bitmap":
+        return Bitmap({key: container.copy() for key, container in self.containers.items()})
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        result = {}
+        for key in self.containers.keys() & other.containers.keys():
+            a, b = self.containers[key], other.containers[key]
+            if a.dtype == np.uint16 and b.dtype == np.uint16:
+                container = np.intersect1d(a, b, assume_unique=True)
+            elif a.dtype == np.uint16 or b.dtype == np.uint16:
+                values, words = (a, b) if a.dtype == np.uint16 else (b, a)
+                hits = (words[values >> 6] >> (values & 63).astype(np.uint64)) & np.uint64(1)
+                container = values[hits.astype(bool)]
+            else:
+                container = a & b
+            container = _normalize(container)
+            if container is not None:
+                result[key] = container
+        return Bitmap(result)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        result = {}
+        for key in self.containers.keys() | other.containers.keys():
+            a, b = self.containers.get(key), other.containers.get(key)
+            if a is None or b is None:
+                result[key] = (a if b is None else b).copy()
+            elif a.dtype == np.uint16 and b.dtype == np.uint16 and len(a) + len(b) <= ARRAY_LIMIT:
+                result[key] = np.union1d(a, b).astype(np.uint16)
+            else:
+                result[key] = _normalize(_to_words(a) | _to_words(b))
+        return Bitmap(result)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        """Rows in self but not in other (ANDNOT)"""
+        result = {}
+        for key, a in self.containers.items():
+            b = other.containers.get(key)
+            if b is None:
+                result[key] = a.copy()
+                continue
+            if a.dtype == np.uint16:
+                if b.dtype == np.uint16:
+                    container = np.setdiff1d(a, b, assume_unique=True).astype(np.uint16)
+                else:
+                    hits = (b[a >> 6] >> (a & 63).astype(np.uint64)) & np.uint64(1)
+                    container = a[~hits.astype(bool)]
+            else:
+                container = a & ~_to_words(b)
+            container = _normalize(container)
+            if container is not None:
+                result[key] = container
+        return Bitmap(result)
+
+    def to_mask(self, size: int) -> np.ndarray:
+        """Expand to a boolean mask over the first size rows"""
+        mask = np.zeros(size, dtype=bool)
+        for key, container in self.containers.items():
+            base = key << CHUNK_BITS
+            if base >= size:
+                continue
+            if container.dtype == np.uint16:
+                rows = container.astype(np.int64) + base
+                mask[rows[rows < size]] = True
+            else:
+                bits = np.unpackbits(container.view(np.uint8), bitorder="little").view(bool)
+                end = min(base + CHUNK_SIZE, size)
+                mask[base:end] = bits[:end - base]
+        return mask
+
+    def rows(self) -> np.ndarray:
+        """Sorted row numbers as an int64 array"""
+        parts = []
+        for key in sorted(self.containers):
+            container = self.containers[key]
+            values = container if container.dtype == np.uint16 else _to_array(container)
+            parts.append(values.astype(np.int64) + (key << CHUNK_BITS))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
@@ -0,0 +1,68 @@
+"""Single-flight coalescing of identical concurrent computations
+
+The first caller for a key starts the computation as its own task; callers
+arriving with the same key while it runs await that task instead of starting
+another, and all of them get the same result (or the same exception). The
+task is shielded, so one client disconnecting does not cancel the
+computation the others are waiting on.
+
+Work that runs inline on the event loop can only be joined by requests
+already waiting to run when it starts; those arriving while it runs are read
+after it has finished. To share with them too, a finished result is kept for
+window seconds and handed to identical callers that start within it. Keys must therefore capture
+everything the result depends on, such as the data version.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """Shares in-flight and just-finished results between callers with equal keys
+
+    observe, if given, is called with "leader", "joined" or "recent" for each
+    call, to count how often work was shared.
+    """
+
+    def __init__(self, window: float = 0.0, max_recent: int = 64, observe: Optional[Callable[[str], None]] = None):
+        self.window = window
+        self.max_recent = max_recent
+        self.observe = observe
+        self.flights: Dict[Hashable, asyncio.Task] = {}
+        # key -> (expiry on the loop clock, result), oldest first
+        self.recent: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable]):
+        """Result of compute() for key, shared with identical concurrent callers"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        while self.recent and next(iter(self.recent.values()))[0] <= now:
+            self.recent.popitem(last=False)
+        entry = self.recent.get(key)
+        if entry is not None:
+            self._observe("recent")
+            return entry[1]
+
+        task = self.flights.get(key)
+        if task is None:
+            task = self.flights[key] = loop.create_task(self._lead(key, compute))
+            self._observe("leader")
+        else:
+            self._observe("joined")
+        return await asyncio.shield(task)
+
+    async def _lead(self, key: Hashable, compute: Callable[[], Awaitable]):
+        try:
+            result = await compute()
+        finally:
+            del self.flights[key]
+        if self.window > 0:
+            self.recent.pop(key, None)
+            self.recent[key] = (asyncio.get_running_loop().time() + self.window, result)
+            while len(self.recent) > self.max_recent:
+                self.recent.popitem(last=False)
+        return result
+
+    def _observe(self, outcome: str):
+        if self.observe is not None:
+            self.observe(outcome)
@@ -0,0 +1,721 @@
+"""Columnar property inventory with precomputed investment metrics"""
+import copy
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from bitmap import Bitmap
+from snapshot import Snapshot, SnapshotRows
+
+# Raw listing fields kept as float64 columns for vectorized filtering
+NUMERIC_COLUMNS = (
+    "price",
+    "bedrooms",
+    "bathrooms",
+    "sqft",
+    "estimated_rent",
+    "estimated_arv",
+    "estimated_repair_cost",
+    "days_on_market",
+    "property_taxes",
+    "hoa_fees",
+)
+
+# Analysis outputs materialized as score columns: column -> (analysis, field)
+METRIC_COLUMNS = {
+    "estimated_roi": ("flip_analysis", "estimated_roi"),
+    "profit_margin": ("flip_analysis", "profit_margin"),
+    "net_profit": ("flip_analysis", "net_profit"),
+    "cash_on_cash_return": ("rental_analysis", "cash_on_cash_return"),
+    "cap_rate": ("rental_analysis", "cap_rate"),
+    "monthly_cash_flow": ("rental_analysis", "monthly_cash_flow"),
+    "annual_cash_flow": ("rental_analysis", "annual_cash_flow"),
+    "rent_to_price_ratio": ("rental_analysis", "rent_to_price_ratio"),
+}
+
+# Analyses of listings still as they are in the snapshot kept per inventory;
+# older ones are recomputed from the decoded listing when next read
+ANALYSIS_CACHE_SIZE = 4096
+
+# Low-cardinality string fields stored as integer codes; matching is case-insensitive
+CATEGORICAL_COLUMNS = ("city", "state", "property_type", "neighborhood_quality")
+
+# Boolean analysis outcomes indexed as bitmaps: flag -> (analysis, field)
+FLAG_COLUMNS = {
+    "meets_70_rule": ("flip_analysis", "meets_70_rule"),
+    "meets_1_percent_rule": ("rental_analysis", "meets_1_percent_rule"),
+}
+
+# Numeric columns the listing filters read, kept in the change history
+HISTORY_COLUMNS = ("price", "bedrooms") + tuple(FLAG_COLUMNS)
+
+# Writes whose before-images are kept for answering change queries. A client
+# further behind than this is sent everything again instead of a delta.
+CHANGE_HISTORY = 10000
+
+# Upper edges of the price histogram buckets used for facet counts
+PRICE_BUCKETS = (
+    (100000, "Under $100k"),
+    (200000, "$100k - $200k"),
+    (300000, "$200k - $300k"),
+    (500000, "$300k - $500k"),
+    (1000000, "$500k - $1M"),
+    (float("inf"), "$1M+"),
+)
+
+
+class ChangeHistory:
+    """How listings looked to the filters just before they were replaced or removed
+
+    One entry per write that replaced or removed a listing: the change
+    version of the write, the row, and the row's liveness, categorical codes
+    and HISTORY_COLUMNS as they were before it. That is enough to evaluate
+    the listing filters as of an earlier version. Entries are kept in arrays
+    keyed "version", "row", "alive", "code:<name>" and "column:<name>". Past
+    twice limit entries the oldest are dropped down to limit; horizon is the
+    oldest version the remaining entries can answer for.
+    """
+
+    _FILL = {"version": 0, "row": -1, "alive": False}
+
+    def __init__(self, horizon: int = 0, arrays: Optional[Dict[str, np.ndarray]] = None, limit: Optional[int] = None):
+        self.horizon = horizon
+        self.limit = CHANGE_HISTORY if limit is None else limit
+        self.arrays = dict(arrays) if arrays else {
+            "version": np.zeros(0, dtype=np.int64),
+            "row": np.zeros(0, dtype=np.int64),
+            "alive": np.zeros(0, dtype=bool),
+        }
+        self.count = len(self.arrays["version"])
+
+    def copy(self) -> "ChangeHistory":
+        # Arrays are shared: records only write past the copy's count, and
+        # growing or trimming replaces them
+        history = copy.copy(self)
+        history.arrays = dict(self.arrays)
+        return history
+
+    def _fill(self, key: str):
+        return self._FILL.get(key, -1 if key.startswith("code:") else 0)
+
+    def record(self, version: int, row: int, alive: bool, codes: Dict[str, int], columns: Dict[str, float]):
+        """Log a row's state before the write with the given change version"""
+        values = {"version": version, "row": row, "alive": alive}
+        values.update((f"code:{name}", code) for name, code in codes.items())
+        values.update((f"column:{name}", value) for name, value in columns.items())
+        capacity = len(self.arrays["version"])
+        if self.count == capacity or not self.arrays["version"].flags.writeable:
+            # Grow, which also copies arrays mapped read-only from a snapshot
+            capacity = max(2 * self.count, 64)
+            for key, array in self.arrays.items():
+                grown = np.full(capacity, self._fill(key), dtype=array.dtype)
+                grown[:self.count] = array[:self.count]
+                self.arrays[key] = grown
+        for key, value in values.items():
+            array = self.arrays.get(key)
+            if array is None:
+                dtype = np.int32 if key.startswith("code:") else np.float64
+                array = self.arrays[key] = np.full(capacity, self._fill(key), dtype=dtype)
+            array[self.count] = value
+        self.count += 1
+
+        if self.count > 2 * self.limit:
+            drop = self.count - self.limit
+            self.horizon = int(self.arrays["version"][drop - 1])
+            self.arrays = {key: array[drop:self.count].copy() for key, array in self.arrays.items()}
+            self.count = self.limit
+
+    def entries(self) -> Dict[str, np.ndarray]:
+        """The logged entries, oldest first, for writing snapshots"""
+        return {key: array[:self.count] for key, array in self.arrays.items()}
+
+    def as_of(self, rows: np.ndarray, since: int) -> np.ndarray:
+        """Entry holding each row's state at version since, or -1 for rows not replaced or removed since"""
+        versions = self.arrays["version"][:self.count]
+        start = int(np.searchsorted(versions, since, side="right"))
+        found, first = np.unique(self.arrays["row"][start:self.count], return_index=True)
+        entries = np.full(len(rows), -1, dtype=np.int64)
+        if len(found):
+            at = np.searchsorted(found, rows).clip(max=len(found) - 1)
+            hit = found[at] == rows
+            entries[hit] = start + first[at[hit]]
+        return entries
+
+    def values(self, key: str, entries: np.ndarray) -> np.ndarray:
+        """Logged values of key for the given entries"""
+        array = self.arrays.get(key)
+        if array is None:
+            return np.full(len(entries), self._fill(key))
+        return array[entries]
+
+
+class Inventory:
+    """Property rows plus numpy columns for filtering and ranking
+
+    Rows keep their insertion position for the life of the inventory; removed
+    listings leave a dead slot behind so row numbers handed out to indexes
+    stay valid. Every listing is analysed once when it is written, so reads
+    never recompute the flip and rental math; listings still as they are in
+    a snapshot are analysed when first read, keeping only the recent ones.
+
+    Each categorical value and boolean flag also has a row bitmap, so
+    equality predicates combine as bitwise AND/OR/ANDNOT without touching the
+    rows themselves.
+    """
+
+    def __init__(
+        self,
+        analyze: Callable[[Dict], Dict],
+        categorize: Optional[Callable[[Dict, Dict], Dict[str, str]]] = None,
+        capacity: int = 1024,
+    ):
+        self.analyze = analyze
+        self.categorize = categorize
+        self.rows: List[Optional[Dict]] = []
+        # Analyses of rows written to this inventory; those of snapshot rows
+        # are computed on read and only the most recent are kept
+        self.analyses: Dict[int, Dict] = {}
+        self._snapshot_analyses: "OrderedDict[int, Dict]" = OrderedDict()
+        # Analyses computed lazily on read rather than at write time
+        self.lazy_analyses = 0
+        # Change log: version is bumped on every upsert and removal, and each
+        # row records the version that last wrote it and the one that created
+        # it. Removed rows keep their slot, so the ids in _removed (row -> id)
+        # are all a client needs to drop them. Derived caches also key on
+        # version to tell they are stale.
+        self.version = 0
+        self.versions = np.zeros(capacity, dtype=np.int64)
+        self.created = np.zeros(capacity, dtype=np.int64)
+        self._removed: Dict[int, str] = {}
+        self.history = ChangeHistory()
+        # Change version at which dead rows were last compacted out of a
+        # snapshot, renumbering the rows after them; 0 if never
+        self.compacted_at = 0
+        # id -> row. For snapshot-backed inventories this only holds rows
+        # written since the snapshot (-1 for removals); the rest are found
+        # through the snapshot's id index.
+        self._row_of: Dict[str, int] = {}
+        self.snapshot: Optional[Snapshot] = None
+        self._bitmap_index: Dict[str, tuple] = {}
+        self.alive = np.zeros(capacity, dtype=bool)
+        column_names = NUMERIC_COLUMNS + tuple(METRIC_COLUMNS) + tuple(FLAG_COLUMNS)
+        self.columns = {name: np.zeros(capacity, dtype=np.float64) for name in column_names}
+        self.codes: Dict[str, np.ndarray] = {}
+        self.dictionaries: Dict[str, Dict[str, int]] = {}
+        self.labels: Dict[str, List[str]] = {}
+        self.counts: Dict[str, List[int]] = {}
+        self.bitmaps: Dict[str, List[Bitmap]] = {}
+        self.flags: Dict[str, Bitmap] = {name: Bitmap() for name in FLAG_COLUMNS}
+        self.live = Bitmap()
+        self._defer_bitmaps = False
+        for name in CATEGORICAL_COLUMNS:
+            self._add_categorical(name)
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        snapshot: Snapshot,
+        analyze: Callable[[Dict], Dict],
+        categorize: Optional[Callable[[Dict, Dict], Dict[str, str]]] = None,
+    ) -> "Inventory":
+        """Inventory whose columns are read-only views over a mapped snapshot
+
+        Nothing is copied until the first write. Rows and analyses are
+        materialized lazily and only the recently read ones are kept, ids are resolved through the snapshot's hash
+        index, and each value bitmap is built from the stored row grouping the
+        first time a filter uses it.
+        """
+        inventory = cls(analyze, categorize, capacity=0)
+        inventory.snapshot = snapshot
+        inventory.alive = snapshot.array("alive")
+        inventory.columns = {name: snapshot.array(f"column:{name}") for name in snapshot.header["columns"]}
+        inventory.version, inventory.versions, inventory.created = snapshot.change_log()
+        inventory.history = ChangeHistory(*snapshot.change_history())
+        inventory.compacted_at = snapshot.header.get("compacted_at", 0)
+        for name, labels in snapshot.header["categorical"].items():
+            codes = snapshot.array(f"code:{name}")
+            inventory.codes[name] = codes
+            inventory.labels[name] = list(labels)
+            inventory.dictionaries[name] = {label.lower(): code for code, label in enumerate(labels)}
+            order, bounds = snapshot.categorical_index(name)
+            inventory.counts[name] = np.diff(bounds).tolist()
+            inventory.bitmaps[name] = [None] * len(labels)
+            inventory._bitmap_index[name] = (order, bounds)
+        inventory.rows = SnapshotRows(snapshot, inventory.alive)
+        inventory.live = Bitmap.from_mask(inventory.alive)
+        for name in FLAG_COLUMNS:
+            inventory.flags[name] = Bitmap.from_mask((inventory.columns[name] != 0) & inventory.alive)
+        return inventory
+
+    def row_for(self, property_id: str) -> Optional[int]:
+        """Row of a live listing, or None"""
+        row = self._row_of.get(property_id)
+        if row is None and self.snapshot is not None:
+            row = self.snapshot.find_row(property_id)
+        return row if row is not None and row >= 0 else None
+
+    def freeze(self) -> "Inventory":
+        """Point-in-time copy for serializing while this inventory keeps changing
+
+        Columns are copied; listing dicts are shared since writes replace them
+        rather than mutating them.
+        """
+        frozen = copy.copy(self)
+        n = self.size
+        frozen.alive = self.alive[:n].copy()
+        frozen.columns = {name: column[:n].copy() for name, column in self.columns.items()}
+        frozen.codes = {name: codes[:n].copy() for name, codes in self.codes.items()}
+        frozen.versions = self.versions[:n].copy()
+        frozen.created = self.created[:n].copy()
+        frozen._removed = dict(self._removed)
+        frozen.history = self.history.copy()
+        frozen.labels = {name: list(labels) for name, labels in self.labels.items()}
+        frozen.rows = self.rows.copy()
+        frozen.analyses = dict(self.analyses)
+        frozen._snapshot_analyses = OrderedDict()
+        return frozen
+
+    def _ensure_writable(self):
+        # Snapshot columns are read-only views; copy them before the first write
+        if self.alive.flags.writeable:
+            return
+        self.alive = self.alive.copy()
+        self.columns = {name: column.copy() for name, column in self.columns.items()}
+        self.codes = {name: codes.copy() for name, codes in self.codes.items()}
+        self.versions = self.versions.copy()
+        self.created = self.created.copy()
+
+    def __len__(self):
+        return int(self.alive[:self.size].sum())
+
+    def __contains__(self, property_id):
+        return self.row_for(property_id) is not None
+
+    @property
+    def size(self) -> int:
+        """Number of row slots in use, including removed listings"""
+        return len(self.rows)
+
+    def _grow(self):
+        extra = max(len(self.alive), 1024)
+        self.alive = np.concatenate([self.alive, np.zeros(extra, dtype=bool)])
+        for name, column in self.columns.items():
+            self.columns[name] = np.concatenate([column, np.zeros(extra, dtype=column.dtype)])
+        for name, column in self.codes.items():
+            self.codes[name] = np.concatenate([column, np.full(extra, -1, dtype=column.dtype)])
+        self.versions = np.concatenate([self.versions, np.zeros(extra, dtype=np.int64)])
+        self.created = np.concatenate([self.created, np.zeros(extra, dtype=np.int64)])
+
+    def _add_categorical(self, name: str):
+        self.codes[name] = np.full(len(self.alive), -1, dtype=np.int32)
+        self.dictionaries[name] = {}
+        self.labels[name] = []
+        self.counts[name] = []
+        self.bitmaps[name] = []
+
+    def _encode(self, name: str, value) -> int:
+        if name not in self.codes:
+            self._add_categorical(name)
+        label = str(value) if value is not None else ""
+        dictionary = self.dictionaries[name]
+        code = dictionary.get(label.lower())
+        if code is None:
+            code = dictionary[label.lower()] = len(dictionary)
+            self.labels[name].append(label)
+            self.counts[name].append(0)
+            self.bitmaps[name].append(Bitmap())
+        return code
+
+    def value_bitmap(self, name: str, code: int) -> Bitmap:
+        """Bitmap of rows holding a categorical code"""
+        bitmap = self.bitmaps[name][code]
+        if bitmap is None:
+            order, bounds = self._bitmap_index[name]
+            bitmap = self.bitmaps[name][code] = Bitmap.from_rows(order[bounds[code]:bounds[code + 1]])
+        return bitmap
+
+    def _set_code(self, name: str, row: int, code: int):
+        codes = self.codes[name]
+        index = not self._defer_bitmaps
+        if codes[row] >= 0:
+            self.counts[name][codes[row]] -= 1
+            if index:
+                self.value_bitmap(name, int(codes[row])).discard(row)
+        if code >= 0:
+            self.counts[name][code] += 1
+            if index:
+                self.value_bitmap(name, code).add(row)
+        codes[row] = code
+
+    def code_for(self, name: str, value: str) -> Optional[int]:
+        """Categorical code for a value, or None if no listing ever had it"""
+        return self.dictionaries[name].get(value.lower())
+
+    def upsert(self, property_data: Dict) -> int:
+        """Insert or replace a listing and refresh its columns; returns its row"""
+        self._ensure_writable()
+        self.version += 1
+        property_id = property_data["id"]
+        row = self.row_for(property_id)
+        if row is None:
+            row = len(self.rows)
+            if row >= len(self.alive):
+                self._grow()
+            self.rows.append(None)
+            self._row_of[property_id] = row
+            self.created[row] = self.version
+        else:
+            self._record_history(row)
+        self.versions[row] = self.version
+
+        analysis = self.analyze(property_data)
+        self.rows[row] = property_data
+        self.analyses[row] = analysis
+        self._snapshot_analyses.pop(row, None)
+        self.alive[row] = True
+        for name in NUMERIC_COLUMNS:
+            self.columns[name][row] = property_data.get(name) or 0
+        for name, (section, field) in METRIC_COLUMNS.items():
+            self.columns[name][row] = analysis[section][field]
+        for name, (section, field) in FLAG_COLUMNS.items():
+            self.columns[name][row] = bool(analysis[section][field])
+            if self._defer_bitmaps:
+                continue
+            if analysis[section][field]:
+                self.flags[name].add(row)
+            else:
+                self.flags[name].discard(row)
+        if not self._defer_bitmaps:
+            self.live.add(row)
+        categories = {name: property_data.get(name) for name in CATEGORICAL_COLUMNS}
+        if self.categorize:
+            categories.update(self.categorize(property_data, analysis))
+        for name, value in categories.items():
+            self._set_code(name, row, self._encode(name, value))
+        return row
+
+    def extend(self, properties: Iterable[Dict]):
+        """Bulk-load listings, building the bitmap indexes once at the end"""
+        self._defer_bitmaps = True
+        try:
+            for property_data in properties:
+                self.upsert(property_data)
+        finally:
+            self._defer_bitmaps = False
+            self.rebuild_bitmaps()
+
+    def rebuild_bitmaps(self):
+        """Recreate every bitmap from the code and flag columns"""
+        n = self.size
+        alive = self.alive[:n]
+        self.live = Bitmap.from_mask(alive)
+        for name, codes in self.codes.items():
+            codes = codes[:n]
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(self.labels[name]) + 1))
+            self.bitmaps[name] = [Bitmap.from_rows(order[bounds[c]:bounds[c + 1]]) for c in range(len(self.labels[name]))]
+            self._bitmap_index.pop(name, None)
+        for name in FLAG_COLUMNS:
+            self.flags[name] = Bitmap.from_mask((self.columns[name][:n] != 0) & alive)
+
+    def remove(self, property_id: str) -> Optional[Dict]:
+        """Remove a listing, leaving its row slot dead"""
+        row = self.row_for(property_id)
+        if row is None:
+            return None
+        if self.snapshot is not None:
+            self._row_of[property_id] = -1
+        else:
+            del self._row_of[property_id]
+        self._ensure_writable()
+        self.version += 1
+        self._record_history(row)
+        self.versions[row] = self.version
+        self._removed[row] = property_id
+        property_data = self.rows[row]
+        self.rows[row] = None
+        self.analyses.pop(row, None)
+        self._snapshot_analyses.pop(row, None)
+        self.alive[row] = False
+        self.live.discard(row)
+        for name in self.codes:
+            self._set_code(name, row, -1)
+        for bitmap in self.flags.values():
+            bitmap.discard(row)
+        return property_data
+
+    def _record_history(self, row: int):
+        self.history.record(
+            self.version, row, bool(self.alive[row]),
+            {name: int(codes[row]) for name, codes in self.codes.items()},
+            {name: float(self.columns[name][row]) for name in HISTORY_COLUMNS},
+        )
+
+    @property
+    def horizon(self) -> int:
+        """Oldest change version that changes can be worked out from
+
+        Before-images older than it are gone, and so may be the dead rows of
+        listings removed before it.
+        """
+        return self.history.horizon
+
+    def changed_rows(self, since: int) -> np.ndarray:
+        """Rows added, updated or removed after change version since, oldest change first"""
+        rows = np.flatnonzero(self.versions[:self.size] > since)
+        return rows[np.argsort(self.versions[rows], kind="stable")]
+
+    def removed_id(self, row: int) -> Optional[str]:
+        """Id of the listing removed from a dead row"""
+        property_id = self._removed.get(row)
+        if property_id is None and self.snapshot is not None:
+            property_id = self.snapshot.removed_id(row)
+        return property_id
+
+    def removed_ids(self) -> Dict[int, str]:
+        """Every dead row's removed listing id, for writing snapshots"""
+        removed = self.snapshot.removed_ids() if self.snapshot is not None else {}
+        removed.update(self._removed)
+        return removed
+
+    def get(self, property_id: str) -> Optional[Dict]:
+        row = self.row_for(property_id)
+        return self.rows[row] if row is not None else None
+
+    def analysis(self, property_id: str) -> Optional[Dict]:
+        row = self.row_for(property_id)
+        return self.analysis_at(row) if row is not None else None
+
+    def analysis_at(self, row: int) -> Optional[Dict]:
+        """Analysis for a row, computed on access for snapshot rows"""
+        analysis = self.analyses.get(row)
+        if analysis is not None or not self.alive[row]:
+            return analysis
+        analysis = self._snapshot_analyses.get(row)
+        if analysis is None:
+            analysis = self._snapshot_analyses[row] = self.analyze(self.rows[row])
+            self.lazy_analyses += 1
+            if len(self._snapshot_analyses) > ANALYSIS_CACHE_SIZE:
+                self._snapshot_analyses.popitem(last=False)
+        else:
+            self._snapshot_analyses.move_to_end(row)
+        return analysis
+
+    def properties(self) -> Iterator[Dict]:
+        """Live listings in insertion order"""
+        return (p for p in self.rows if p is not None)
+
+    def column(self, name: str) -> np.ndarray:
+        """View of a numeric or metric column over the used rows"""
+        return self.columns[name][:self.size]
+
+    def match_values(self, name: str, expression: str) -> Bitmap:
+        """Rows whose categorical value matches a comma-separated value list
+
+        Plain values are OR'd together; values prefixed with "!" are excluded,
+        so "GA,FL" selects either state and "!Multi Family" everything else.
+        """
+        include_codes, exclude_codes = self._value_codes(name, expression)
+        include, exclude = None, Bitmap()
+        for code in include_codes or ():
+            bitmap = self.value_bitmap(name, code)
+            include = bitmap if include is None else include | bitmap
+        for code in exclude_codes:
+            exclude = exclude | self.value_bitmap(name, code)
+        if include is None:
+            include = self.live if include_codes is None else Bitmap()
+        return include - exclude if exclude.containers else include
+
+    def _value_codes(self, name: str, expression: str):
+        """Codes a value list includes (None if it has no plain values) and excludes
+
+        Values no listing ever had have no code and are left out.
+        """
+        include, exclude = None, []
+        for value in expression.split(","):
+            value = value.strip()
+            negate = value.startswith("!")
+            if negate:
+                value = value[1:].strip()
+            if not value:
+                continue
+            if not negate and include is None:
+                include = []
+            code = self.code_for(name, value) if name in self.codes else None
+            if code is not None:
+                (exclude if negate else include).append(code)
+        return include, exclude
+
+    def match_flag(self, name: str, value: bool) -> Bitmap:
+        """Rows where a boolean analysis flag has the given value"""
+        return self.flags[name] if value else self.live - self.flags[name]
+
+    def filter_mask(
+        self,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        min_bedrooms: Optional[int] = None,
+        property_type: Optional[str] = None,
+        categories: Optional[Dict[str, str]] = None,
+        flags: Optional[Dict[str, bool]] = None,
+    ) -> np.ndarray:
+        """Boolean mask over rows matching the structured listing filters
+
+        Categorical and flag predicates are resolved on the bitmaps first;
+        only the numeric range checks run over the columns.
+        """
+        n = self.size
+        predicates = {"city": city, "state": state, "property_type": property_type}
+        predicates.update(categories or {})
+        predicates = {name: value for name, value in predicates.items() if value}
+        flags = {name: value for name, value in (flags or {}).items() if value is not None}
+
+        if predicates or flags:
+            selection = self.live
+            for name, value in predicates.items():
+                selection = selection & self.match_values(name, value)
+            for name, value in flags.items():
+                selection = selection & self.match_flag(name, value)
+            mask = selection.to_mask(n)
+        else:
+            mask = self.alive[:n].copy()
+
+        if min_price:
+            mask &= self.columns["price"][:n] >= min_price
+        if max_price:
+            mask &= self.columns["price"][:n] <= max_price
+        if min_bedrooms:
+            mask &= self.columns["bedrooms"][:n] >= min_bedrooms
+        return mask
+
+    def filter_rows(
+        self,
+        rows: np.ndarray,
+        min_price: Optional[int] = None,
+        max_price: Optional[int] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        min_bedrooms: Optional[int] = None,
+        property_type: Optional[str] = None,
+        categories: Optional[Dict[str, str]] = None,
+        flags: Optional[Dict[str, bool]] = None,
+        as_of: Optional[int] = None,
+    ) -> np.ndarray:
+        """filter_mask evaluated on just the given rows; one boolean per row
+
+        Reads the columns of those rows only, so checking a few changed
+        listings against many filters never scans the inventory. With as_of,
+        the rows are checked as they were at that change version (which must
+        not be older than horizon) using the change history.
+        """
+        predicates = {"city": city, "state": state, "property_type": property_type}
+        predicates.update(categories or {})
+        predicates = {name: value for name, value in predicates.items() if value}
+        flags = {name: value for name, value in (flags or {}).items() if value is not None}
+        values = self._row_values(rows, as_of)
+
+        keep = values("alive")
+        for name, expression in predicates.items():
+            include, exclude = self._value_codes(name, expression)
+            codes = values(f"code:{name}")
+            if include is not None:
+                keep &= np.isin(codes, include)
+            if exclude:
+                keep &= ~np.isin(codes, exclude)
+        for name, value in flags.items():
+            keep &= (values(f"column:{name}") != 0) == value
+        if min_price:
+            keep &= values("column:price") >= min_price
+        if max_price:
+            keep &= values("column:price") <= max_price
+        if min_bedrooms:
+            keep &= values("column:bedrooms") >= min_bedrooms
+        return keep
+
+    def _row_values(self, rows: np.ndarray, as_of: Optional[int]) -> Callable[[str], np.ndarray]:
+        """Lookup of rows' values by ChangeHistory key, now or at change version as_of"""
+        def current(key: str) -> np.ndarray:
+            if key == "alive":
+                return self.alive[rows].copy()
+            kind, name = key.split(":", 1)
+            if kind == "code":
+                return self.codes[name][rows] if name in self.codes else np.full(len(rows), -1)
+            return self.columns[name][rows]
+
+        if as_of is None:
+            return current
+        entries = self.history.as_of(rows, as_of)
+        logged = entries >= 0
+        created_later = self.created[rows] > as_of
+
+        def past(key: str) -> np.ndarray:
+            values = current(key).copy()
+            values[logged] = self.history.values(key, entries[logged])
+            if key == "alive":
+                values[created_later] = False
+            return values
+        return past
+
+    def composite_score(self, weights: Dict[str, float], mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """Weighted sum of standardized metric columns
+
+        Metrics are z-scored over the rows in mask (or all live rows) so that
+        percentages and dollar amounts can be mixed in one score.
+        """
+        n = self.size
+        population = self.alive[:n] if mask is None else mask
+        score = np.zeros(n, dtype=np.float64)
+        for name, weight in weights.items():
+            column = self.column(name)
+            values = column[population]
+            if not len(values):
+                continue
+            std = values.std()
+            score += weight * ((column - values.mean()) / std if std > 0 else 0)
+        return score
+
+    def top_k(self, scores: np.ndarray, mask: np.ndarray, k: int) -> List[int]:
+        """Rows of the k highest scores within mask, best first
+
+        Uses argpartition so only the k winners are ever sorted.
+        """
+        candidates = np.flatnonzero(mask)
+        if k <= 0 or not len(candidates):
+            return []
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")].tolist()
+
+    def facet_counts(self, mask: Optional[np.ndarray] = None, names: Optional[Iterable[str]] = None) -> Dict[str, List[Dict]]:
+        """Histograms of categorical values, bedrooms and price buckets
+
+        With no mask the categorical counts come straight from the counters
+        maintained on write, so no rows are scanned. Otherwise each facet is a
+        bincount over the codes of the selected rows.
+        """
+        n = self.size
+        facets = {}
+        for name in names if names is not None else self.codes:
+            if mask is None:
+                counts = self.counts[name]
+            else:
+                codes = self.codes[name][:n][mask]
+                counts = np.bincount(codes[codes >= 0], minlength=len(self.labels[name])).tolist()
+            facets[name] = sorted(
+                ({"value": label, "count": count} for label, count in zip(self.labels[name], counts) if count),
+                key=lambda item: -item["count"]
+            )
+
+        selected = self.alive[:n] if mask is None else mask
+        bedrooms, bedroom_counts = np.unique(self.columns["bedrooms"][:n][selected], return_counts=True)
+        facets["bedrooms"] = [{"value": int(value), "count": int(count)} for value, count in zip(bedrooms, bedroom_counts)]
+
+        edges = [edge for edge, _ in PRICE_BUCKETS[:-1]]
+        bucket_counts = np.bincount(np.digitize(self.columns["price"][:n][selected], edges), minlength=len(PRICE_BUCKETS))
+        facets["price_bucket"] = [
+            {"value": label, "count": int(count)} for (_, label), count in zip(PRICE_BUCKETS, bucket_counts)
+        ]
+        return facets
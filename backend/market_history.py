@@ -0,0 +1,311 @@
+"""Per-market daily time series with weekly and monthly rollups
+
+Every day one snapshot per market (median list price, median rent, median
+days on market and the number of live listings) is appended to a log of
+fixed-size records. In memory the history is a dense markets x days matrix
+per metric, NaN where a market has no observation, plus weekly and monthly
+sums and counts rolled up as days are appended, so multi-year queries read a
+few hundred buckets instead of thousands of days. Trends are rolling means
+computed with cumulative sums over the day axis for all markets at once, and
+only over the tail of the history they need.
+
+Several workers can share one log: appends happen under the caller's lock
+and refresh() reads whatever other processes appended since.
+"""
+import json
+import os
+from datetime import date
+from typing import Dict, List, Optional
+
+import numpy as np
+
+METRICS = ("median_price", "median_rent", "median_days_on_market", "listings")
+RECORD = np.dtype([("day", "<i4"), ("market", "<i4")] + [(name, "<f8") for name in METRICS])
+RESOLUTIONS = ("day", "week", "month")
+
+
+def day_number(value: date) -> int:
+    """Days since 1970-01-01"""
+    return value.toordinal() - date(1970, 1, 1).toordinal()
+
+
+def day_date(day: int) -> date:
+    return date.fromordinal(day + date(1970, 1, 1).toordinal())
+
+
+def bucket_of(days, resolution: str):
+    """Week (Monday-based) or calendar month number of day numbers"""
+    days = np.asarray(days)
+    if resolution == "week":
+        # 1970-01-01 was a Thursday
+        return (days + 3) // 7
+    if resolution == "month":
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+    return days
+
+
+def bucket_start(bucket: int, resolution: str) -> date:
+    if resolution == "week":
+        return day_date(bucket * 7 - 3)
+    if resolution == "month":
+        return date(1970 + bucket // 12, bucket % 12 + 1, 1)
+    return day_date(bucket)
+
+
+def group_medians(groups: np.ndarray, values: np.ndarray, count: int) -> np.ndarray:
+    """Median of values per group id in [0, count); NaN for empty groups"""
+    order = np.lexsort((values, groups))
+    groups, values = groups[order], values[order]
+    bounds = np.searchsorted(groups, np.arange(count + 1))
+    sizes = np.diff(bounds)
+    medians = np.full(count, np.nan)
+    present = sizes > 0
+    low = bounds[:-1][present] + (sizes[present] - 1) // 2
+    high = bounds[:-1][present] + sizes[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over window columns, skipping NaN; NaN where a window is empty"""
+    present = ~np.isnan(values)
+    zeros = np.zeros((values.shape[0], 1))
+    sums = np.concatenate([zeros, np.cumsum(np.where(present, values, 0.0), axis=1)], axis=1)
+    counts = np.concatenate([zeros, np.cumsum(present, axis=1)], axis=1)
+    end = np.arange(1, values.shape[1] + 1)
+    start = np.maximum(end - window, 0)
+    count = counts[:, end] - counts[:, start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, (sums[:, end] - sums[:, start]) / count, np.nan)
+
+
+def annual_growth(series: np.ndarray, horizon: int, min_days: int) -> np.ndarray:
+    """Annualized percent change per row between the last value and horizon days earlier
+
+    Rows with less history use their earliest value instead, and rows with
+    fewer than min_days between the two get NaN.
+    """
+    markets, days = series.shape
+    valid = ~np.isnan(series)
+    first = np.where(valid.any(axis=1), valid.argmax(axis=1), days - 1)
+    reference = np.maximum(days - 1 - horizon, first)
+    span = days - 1 - reference
+    rows = np.arange(markets)
+    last, earlier = series[:, -1], series[rows, reference]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        growth = ((last / earlier) ** (365 / np.maximum(span, 1)) - 1) * 100
+    return np.where((span >= min_days) & (earlier > 0), growth, np.nan)
+
+
+class _Rollup:
+    """Sum and count per market and week or month bucket"""
+
+    def __init__(self):
+        self.first: Optional[int] = None
+        self.used = 0
+        self.sums = {name: np.zeros((0, 0)) for name in METRICS}
+        self.counts = {name: np.zeros((0, 0), dtype=np.int32) for name in METRICS}
+
+    def add(self, markets: np.ndarray, buckets: np.ndarray, records: np.ndarray, market_count: int):
+        if self.first is None:
+            self.first = int(buckets.min())
+        columns = buckets - self.first
+        self.used = max(self.used, int(columns.max()) + 1)
+        rows, width = self.sums[METRICS[0]].shape
+        shape = (_grown(rows, market_count, 8), _grown(width, self.used, 16))
+        for name in METRICS:
+            if shape != (rows, width):
+                self.sums[name] = _resized(self.sums[name], shape, 0.0)
+                self.counts[name] = _resized(self.counts[name], shape, 0)
+            values = records[name]
+            present = ~np.isnan(values)
+            np.add.at(self.sums[name], (markets[present], columns[present]), values[present])
+            np.add.at(self.counts[name], (markets[present], columns[present]), 1)
+
+    def means(self, name: str, rows, columns: slice) -> np.ndarray:
+        sums = self.sums[name][rows, columns]
+        counts = self.counts[name][rows, columns]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def _grown(current: int, needed: int, minimum: int) -> int:
+    """Capacity for needed slots, doubling so repeated appends stay amortized O(1)"""
+    return current if needed <= current else max(needed, current * 2, minimum)
+
+
+def _resized(array: np.ndarray, shape, fill) -> np.ndarray:
+    grown = np.full(shape, fill, dtype=array.dtype)
+    grown[:array.shape[0], :array.shape[1]] = array
+    return grown
+
+
+class MarketHistory:
+    """Append-only daily market metrics, optionally persisted to a log file
+
+    Markets are identified by name ("Atlanta, GA"); the name list is kept
+    next to the log as JSON and only ever grows.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.markets: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.first_day: Optional[int] = None
+        self.days = 0
+        self.records = 0
+        self.values = {name: np.full((0, 0), np.nan) for name in METRICS}
+        self.rollups = {"week": _Rollup(), "month": _Rollup()}
+        # Bytes of the log read so far; call refresh() to load it
+        self._offset = 0
+
+    @property
+    def names_path(self) -> str:
+        return f"{self.path}.markets.json"
+
+    @property
+    def last_day(self) -> Optional[int]:
+        return None if self.first_day is None else self.first_day + self.days - 1
+
+    def refresh(self) -> bool:
+        """Load records appended to the log since the last read; True if there were any"""
+        if not self.path:
+            return False
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            return False
+        # A record cut short by a crash mid-append is ignored until completed
+        end = size - size % RECORD.itemsize
+        if end <= self._offset:
+            return False
+        with open(self.names_path) as f:
+            names = json.load(f)
+        for name in names[len(self.markets):]:
+            self._market(name)
+        records = np.fromfile(self.path, dtype=RECORD, count=(end - self._offset) // RECORD.itemsize, offset=self._offset)
+        self._offset = end
+        self._apply(records)
+        return True
+
+    def append(self, day: int, snapshot: Dict[str, Dict[str, float]]):
+        """Add one day's metrics per market; days must be appended in increasing order
+
+        With a shared log the caller must hold the writers' lock.
+        """
+        self.refresh()
+        if self.last_day is not None and day <= self.last_day:
+            raise ValueError(f"Day {day_date(day)} is not after the last recorded day {day_date(self.last_day)}")
+        known = len(self.markets)
+        records = np.zeros(len(snapshot), dtype=RECORD)
+        for i, (name, metrics) in enumerate(snapshot.items()):
+            records[i]["day"] = day
+            records[i]["market"] = self._market(name)
+            for metric in METRICS:
+                records[i][metric] = metrics.get(metric, np.nan)
+        if self.path:
+            if len(self.markets) > known:
+                # Names first, so a reader never sees a record for an unknown market
+                tmp_path = f"{self.names_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(self.markets, f)
+                os.replace(tmp_path, self.names_path)
+            with open(self.path, "ab") as f:
+                # Drop a partial record left by an interrupted append
+                f.truncate(self._offset)
+                f.write(records.tobytes())
+            self._offset += records.nbytes
+        self._apply(records)
+
+    def _market(self, name: str) -> int:
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.markets)
+            self.markets.append(name)
+        return i
+
+    def _apply(self, records: np.ndarray):
+        if not len(records):
+            return
+        days = records["day"].astype(np.int64)
+        markets = records["market"].astype(np.int64)
+        if self.first_day is None:
+            self.first_day = int(days.min())
+        columns = days - self.first_day
+        width = int(columns.max()) + 1
+        rows, capacity = self.values["median_price"].shape
+        shape = (_grown(rows, len(self.markets), 8), _grown(capacity, width, 64))
+        for name in METRICS:
+            if shape != (rows, capacity):
+                self.values[name] = _resized(self.values[name], shape, np.nan)
+            self.values[name][markets, columns] = records[name]
+        for resolution, rollup in self.rollups.items():
+            rollup.add(markets, bucket_of(days, resolution), records, len(self.markets))
+        self.days = max(self.days, width)
+        self.records += len(records)
+
+    def matrix(self, name: str) -> np.ndarray:
+        """markets x days view of one metric"""
+        return self.values[name][:len(self.markets), :self.days]
+
+    def series(self, resolution: str = "month", periods: Optional[int] = None, markets: Optional[List[str]] = None) -> Dict:
+        """Per-market series at a resolution, oldest first, limited to the last periods buckets"""
+        if self.first_day is None:
+            return {"resolution": resolution, "periods": [], "markets": {}}
+        if resolution == "day":
+            start, width = self.first_day, self.days
+        else:
+            rollup = self.rollups[resolution]
+            start, width = rollup.first, rollup.used
+        skip = max(width - periods, 0) if periods else 0
+        columns = slice(skip, width)
+        names = [name for name in (markets if markets is not None else self.markets) if name in self.index]
+        rows = [self.index[name] for name in names]
+        if resolution == "day":
+            tables = {metric: self.values[metric][rows, columns] for metric in METRICS}
+        else:
+            tables = {metric: rollup.means(metric, rows, columns) for metric in METRICS}
+        # Round and convert whole tables at once; NaN (no observation) becomes None
+        tables = {metric: np.round(table, 2).tolist() for metric, table in tables.items()}
+        tables = {metric: [[v if v == v else None for v in row] for row in table] for metric, table in tables.items()}
+        return {
+            "resolution": resolution,
+            "periods": [bucket_start(start + i, resolution).isoformat() for i in range(skip, width)],
+            "markets": {name: {metric: tables[metric][i] for metric in METRICS} for i, name in enumerate(names)},
+        }
+
+    def trends(self, window: int = 30, horizon: int = 365, min_days: int = 60) -> Dict[str, Dict]:
+        """Current metrics and annualized growth per market from window-day rolling means
+
+        Growth compares the latest rolling mean with the one horizon days
+        earlier (or the earliest available) and needs at least min_days of
+        history; markets short of that get no growth figures.
+        """
+        if self.first_day is None:
+            return {}
+        tail = min(self.days, horizon + window)
+        rolled = {name: rolling_mean(self.matrix(name)[:, -tail:], window) for name in METRICS}
+        appreciation = annual_growth(rolled["median_price"], horizon, min_days)
+        rent_growth = annual_growth(rolled["median_rent"], horizon, min_days)
+        inventory_change = annual_growth(rolled["listings"], horizon, min_days)
+        observed = ~np.isnan(self.matrix("median_price"))
+        history_days = self.days - np.where(observed.any(axis=1), observed.argmax(axis=1), self.days)
+
+        trends = {}
+        for i, name in enumerate(self.markets):
+            latest = {metric: rolled[metric][i, -1] for metric in METRICS}
+            if np.isnan(latest["median_price"]):
+                continue
+            market = {
+                "median_price": round(float(latest["median_price"]), 2),
+                "median_rent": round(float(latest["median_rent"]), 2),
+                "days_on_market_avg": round(float(latest["median_days_on_market"])),
+                "listings": round(float(latest["listings"]), 1),
+                "history_days": int(history_days[i]),
+            }
+            if not np.isnan(appreciation[i]):
+                market["appreciation_rate"] = round(float(appreciation[i]), 1)
+                market["rent_growth_rate"] = round(float(rent_growth[i]), 1)
+                market["inventory_change_rate"] = round(float(inventory_change[i]), 1)
+            trends[name] = market
+        return trends
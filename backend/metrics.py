@@ -0,0 +1,264 @@
+"""In-process metrics with Prometheus text exposition
+
+Counters, gauges and histograms keyed by label values, an ASGI middleware
+that times every request by route, and span() for timing stages inside a
+handler. Route-level metrics are always recorded and cost a few dict updates
+per request; stage spans only record on the fraction of requests selected by
+the sample rate, and are a no-op otherwise. Metrics are per process, so with
+several uvicorn workers each one reports its own.
+"""
+import contextvars
+import random
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds; spans sub-millisecond lookups up to multi-second scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NO_SPAN = nullcontext()
+# ASGI scope of the request being handled, for spans to find their route
+_current_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("metrics_scope", default=None)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{labels} {_format_number(value)}" for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    """Monotonically increasing count per label combination"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    """Value that can go up and down, or is read from function at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple, float] = {}
+        self.function = function
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def samples(self):
+        if self.function is not None:
+            return [(self.name, "", self.function())]
+        return [(self.name, _format_labels(self.label_names, key), value) for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    """Bucketed distribution of observations per label combination"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum]
+        self.values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        samples = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_number(bound)}"')
+                samples.append((f"{self.name}_bucket", labels, cumulative))
+            samples.append((f"{self.name}_sum", _format_labels(self.label_names, key), total))
+            samples.append((f"{self.name}_count", _format_labels(self.label_names, key), cumulative))
+        return samples
+
+
+class Registry:
+    """Named collection of metrics rendered together for /metrics"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(
+        self, name: str, documentation: str, labels: Iterable[str] = (), function: Optional[Callable[[], float]] = None
+    ) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(
+        self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def counts(self) -> Dict[Tuple[str, Tuple], float]:
+        """Value of every counter series, keyed by (name, labels)"""
+        counters = (metric for metric in self.metrics.values() if isinstance(metric, Counter))
+        return {(counter.name, labels): value for counter in counters for labels, value in counter.values.items()}
+
+    def counts_since(self, before: Dict[Tuple[str, Tuple], float]) -> Dict[Tuple[str, Tuple], float]:
+        """Counter increments since an earlier counts(), e.g. to send them to another process"""
+        return {key: value - before.get(key, 0) for key, value in self.counts().items() if value != before.get(key, 0)}
+
+    def add_counts(self, counts: Dict[Tuple[str, Tuple], float]):
+        """Apply counts_since() increments from another process to this registry's counters"""
+        for (name, labels), amount in counts.items():
+            self.metrics[name].inc(*labels, amount=amount)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+REQUEST_LATENCY = REGISTRY.histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests currently being handled")
+STAGE_LATENCY = REGISTRY.histogram(
+    "request_stage_duration_seconds", "Time spent in each stage of a sampled request", ("route", "stage")
+)
+
+
+def route_of(scope: dict) -> str:
+    """Path template of the route that handled scope, e.g. /api/properties/{property_id}"""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    app = scope.get("app")
+    routes = getattr(app, "_metrics_routes", None)
+    if routes is None:
+        routes = {}
+        if app is not None:
+            app._metrics_routes = routes
+    path = routes.get(endpoint)
+    if path is None:
+        matching = (route.path for route in getattr(app, "routes", ()) if getattr(route, "endpoint", None) is endpoint)
+        path = next(matching, "unmatched")
+        routes[endpoint] = path
+    return path
+
+
+class _Span:
+    __slots__ = ("scope", "stage", "start")
+
+    def __init__(self, scope: dict, stage: str):
+        self.scope = scope
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        STAGE_LATENCY.observe(time.perf_counter() - self.start, route_of(self.scope), self.stage)
+        return False
+
+
+def span(stage: str):
+    """Context manager timing a stage of the current request, if it is sampled"""
+    scope = _current_scope.get()
+    if scope is None or not scope.get("metrics.sampled"):
+        return _NO_SPAN
+    return _Span(scope, stage)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route request counts and latency
+
+    sample_rate is the fraction of requests whose stage spans are recorded.
+    """
+
+    def __init__(self, app, sample_rate: float = 0.0):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        scope["metrics.sampled"] = self.sample_rate > 0 and random.random() < self.sample_rate
+        token = _current_scope.set(scope)
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec()
+            _current_scope.reset(token)
+            route = route_of(scope)
+            REQUESTS.inc(scope["method"], route, str(status))
+            REQUEST_LATENCY.observe(elapsed, scope["method"], route)
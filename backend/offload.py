@@ -0,0 +1,66 @@
+"""Process pool for CPU-heavy request work
+
+Handlers run on the event loop, so a computation that takes seconds there
+stalls every other request on the worker, health checks included. An
+Offloader sends such work to a pool of worker processes and awaits it, so
+the loop keeps serving while it runs. Starting a task costs a round trip
+between processes plus pickling its arguments and result, so callers only
+offload work above a size threshold, and should pass and return compact
+values (row arrays, encoded bytes) rather than lists of dicts.
+
+Workers are started with "spawn": forking a process that runs an event loop
+and helper threads can copy locks in a held state.
+"""
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _ready():
+    return True
+
+
+class Offloader:
+    """Lazily started process pool; workers=0 disables it"""
+
+    def __init__(self, workers: int, min_rows: int, initializer: Optional[Callable[[], None]] = None):
+        self.workers = workers
+        self.min_rows = min_rows
+        self.initializer = initializer
+        self.pool: Optional[ProcessPoolExecutor] = None
+
+    def wants(self, rows: int) -> bool:
+        """Whether work covering rows listings is worth sending to the pool"""
+        return self.workers > 0 and rows >= self.min_rows
+
+    def start(self) -> ProcessPoolExecutor:
+        """Create the pool, spawning every worker in the background"""
+        if self.pool is None:
+            spawn = multiprocessing.get_context("spawn")
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=spawn, initializer=self.initializer)
+            for _ in range(self.workers):
+                self.pool.submit(_ready)
+        return self.pool
+
+    async def run(self, fn: Callable, *args):
+        """fn(*args) in a pool worker; fn and args must be picklable"""
+        pool = self.start()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory); the next call starts a new pool
+            if self.pool is pool:
+                logger.warning("Process pool broke; replacing it")
+                self.pool = None
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
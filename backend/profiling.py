@@ -0,0 +1,273 @@
+"""Opt-in profiling of live requests
+
+A ProfilingMiddleware wraps the app only when profiling is enabled, so
+normal deployments pay nothing. When it is installed, a request is profiled
+either because it carries an X-Profile header with the admin token, or because
+it was picked by the sampled-traffic settings an admin switched on.
+
+Two modes are available. "cprofile" runs cProfile around the request and
+stores a pstats file. "sampling" polls the event loop thread's stack from a
+background thread and stores collapsed stacks ready for flamegraph.pl or
+speedscope. Both see everything the worker thread does while the request is
+in flight, including other requests interleaved on the same event loop, so
+profiles are cleanest on a quiet worker. Only one request per worker is
+profiled at a time.
+
+Profiles are written to a directory so any worker can serve the download.
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from metrics import route_of
+
+MODES = ("cprofile", "sampling")
+PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class StackSampler(threading.Thread):
+    """Collects the stacks of another thread at a fixed interval"""
+
+    def __init__(self, thread_id: int, interval: float = 0.001):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        # The sampler needs the GIL to look at the other thread; the default
+        # 5ms switch interval would cap it at a fraction of the sample rate
+        self._switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self._switch_interval, self.interval / 2))
+        super().start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed format: one "frame;frame;frame count" line per stack"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Directory of captured profiles, trimmed to the newest keep entries"""
+
+    def __init__(self, directory: str, keep: int = 50):
+        self.directory = directory
+        self.keep = keep
+
+    def path(self, profile_id: str, suffix: str) -> Optional[str]:
+        if not PROFILE_ID_RE.match(profile_id):
+            return None
+        return os.path.join(self.directory, f"{profile_id}.{suffix}")
+
+    def save(self, meta: Dict, files: Dict[str, bytes]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        profile_id = meta["id"]
+        for suffix, data in files.items():
+            with open(self.path(profile_id, suffix), "wb") as f:
+                f.write(data)
+        meta["files"] = sorted(files)
+        # Metadata last: a profile is listed only once its files are complete
+        with open(self.path(profile_id, "json"), "w") as f:
+            json.dump(meta, f)
+        self.trim()
+        return profile_id
+
+    def list(self) -> List[Dict]:
+        """Metadata of stored profiles, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda meta: meta["created"], reverse=True)
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        path = self.path(profile_id, "json")
+        if path is None or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def delete(self, profile_id: str):
+        for suffix in ("json", "pstats", "txt", "collapsed"):
+            path = self.path(profile_id, suffix)
+            if path and os.path.exists(path):
+                os.unlink(path)
+
+    def trim(self):
+        for meta in self.list()[self.keep:]:
+            self.delete(meta["id"])
+
+    def clear(self) -> int:
+        profiles = self.list()
+        for meta in profiles:
+            self.delete(meta["id"])
+        return len(profiles)
+
+
+class Profiler:
+    """Profiling settings for this worker plus the shared profile store
+
+    sample_rate is the fraction of requests profiled in mode, limited to
+    paths starting with path_prefix; sampling switches itself off after
+    remaining more profiles.
+    """
+
+    def __init__(self, store: ProfileStore, token: str, interval: float = 0.001):
+        self.store = store
+        self.token = token
+        self.interval = interval
+        self.mode = "cprofile"
+        self.sample_rate = 0.0
+        self.path_prefix = "/api/"
+        self.remaining = 0
+        self.active = False
+
+    def configure(self, sample_rate: float, mode: str, path_prefix: str, limit: int):
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.path_prefix = path_prefix
+        self.remaining = limit if sample_rate > 0 else 0
+
+    def settings(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "sample_rate": self.sample_rate,
+            "path_prefix": self.path_prefix,
+            "remaining": self.remaining,
+            "interval": self.interval,
+        }
+
+    def authorized(self, token: Optional[str]) -> bool:
+        return bool(token) and secrets.compare_digest(token.encode(), self.token.encode())
+
+    def requested_mode(self, scope: dict) -> Optional[str]:
+        """Mode to profile this request in, or None to let it through untouched"""
+        if self.active:
+            return None
+        header_mode = token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                header_mode = value.decode("latin-1")
+            elif name == b"x-admin-token":
+                token = value.decode("latin-1")
+        if header_mode is not None:
+            return header_mode if header_mode in MODES and self.authorized(token) else None
+        if self.remaining > 0 and scope["path"].startswith(self.path_prefix) and random.random() < self.sample_rate:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.sample_rate = 0.0
+            return self.mode
+        return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles the requests the Profiler selects"""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        mode = self.profiler.requested_mode(scope) if scope["type"] == "http" else None
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        status = 500
+
+        async def send_with_header(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        profile = sampler = None
+        if mode == "cprofile":
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (a debugger, coverage) already owns the hook
+                await self.app(scope, receive, send)
+                return
+        else:
+            sampler = StackSampler(threading.get_ident(), self.profiler.interval)
+            sampler.start()
+        self.profiler.active = True
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            elapsed = time.perf_counter() - start
+            if profile is not None:
+                profile.disable()
+            else:
+                sampler.stop()
+            self.profiler.active = False
+            self._save(profile_id, mode, scope, status, elapsed, profile, sampler)
+
+    def _save(self, profile_id: str, mode: str, scope: dict, status: int, elapsed: float, profile, sampler):
+        meta = {
+            "id": profile_id,
+            "mode": mode,
+            "method": scope["method"],
+            "path": scope["path"],
+            "query": scope.get("query_string", b"").decode("latin-1"),
+            "route": route_of(scope),
+            "status": status,
+            "duration_ms": round(elapsed * 1000, 3),
+            "created": datetime.now().isoformat(),
+            "pid": os.getpid(),
+        }
+        if profile is not None:
+            profile.create_stats()
+            # Serialize first: pstats.Stats takes the stats over from the profile
+            data = marshal.dumps(profile.stats)
+            summary = io.StringIO()
+            pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+            files = {"pstats": data, "txt": summary.getvalue().encode()}
+        else:
+            meta["samples"] = sampler.samples
+            files = {"collapsed": sampler.collapsed().encode()}
+        self.profiler.store.save(meta, files)
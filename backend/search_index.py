@@ -0,0 +1,323 @@
+"""In-process full-text index over the free-text property fields"""
+import math
+import re
+import heapq
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Default cap on how many vocabulary terms a prefix may expand to. Short
+# prefixes such as "a" would otherwise touch most of the postings on every
+# keystroke. Only the most frequent terms are kept, so documents matching the
+# prefix through a rarer term are missed; search reports when that happened.
+MAX_PREFIX_EXPANSIONS = 64
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercase text and split it into alphanumeric tokens"""
+    if not text:
+        return []
+    return TOKEN_RE.findall(text.lower())
+
+
+class SearchResults(NamedTuple):
+    """One page of ranked matches
+
+    ids and scores are the requested page, best first; total counts every
+    match and matches is a boolean mask of them indexed by document id.
+    truncated is set when the final token's prefix expansion hit the cap.
+    """
+
+    ids: np.ndarray
+    scores: np.ndarray
+    total: int
+    matches: np.ndarray
+    truncated: bool = False
+
+
+class SearchIndex:
+    """Inverted index with prefix matching and BM25 ranking
+
+    Documents are keyed by non-negative integer ids (the server uses
+    inventory rows) and can be added, replaced or removed one at a time, so
+    the index never needs a full rebuild when listings change. Postings are
+    kept as dicts for cheap updates and compiled to numpy arrays on first
+    use, and scores live in arrays indexed by id, so scoring a query,
+    applying a candidate mask and picking the top results are all vectorized.
+
+    Internally each document sits in a slot. Slots are the ids themselves
+    until renumber() moves the documents to new ids, after which the index
+    translates between the two.
+    """
+
+    def __init__(
+        self,
+        fields: Iterable[str] = ("address", "description", "listing_agent"),
+        k1: float = 1.2,
+        b: float = 0.75,
+        max_expansions: int = MAX_PREFIX_EXPANSIONS,
+    ):
+        self.fields = tuple(fields)
+        self.k1 = k1
+        self.b = b
+        self.max_expansions = max_expansions
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.vocabulary: List[str] = []
+        self.doc_terms: Dict[int, List[str]] = {}
+        self.lengths = np.zeros(1024, dtype=np.float64)
+        self.size = 0
+        self.total_length = 0
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # Capped expansions of prefixes matching more terms than the cap,
+        # dropped when a document with a term under the prefix changes
+        self._expansions: Dict[str, List[str]] = {}
+        # Id of the document in each slot (-1 for none) and slot of each id,
+        # once renumber() has been called
+        self._ids: Optional[np.ndarray] = None
+        self._slots: Dict[int, int] = {}
+        self._free_slot = 0
+
+    def __len__(self):
+        return len(self.doc_terms)
+
+    def __contains__(self, doc_id):
+        return self._slot_of(doc_id) in self.doc_terms
+
+    def _slot_of(self, doc_id: int) -> Optional[int]:
+        return doc_id if self._ids is None else self._slots.get(doc_id)
+
+    def _slot_for(self, doc_id: int) -> int:
+        """Slot of doc_id, giving a new id the next free one"""
+        if self._ids is None:
+            return doc_id
+        slot = self._slots.get(doc_id)
+        if slot is None:
+            slot = self._slots[doc_id] = self._free_slot
+            self._free_slot += 1
+            if slot >= len(self._ids):
+                self._ids = np.concatenate([self._ids, np.full(max(1024, len(self._ids)), -1, dtype=np.int64)])
+            self._ids[slot] = doc_id
+        return slot
+
+    def _document_tokens(self, doc: Dict) -> List[str]:
+        return tokenize(" ".join(text for text in map(doc.get, self.fields) if text))
+
+    def add(self, doc_id: int, doc: Dict):
+        """Index a document, replacing any previous version with the same id"""
+        self._add(doc_id, doc, insort)
+
+    def extend(self, docs: Iterable[Tuple[int, Dict]]):
+        """Index many (id, document) pairs, sorting the vocabulary once at the end"""
+        # Replaced documents are removed first, while the vocabulary is sorted
+        docs = dict(docs)
+        for doc_id in docs:
+            self.remove(doc_id)
+        terms = len(self.vocabulary)
+        for doc_id, doc in docs.items():
+            self._add(doc_id, doc, list.append)
+        if len(self.vocabulary) > terms:
+            self.vocabulary.sort()
+
+    def _add(self, doc_id: int, doc: Dict, add_term):
+        slot = self._slot_for(doc_id)
+        if slot in self.doc_terms:
+            self._remove(slot)
+
+        tokens = self._document_tokens(doc)
+        term_freqs = Counter(tokens)
+
+        if slot >= len(self.lengths):
+            self.lengths = np.concatenate([self.lengths, np.zeros(max(slot + 1, 2 * len(self.lengths)) - len(self.lengths))])
+        self.size = max(self.size, slot + 1)
+        all_postings = self.postings
+        for term, tf in term_freqs.items():
+            postings = all_postings.get(term)
+            if postings is None:
+                postings = all_postings[term] = {}
+                add_term(self.vocabulary, term)
+            postings[slot] = tf
+        if self._arrays:
+            for term in term_freqs:
+                self._arrays.pop(term, None)
+
+        self.doc_terms[slot] = list(term_freqs)
+        self.lengths[slot] = len(tokens)
+        self.total_length += len(tokens)
+        self._invalidate_expansions(term_freqs)
+
+    def remove(self, doc_id: int):
+        """Drop a document from the index; unknown ids are ignored"""
+        slot = self._slot_of(doc_id)
+        if slot is not None:
+            self._remove(slot)
+
+    def _remove(self, slot: int):
+        terms = self.doc_terms.pop(slot, None)
+        if terms is None:
+            return
+
+        for term in terms:
+            postings = self.postings[term]
+            del postings[slot]
+            self._arrays.pop(term, None)
+            if not postings:
+                del self.postings[term]
+                del self.vocabulary[bisect_left(self.vocabulary, term)]
+
+        self.total_length -= int(self.lengths[slot])
+        self.lengths[slot] = 0
+        self._invalidate_expansions(terms)
+
+    def renumber(self, ids: np.ndarray):
+        """Move the document with each id i to id ids[i], dropping those mapped to -1 or past the end of ids
+
+        Postings keep their slots and only the translation to ids changes,
+        so this stays cheap however large the index is. The new ids must keep
+        the documents in the same order, as compacting dead rows out of the
+        inventory does, so that ties in score still go to the lowest id.
+        """
+        n = self.size
+        current = np.arange(n, dtype=np.int64) if self._ids is None else self._ids[:n]
+        moved = np.full(n, -1, dtype=np.int64)
+        known = (current >= 0) & (current < len(ids))
+        moved[known] = ids[current[known]]
+        for slot in np.flatnonzero(moved < 0).tolist():
+            if slot in self.doc_terms:
+                self._remove(slot)
+        self._ids = moved
+        self._slots = {doc_id: slot for slot, doc_id in enumerate(moved.tolist()) if doc_id >= 0}
+        self._free_slot = n
+
+    def _invalidate_expansions(self, terms: Iterable[str]):
+        if self._expansions:
+            stale = [prefix for prefix in self._expansions if any(term.startswith(prefix) for term in terms)]
+            for prefix in stale:
+                del self._expansions[prefix]
+
+    def _postings_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            postings = self.postings[term]
+            arrays = (
+                np.fromiter(postings.keys(), dtype=np.int64, count=len(postings)),
+                np.fromiter(postings.values(), dtype=np.float64, count=len(postings)),
+            )
+            self._arrays[term] = arrays
+        return arrays
+
+    def _prefix_range(self, prefix: str) -> Tuple[int, int]:
+        """Bounds of the vocabulary slice holding the terms that start with prefix"""
+        return bisect_left(self.vocabulary, prefix), bisect_left(self.vocabulary, prefix + "\uffff")
+
+    def expand_prefix(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """Return vocabulary terms starting with prefix, most frequent first past the cap"""
+        limit = self.max_expansions if limit is None else limit
+        start, end = self._prefix_range(prefix)
+        if end - start <= limit:
+            return self.vocabulary[start:end]
+        terms = self._expansions.get(prefix) if limit == self.max_expansions else None
+        if terms is None:
+            terms = heapq.nlargest(limit, self.vocabulary[start:end], key=lambda t: len(self.postings[t]))
+            if limit == self.max_expansions:
+                self._expansions[prefix] = terms
+        return terms
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """Type-ahead completions for a partial token"""
+        tokens = tokenize(prefix)
+        if not tokens:
+            return []
+        terms = self.expand_prefix(tokens[-1])
+        ranked = heapq.nlargest(limit, terms, key=lambda t: len(self.postings[t]))
+        return [{"term": term, "document_count": len(self.postings[term])} for term in ranked]
+
+    def _idf(self, term: str) -> float:
+        df = len(self.postings[term])
+        n = len(self.doc_terms)
+        return math.log((n - df + 0.5) / (df + 0.5) + 1)
+
+    def search(
+        self,
+        query: str,
+        candidates: Optional[np.ndarray] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        prefix: bool = True,
+    ) -> SearchResults:
+        """Rank documents matching every query token by BM25
+
+        The final token is treated as a prefix unless the query ends in
+        whitespace, which gives search-as-you-type behaviour. candidates, a
+        boolean mask indexed by id, restricts the matches so structured
+        filters can be combined with the text match. Only the page of limit
+        results after offset is ranked (limit=None ranks every match);
+        ties in score go to the lowest id.
+        """
+        n = self.size
+        tokens = tokenize(query)
+        # Each query token becomes a group of index terms; a document matches
+        # the token if it contains any term in the group.
+        groups = [[token] if token in self.postings else [] for token in tokens]
+        truncated = False
+        if groups and prefix and not query[-1].isspace():
+            start, end = self._prefix_range(tokens[-1])
+            truncated = end - start > self.max_expansions
+            groups[-1] = self.expand_prefix(tokens[-1])
+        slot_ids = None if self._ids is None else self._ids[:n]
+        if not groups or any(not group for group in groups):
+            nothing = np.zeros(self._id_count(slot_ids), dtype=bool)
+            return SearchResults(np.zeros(0, dtype=np.int64), np.zeros(0), 0, nothing, truncated)
+
+        lengths = self.lengths[:n]
+        avg_length = self.total_length / len(self.doc_terms)
+        k1, b = self.k1, self.b
+        norms = k1 * (1 - b + b * lengths / avg_length) if avg_length else np.full(n, k1)
+
+        scores = np.zeros(n, dtype=np.float64)
+        matches = None
+        for group in groups:
+            in_group = np.zeros(n, dtype=bool)
+            for term in group:
+                ids, tfs = self._postings_arrays(term)
+                in_group[ids] = True
+                scores[ids] += self._idf(term) * tfs * (k1 + 1) / (tfs + norms[ids])
+            matches = in_group if matches is None else matches & in_group
+        if candidates is not None:
+            allowed = np.zeros(n, dtype=bool)
+            if slot_ids is None:
+                allowed[:min(n, len(candidates))] = candidates[:n]
+            else:
+                known = (slot_ids >= 0) & (slot_ids < len(candidates))
+                allowed[known] = candidates[slot_ids[known]]
+            matches &= allowed
+
+        hits = np.flatnonzero(matches)
+        total = len(hits)
+        k = total if limit is None else min(total, offset + limit)
+        hit_scores = scores[hits]
+        if k == 0:
+            hits, hit_scores = hits[:0], hit_scores[:0]
+        elif k < total:
+            # Everything scoring above the k-th best score, topped up with the
+            # lowest ids among those tied with it
+            threshold = -np.partition(-hit_scores, k - 1)[k - 1]
+            above = hit_scores > threshold
+            tied = np.flatnonzero(hit_scores == threshold)[:k - int(above.sum())]
+            chosen = np.concatenate((np.flatnonzero(above), tied))
+            hits, hit_scores = hits[chosen], hit_scores[chosen]
+        order = np.lexsort((hits, -hit_scores))[offset:k]
+        hits = hits[order]
+        if slot_ids is not None:
+            hits = slot_ids[hits]
+            matched = np.zeros(self._id_count(slot_ids), dtype=bool)
+            matched[slot_ids[matches]] = True
+            matches = matched
+        return SearchResults(hits, hit_scores[order], total, matches, truncated)
+
+    def _id_count(self, ids: Optional[np.ndarray]) -> int:
+        """Length of a mask indexed by id"""
+        return self.size if ids is None else int(ids.max(initial=-1)) + 1
@@ -1,19 +1,105 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
 import os
-from motor.motor_asyncio import AsyncIOMotorClient
 import uuid
 from datetime import datetime, timedelta
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import asyncio
+import functools
 import json
+import logging
+import math
+import secrets
+import time
+from contextlib import asynccontextmanager, nullcontext
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 
-app = FastAPI(title="Real Estate Investment Sourcing API")
+from admission import AdmissionGate, Overloaded, RateLimitMiddleware, RateLimiter
+from coalesce import SingleFlight
+from inventory import Inventory, METRIC_COLUMNS
+from market_history import RESOLUTIONS as HISTORY_RESOLUTIONS, MarketHistory, day_number, group_medians
+from metrics import REGISTRY, MetricsMiddleware, span
+from offload import Offloader
+from profiling import MODES as PROFILE_MODES, ProfileStore, Profiler, ProfilingMiddleware
+from search_index import MAX_PREFIX_EXPANSIONS, SearchIndex
+from snapshot import Snapshot, SnapshotError, SnapshotRows, SnapshotStore
+from subscriptions import SubscriptionHub, encode_event
+
+logger = logging.getLogger(__name__)
+
+# Heavy components (the persisted inventory, the Mongo client, the SMTP and
+# MIME modules, market aggregates, the process pool) are created on first use
+# or in the lifespan hook, so importing this module stays cheap for tests and tools.
+@asynccontextmanager
+async def lifespan(app):
+    """Open the inventory when a worker starts; flush and disconnect when it stops"""
+    global _search_build
+    # Opening may wait on other workers seeding the store
+    await asyncio.get_running_loop().run_in_executor(None, ensure_inventory)
+    _search_build = asyncio.get_running_loop().run_in_executor(None, build_search_index, INVENTORY)
+    if SNAPSHOT_STORE is not None and OFFLOAD.wants(INVENTORY.size):
+        OFFLOAD.start()
+    watcher = asyncio.create_task(watch_listing_changes())
+    recorder = asyncio.create_task(record_market_history_daily())
+    yield
+    watcher.cancel()
+    recorder.cancel()
+    OFFLOAD.shutdown()
+    await flush_inventory_snapshot()
+    if _mongo_client is not None:
+        _mongo_client.close()
+
+app = FastAPI(title="Real Estate Investment Sourcing API", lifespan=lifespan)
+
+# Per-client rate limits by lane, checked before routing: search (listing
+# scans and market aggregates), alerts (writes that send email) and lookup
+# (everything else under /api). Each lane allows RATE_<LANE> requests per
+# second with bursts of RATE_<LANE>_BURST; a rate of 0 turns it off, and every
+# lane is off unless configured. Suggested starting points are lookup 50/100,
+# search 5/20 and alerts 0.1/3. Health, metrics and admin routes are never
+# limited. Clients are told apart by peer address, so behind a reverse proxy
+# or load balancer every request would share one bucket: set
+# TRUSTED_PROXY_HOPS to the number of proxies in front of the app, and
+# CLIENT_IP_HEADER if they record the client somewhere other than
+# X-Forwarded-For. Added before CORS so that 429 responses still carry its headers.
+RATE_LANES = {
+    "/api/properties": "search",
+    "/api/changes": "search",
+    "/api/facets": "search",
+    "/api/deals/top": "search",
+    "/api/market-analysis": "search",
+    "/api/markets": "search",
+    "/api/send-alert": "alerts",
+    "/api/user-criteria": "alerts",
+}
+
+def request_lane(method: str, path: str) -> Optional[str]:
+    """Rate limit lane of a request, or None for routes that are never limited"""
+    lane = RATE_LANES.get(path)
+    if lane is not None:
+        return lane
+    if not path.startswith("/api/") or path == "/api/health" or path.startswith("/api/admin/"):
+        return None
+    return "lookup"
+
+def rate_limiter(lane: str) -> Optional[RateLimiter]:
+    rate = float(os.environ.get(f"RATE_{lane.upper()}", 0))
+    burst = float(os.environ.get(f"RATE_{lane.upper()}_BURST", rate))
+    return RateLimiter(rate, burst) if rate > 0 else None
+
+RATE_LIMITERS = {lane: rate_limiter(lane) for lane in ("lookup", "search", "alerts")}
+RATE_LIMITERS = {lane: limiter for lane, limiter in RATE_LIMITERS.items() if limiter is not None}
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", 0))
+CLIENT_IP_HEADER = os.environ.get("CLIENT_IP_HEADER", "X-Forwarded-For")
+RATE_LIMITED = REGISTRY.counter("rate_limited_total", "Requests refused with 429 by rate limit lane", ("lane",))
+if RATE_LIMITERS:
+    app.add_middleware(
+        RateLimitMiddleware, limiters=RATE_LIMITERS, lane_of=request_lane, client_header=CLIENT_IP_HEADER,
+        proxy_hops=TRUSTED_PROXY_HOPS, on_limited=RATE_LIMITED.inc
+    )
 
 # CORS middleware
 app.add_middleware(
@@ -24,19 +110,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database connection
+# Request metrics for /metrics. Route latency is always recorded; per-stage
+# spans only for the METRICS_SAMPLE_RATE fraction of requests (0 disables).
+METRICS_SAMPLE_RATE = float(os.environ.get("METRICS_SAMPLE_RATE", 0))
+app.add_middleware(MetricsMiddleware, sample_rate=METRICS_SAMPLE_RATE)
+CACHE_REQUESTS = REGISTRY.counter("cache_requests_total", "Lookups against lazily built caches", ("cache", "result"))
+ROWS_SCANNED = REGISTRY.counter("rows_scanned_total", "Inventory rows considered by a request", ("route",))
+ROWS_RETURNED = REGISTRY.counter("rows_returned_total", "Listings returned by a request", ("route",))
+EMAIL_QUEUE = REGISTRY.gauge("email_queue_depth", "Alert emails queued but not yet sent")
+EMAIL_SENDS = REGISTRY.counter("email_send_total", "Alert email attempts by outcome", ("result",))
+EMAIL_LATENCY = REGISTRY.histogram("email_send_duration_seconds", "Time to deliver an alert email over SMTP")
+REGISTRY.gauge("inventory_listings", "Live listings in this worker's inventory", function=lambda: len(INVENTORY))
+REGISTRY.gauge("stream_subscribers", "Open listing streams on this worker", function=lambda: SUBSCRIPTIONS.count)
+STREAM_EVENTS = REGISTRY.counter("stream_events_total", "Listing events queued for stream subscribers", ("type",))
+STREAM_RESYNCS = REGISTRY.counter("stream_resyncs_total", "Stream buffers that overflowed and asked the client to resync")
+
+# Admin-only endpoints require this token in the X-Admin-Token header and are
+# refused entirely when it is unset.
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+
+# On-demand request profiling. Off unless PROFILING=1 and an admin token is
+# configured; when off the middleware is not installed at all.
+PROFILING = os.environ.get("PROFILING", "") not in ("", "0") and bool(ADMIN_TOKEN)
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "profiles"))
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.001))
+PROFILER = Profiler(ProfileStore(PROFILE_DIR), ADMIN_TOKEN, PROFILE_INTERVAL) if PROFILING else None
+if PROFILER is not None:
+    app.add_middleware(ProfilingMiddleware, profiler=PROFILER)
+
+# Database connection, opened on first use
 MONGO_URL = os.environ.get("MONGO_URL")
-if MONGO_URL:
-    client = AsyncIOMotorClient(MONGO_URL)
-    db = client.real_estate_db
-else:
-    client = None
-    db = None
+_mongo_client = None
+
+def mongo_database():
+    """Motor database handle, or None when MONGO_URL is unset"""
+    global _mongo_client
+    if not MONGO_URL:
+        return None
+    if _mongo_client is None:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        _mongo_client = AsyncIOMotorClient(MONGO_URL)
+    return _mongo_client.real_estate_db
 
 # Enhanced mock data with multi-family properties and market data
 MOCK_PROPERTIES = [
     {
-        "id": str(uuid.uuid4()),
+        "id": "8f7dd351-f016-5951-95a9-eaa44fbdeb90",
         "address": "1234 Peachtree St, Atlanta, GA 30309",
         "city": "Atlanta",
         "state": "GA",
@@ -67,7 +186,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "398f468c-5b5c-5f85-b121-004bf0be715c",
         "address": "5678 Desert View Dr, Phoenix, AZ 85016",
         "city": "Phoenix",
         "state": "AZ",
@@ -98,7 +217,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "687a67e7-dcc4-5c77-aa83-ba7c92fb15c4",
         "address": "9012 Maple Ave, Cleveland, OH 44102",
         "city": "Cleveland",
         "state": "OH",
@@ -129,7 +248,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "5c932848-3bec-5c39-955e-f79451f6e45d",
         "address": "3456 Oak Street, Memphis, TN 38104",
         "city": "Memphis",
         "state": "TN",
@@ -160,7 +279,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "6d7e9580-cb5f-5cce-8f30-56f8fd9a2541",
         "address": "7890 Pine Ridge Rd, Jacksonville, FL 32225",
         "city": "Jacksonville",
         "state": "FL",
@@ -191,7 +310,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "45e777f8-4f49-5a91-b958-75b8b3e217eb",
         "address": "2468 Sunset Blvd, Birmingham, AL 35209",
         "city": "Birmingham",
         "state": "AL",
@@ -223,7 +342,7 @@ MOCK_PROPERTIES = [
     },
     # Multi-family properties
     {
-        "id": str(uuid.uuid4()),
+        "id": "97facecb-2ea5-59b8-9cdf-e261172c208f",
         "address": "1122 Duplex Dr, Atlanta, GA 30315",
         "city": "Atlanta",
         "state": "GA",
@@ -255,7 +374,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "8e63b390-55a7-5a32-a699-f656a2d4aaf9",
         "address": "5544 Fourplex Ave, Phoenix, AZ 85021",
         "city": "Phoenix",
         "state": "AZ",
@@ -287,7 +406,7 @@ MOCK_PROPERTIES = [
         }
     },
     {
-        "id": str(uuid.uuid4()),
+        "id": "20990f66-8a01-5725-a2a3-013c0e4bf59d",
         "address": "3388 Triplex Ct, Cleveland, OH 44105",
         "city": "Cleveland",
         "state": "OH",
@@ -338,6 +457,10 @@ class PropertyFilter(BaseModel):
     min_bedrooms: Optional[int] = None
     property_type: Optional[str] = None
     investment_type: Optional[str] = None
+    neighborhood_quality: Optional[str] = None
+    recommendation: Optional[str] = None
+    meets_70_rule: Optional[bool] = None
+    meets_1_percent_rule: Optional[bool] = None
 
 class UserCriteria(BaseModel):
     id: Optional[str] = None
@@ -356,6 +479,12 @@ class DealCalculatorInput(BaseModel):
     repair_costs: float = 0
     arv: Optional[float] = None
 
+class ProfilingSettings(BaseModel):
+    sample_rate: float = 0.0
+    mode: str = "cprofile"
+    path_prefix: str = "/api/"
+    limit: int = 20
+
 class MarketAnalysis(BaseModel):
     city: str
     state: str
@@ -450,120 +579,1076 @@ def calculate_rental_analysis(property_data):
         "recommendation": "Good Rental" if meets_1_percent_rule and cash_on_cash_return > 8 else "Review Required"
     }
 
+def monthly_mortgage_payment(loan_amount, interest_rate, loan_term_years):
+    """Fixed-rate amortized payment for an annual interest rate in percent"""
+    monthly_rate = interest_rate / 100 / 12
+    num_payments = loan_term_years * 12
+    
+    if monthly_rate > 0:
+        growth = (1 + monthly_rate) ** num_payments
+        return loan_amount * (monthly_rate * growth) / (growth - 1)
+    return loan_amount / num_payments
+
+def analyze_listing(property_data):
+    """Run both investment analyses for a listing"""
+    return {
+        "flip_analysis": calculate_flip_analysis(property_data),
+        "rental_analysis": calculate_rental_analysis(property_data)
+    }
+
+def investment_recommendation(analysis, investment_type: Optional[str] = None):
+    """Overall recommendation label for the requested investment strategy"""
+    flip_analysis = analysis["flip_analysis"]
+    rental_analysis = analysis["rental_analysis"]
+    if investment_type == "flip":
+        return flip_analysis["recommendation"]
+    if investment_type == "rental":
+        return rental_analysis["recommendation"]
+    
+    # Both - recommend based on better option
+    flip_good = flip_analysis["meets_70_rule"] and flip_analysis["estimated_roi"] > 15
+    rental_good = rental_analysis["meets_1_percent_rule"] and rental_analysis["cash_on_cash_return"] > 8
+    
+    if flip_good and rental_good:
+        return "Good for Both"
+    elif flip_good:
+        return "Good Flip"
+    elif rental_good:
+        return "Good Rental"
+    return "Review Required"
+
+INVESTMENT_TYPES = ("both", "flip", "rental")
+
+def listing_categories(property_data, analysis):
+    """Recommendation labels per investment type, stored as categorical columns for facets"""
+    return {f"recommendation_{t}": investment_recommendation(analysis, t) for t in INVESTMENT_TYPES}
+
+def listing_with_analysis(row: int, investment_type: Optional[str] = None, **extra):
+    """Response payload for an inventory row with its precomputed analysis"""
+    analysis = INVENTORY.analysis_at(row)
+    return {
+        **INVENTORY.rows[row],
+        **analysis,
+        "investment_recommendation": investment_recommendation(analysis, investment_type),
+        **extra
+    }
+
+# Columnar inventory with analyses precomputed at write time
+INVENTORY = Inventory(analyze_listing, listing_categories)
+
+# Full-text index over the free-text listing fields, keyed by row. Workers
+# build it on a background thread at startup, and searches re-index just the
+# rows changed since it was last brought up to date, whether written locally
+# or picked up from another worker's snapshot. A prefix expands to at most
+# SEARCH_PREFIX_EXPANSIONS of its most frequent terms; responses say when
+# more were dropped. Full-text results come in pages of SEARCH_PAGE_SIZE.
+SEARCH_PREFIX_EXPANSIONS = int(os.environ.get("SEARCH_PREFIX_EXPANSIONS", MAX_PREFIX_EXPANSIONS))
+SEARCH_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+SEARCH_INDEX = None
+# Compaction and change version of the inventory the index reflects, and
+# the version each of its rows was created at
+_indexed_compaction = 0
+_indexed_version = 0
+_indexed_created = None
+# Future of a full index build running on a worker thread (the one started
+# at startup, or after the inventory was replaced), until a search picks it up
+_search_build = None
+
+# The inventory is persisted as versioned memory-mapped snapshots in
+# SNAPSHOT_DIR (set it empty to disable). Startup maps the latest snapshot
+# instead of rebuilding from MOCK_PROPERTIES. A single worker writes new
+# snapshots in the background after changes; with several uvicorn workers
+# every write is published before it returns so the other workers can swap
+# it in; writes arriving within SHARED_WRITE_DELAY seconds of each other, or
+# while the previous batch is being published, share one hold of the store
+# lock and one published version. Snapshot writes and the store lock are
+# kept off the event loop. Once
+# enough listings removed before the change history's horizon pile up, a
+# snapshot is written without their dead rows and replaces the inventory.
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", 1))
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+SNAPSHOT_DELAY = float(os.environ.get("SNAPSHOT_DELAY", 1.0))
+SHARED_WRITE_DELAY = float(os.environ.get("SHARED_WRITE_DELAY", 0.05))
+SNAPSHOT_STORE = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+SHARED_SNAPSHOTS = SNAPSHOT_STORE is not None and WORKERS > 1
+_pending_snapshot = None
+# Shared writes waiting for the next publish, as (write, args, future), and
+# the task publishing them
+_shared_writes = []
+_shared_flush = None
+_inventory_opened = False
+# (inventory, change version, path) of the last snapshot this worker published
+_published = None
+
+def search_documents(inventory, fields):
+    """(row, text fields) for every live row of inventory
+    
+    Rows still as they were in the snapshot are read a column at a time
+    from its string table instead of decoding each listing. Rows removed
+    while this runs on a worker thread are skipped; their removal is newer
+    than the version the caller recorded, so it is applied afterwards.
+    """
+    live = np.flatnonzero(inventory.alive[:inventory.size]).tolist()
+    rows = inventory.rows
+    snapshot = inventory.snapshot
+    kinds = {field["name"]: field["kind"] for field in snapshot.fields} if snapshot is not None else {}
+    if not isinstance(rows, SnapshotRows) or any(kinds.get(field) != "str" for field in fields):
+        documents = ((row, rows[row]) for row in live)
+    else:
+        columns = [snapshot.strings(field) for field in fields]
+        dirty = set(rows.dirty)
+        def document(row):
+            if row in dirty or row >= snapshot.size:
+                return rows[row]
+            return {field: column[row] for field, column in zip(fields, columns)}
+        documents = ((row, document(row)) for row in live)
+    return [(row, document) for row, document in documents if document is not None]
+
+def build_search_index(inventory):
+    """A search index over inventory's live rows, with the compaction, change version and row creation versions it reflects
+    
+    Safe to run on a worker thread while the loop keeps writing: rows written
+    meanwhile are newer than the returned version and get re-indexed.
+    """
+    compacted_at, version, size = inventory.compacted_at, inventory.version, inventory.size
+    created = inventory.created[:size]
+    index = SearchIndex(max_expansions=SEARCH_PREFIX_EXPANSIONS)
+    index.extend(search_documents(inventory, index.fields))
+    return index, compacted_at, version, created
+
+def compacted_search_rows():
+    """Row each row of the indexed inventory has in INVENTORY since it was compacted (-1 if dropped), or None
+    
+    Rows are created one change version apart, so a row is found again by
+    the version it was created at. None if the indexed inventory predates
+    the change log and had none recorded.
+    """
+    created = _indexed_created
+    if created is None or not np.all(np.diff(created) > 0):
+        return None
+    current = INVENTORY.created[:INVENTORY.size]
+    old_rows = np.searchsorted(created, current)
+    found = old_rows < len(created)
+    found[found] = created[old_rows[found]] == current[found]
+    renumber = np.full(len(created), -1, dtype=np.int64)
+    renumber[old_rows[found]] = np.flatnonzero(found)
+    return renumber
+
+def search_index_outdated() -> bool:
+    """Whether the search index needs a full build to reflect the inventory
+    
+    It does if it was never built or the inventory was replaced by an
+    unrelated one. A compaction only renumbers its rows.
+    """
+    if SEARCH_INDEX is None or INVENTORY.version < _indexed_version:
+        return True
+    return INVENTORY.compacted_at != _indexed_compaction and compacted_search_rows() is None
+
+def search_index():
+    """Full-text index over the current inventory, keyed by row"""
+    global SEARCH_INDEX, _indexed_compaction, _indexed_version, _indexed_created
+    CACHE_REQUESTS.inc("search_index", "miss" if SEARCH_INDEX is None else "hit")
+    if search_index_outdated():
+        SEARCH_INDEX, _indexed_compaction, _indexed_version, _indexed_created = build_search_index(INVENTORY)
+        return SEARCH_INDEX
+    if INVENTORY.compacted_at != _indexed_compaction:
+        SEARCH_INDEX.renumber(compacted_search_rows())
+        _indexed_compaction = INVENTORY.compacted_at
+    if INVENTORY.version > _indexed_version:
+        rows = INVENTORY.changed_rows(_indexed_version)
+        alive = INVENTORY.alive[rows]
+        for row in rows[~alive].tolist():
+            SEARCH_INDEX.remove(row)
+        SEARCH_INDEX.extend((row, INVENTORY.rows[row]) for row in rows[alive].tolist())
+        _indexed_version = INVENTORY.version
+    _indexed_created = INVENTORY.created[:INVENTORY.size]
+    return SEARCH_INDEX
+
+async def ready_search_index():
+    """search_index(), without building it on the event loop
+    
+    A full build runs on a worker thread, and searches wait for it there
+    instead of blocking every other request. The loop only builds it itself
+    if that fails.
+    """
+    global SEARCH_INDEX, _indexed_compaction, _indexed_version, _indexed_created, _search_build
+    while True:
+        if _search_build is None:
+            if not search_index_outdated():
+                return search_index()
+            _search_build = asyncio.get_running_loop().run_in_executor(None, build_search_index, INVENTORY)
+        build = _search_build
+        try:
+            index = await build
+        except Exception:
+            logger.exception("Background search index build failed")
+            index = None
+        if _search_build is build:
+            _search_build = None
+            if index is None:
+                return search_index()
+            SEARCH_INDEX, _indexed_compaction, _indexed_version, _indexed_created = index
+
+def attach_snapshot():
+    """Swap in the latest published snapshot as this worker's inventory"""
+    global INVENTORY
+    snapshot = SNAPSHOT_STORE.open()
+    if snapshot is None:
+        return
+    if INVENTORY.snapshot is None or INVENTORY.snapshot.version != snapshot.version:
+        INVENTORY = open_inventory_snapshot(snapshot)
+
+def open_inventory_snapshot(snapshot) -> Inventory:
+    """Inventory over a mapped snapshot"""
+    return Inventory.from_snapshot(snapshot, analyze_listing, listing_categories)
+
+def publish_snapshot(inventory, source=None):
+    """Write inventory (a frozen copy of source, if given) as the next snapshot version
+    
+    Returns the published version mapped as an inventory if dead rows were
+    compacted out of it, since its rows then no longer line up with
+    source's, and None otherwise.
+    """
+    global _published
+    with SNAPSHOT_STORE.lock():
+        version = SNAPSHOT_STORE.publish(inventory, compact=True)
+        snapshot = Snapshot(SNAPSHOT_STORE.path_for(version))
+    if snapshot.header["compacted_at"] != inventory.compacted_at:
+        return open_inventory_snapshot(snapshot)
+    _published = (source or inventory, inventory.version, snapshot.path)
+    return None
+
+async def publish_inventory_snapshot(frozen=None):
+    """Publish a frozen copy of the inventory (frozen, if already taken) from a worker thread
+    
+    A compacted snapshot replaces the inventory unless it was written to
+    meanwhile; the next snapshot then tries again.
+    """
+    global INVENTORY
+    source = INVENTORY
+    frozen = frozen or source.freeze()
+    compacted = await asyncio.get_running_loop().run_in_executor(None, publish_snapshot, frozen, source)
+    if compacted is not None and INVENTORY is source and source.version == frozen.version:
+        INVENTORY = compacted
+
+async def publish_snapshot_in_background():
+    """Serialize a frozen copy of the inventory on a worker thread"""
+    global _pending_snapshot
+    _pending_snapshot = None
+    await publish_inventory_snapshot()
+
+def schedule_snapshot():
+    """Persist the inventory SNAPSHOT_DELAY seconds after the first unsaved write"""
+    global _pending_snapshot
+    if _pending_snapshot is None:
+        loop = asyncio.get_running_loop()
+        _pending_snapshot = loop.call_later(SNAPSHOT_DELAY, lambda: asyncio.ensure_future(publish_snapshot_in_background()))
+
+def write_shared_snapshot(writes):
+    """Apply each write(inventory, *args) in writes to the latest published version and publish the result once
+    
+    Blocks on the store lock, so that writes from every worker land on top
+    of each other; run it on a worker thread. Returns the inventory mapped
+    from the new version and each write's result, or the exception it
+    raised. A write that raises is left out: the ones before it are applied
+    again to a fresh copy, so nothing it half did gets published.
+    """
+    with SNAPSHOT_STORE.lock():
+        snapshot = SNAPSHOT_STORE.open(mark_seen=False)
+        def latest():
+            return open_inventory_snapshot(snapshot) if snapshot is not None else Inventory(analyze_listing, listing_categories)
+        inventory = latest()
+        version = inventory.version
+        applied, results = [], []
+        for write, args in writes:
+            try:
+                results.append(write(inventory, *args))
+                applied.append((write, args))
+            except Exception as e:
+                results.append(e)
+                inventory = latest()
+                for write, args in applied:
+                    write(inventory, *args)
+        if inventory.version == version:
+            # Nothing changed (e.g. removing an unknown id)
+            return inventory, results
+        version = SNAPSHOT_STORE.publish(inventory, compact=True)
+        published = open_inventory_snapshot(Snapshot(SNAPSHOT_STORE.path_for(version)))
+    return published, results
+
+async def publish_shared_writes():
+    """Publish queued shared writes in batches until none are left, settling each write's future"""
+    global INVENTORY, _shared_writes, _shared_flush
+    try:
+        while _shared_writes:
+            await asyncio.sleep(SHARED_WRITE_DELAY)
+            batch, _shared_writes = _shared_writes, []
+            try:
+                published, results = await asyncio.get_running_loop().run_in_executor(
+                    None, write_shared_snapshot, [(write, args) for write, args, _ in batch]
+                )
+            except Exception as e:
+                results = [e] * len(batch)
+            else:
+                current = INVENTORY.snapshot
+                if published.snapshot is not None and (current is None or current.version < published.snapshot.version):
+                    INVENTORY = published
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+    finally:
+        _shared_flush = None
+
+async def write_shared(write, args):
+    """Queue a write for the next shared publish; returns its result once it is published"""
+    global _shared_flush
+    future = asyncio.get_running_loop().create_future()
+    _shared_writes.append((write, args, future))
+    if _shared_flush is None:
+        _shared_flush = asyncio.ensure_future(publish_shared_writes())
+    return await future
+
+async def write_inventory(write, *args):
+    """Apply write(inventory, *args) as an inventory write that gets persisted; returns its result
+    
+    With shared snapshots the write is batched with any others made around
+    the same time, applied on top of the latest version and published on a
+    worker thread, and this worker swaps in the published version before it
+    returns; otherwise it is applied in place and a background snapshot is
+    scheduled.
+    """
+    ensure_inventory()
+    if SHARED_SNAPSHOTS:
+        result = await write_shared(write, args)
+    else:
+        result = write(INVENTORY, *args)
+        if SNAPSHOT_STORE is not None:
+            schedule_snapshot()
+    notify_listing_changes()
+    return result
+
+async def upsert_property(property_data):
+    """Insert or replace a listing"""
+    await write_inventory(Inventory.upsert, property_data)
+    return property_data
+
+async def remove_property(property_id: str):
+    """Remove a listing, returning it if it existed"""
+    return await write_inventory(Inventory.remove, property_id)
+
+async def load_properties(properties):
+    """Bulk-load listings into the inventory"""
+    await write_inventory(Inventory.extend, properties)
+
+def open_inventory():
+    """Map the latest persisted snapshot, seeding it from MOCK_PROPERTIES on first run
+    
+    An unreadable latest version is moved aside and the newest readable one
+    still on disk is used instead. With none left the worker refuses to
+    start rather than replace persisted listings with the seed data.
+    """
+    if SNAPSHOT_STORE is None:
+        INVENTORY.extend(MOCK_PROPERTIES)
+        return
+    # Under the lock so that only the first of several workers seeds it
+    with SNAPSHOT_STORE.lock():
+        try:
+            if SNAPSHOT_STORE.current_version() or SNAPSHOT_STORE.versions():
+                attach_snapshot()
+                if INVENTORY.snapshot is None:
+                    raise SnapshotError(f"{SNAPSHOT_STORE.current_path} is missing")
+                return
+        except SnapshotError as e:
+            logger.error("Inventory snapshot is unreadable: %s", e)
+            version = SNAPSHOT_STORE.recover()
+            if version is None:
+                raise SnapshotError(
+                    f"No readable inventory snapshot left in {SNAPSHOT_DIR} (unreadable ones were renamed *.corrupt); "
+                    "restore one or remove the directory to reseed"
+                ) from e
+            logger.warning("Recovered the inventory from snapshot version %d", version)
+            attach_snapshot()
+            return
+        INVENTORY.extend(MOCK_PROPERTIES)
+        SNAPSHOT_STORE.publish(INVENTORY)
+        attach_snapshot()
+
+def ensure_inventory():
+    """Open the inventory the first time anything needs it"""
+    global _inventory_opened
+    if not _inventory_opened:
+        _inventory_opened = True
+        open_inventory()
+
+class InventoryRefreshMiddleware:
+    """Pick up snapshots published by other workers before handling a request
+    
+    Plain ASGI rather than @app.middleware("http"), which would wrap every
+    response (long-lived listing streams included) in extra tasks and buffers.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            ensure_inventory()
+            if SHARED_SNAPSHOTS:
+                changed = SNAPSHOT_STORE.changed()
+                CACHE_REQUESTS.inc("snapshot", "miss" if changed else "hit")
+                if changed:
+                    attach_snapshot()
+        await self.app(scope, receive, send)
+
+app.add_middleware(InventoryRefreshMiddleware)
+
+async def flush_inventory_snapshot(frozen=None):
+    """Write any change still waiting for its background snapshot
+    
+    frozen, if given, is a copy of the inventory as it is now to publish.
+    """
+    global _pending_snapshot
+    if _pending_snapshot is not None:
+        _pending_snapshot.cancel()
+        _pending_snapshot = None
+        await publish_inventory_snapshot(frozen)
+
+def recommendation_column(investment_type: Optional[str] = None):
+    """Categorical column holding the recommendation label for an investment type"""
+    return f"recommendation_{investment_type if investment_type in INVESTMENT_TYPES else 'both'}"
+
+def listing_mask(criteria: PropertyFilter):
+    """Row mask for the listing filters shared by the search endpoints
+    
+    Categorical filters accept comma-separated values (any of) and a "!"
+    prefix to exclude a value; they are evaluated on the bitmap indexes.
+    """
+    categories, flags = listing_predicates(criteria)
+    return INVENTORY.filter_mask(
+        criteria.min_price, criteria.max_price, criteria.city, criteria.state, criteria.min_bedrooms, criteria.property_type,
+        categories, flags
+    )
+
+def listing_predicates(criteria: PropertyFilter):
+    """Categorical and flag predicates for the analysis-derived listing filters"""
+    categories = {"neighborhood_quality": criteria.neighborhood_quality}
+    if criteria.recommendation:
+        categories[recommendation_column(criteria.investment_type)] = criteria.recommendation
+    flags = {"meets_70_rule": criteria.meets_70_rule, "meets_1_percent_rule": criteria.meets_1_percent_rule}
+    return categories, flags
+
+def listing_matches(rows, criteria: PropertyFilter, as_of: Optional[int] = None):
+    """Which of rows match a filter (as they were at change version as_of, if given), without scanning the inventory"""
+    categories, flags = listing_predicates(criteria)
+    return INVENTORY.filter_rows(
+        rows, criteria.min_price, criteria.max_price, criteria.city, criteria.state, criteria.min_bedrooms,
+        criteria.property_type, categories, flags, as_of=as_of
+    )
+
+async def search_rows(mask, q: str, limit: Optional[int] = None, offset: int = 0):
+    """Rank the rows selected by mask against a full-text query
+    
+    Returns the SearchResults page (limit rows after offset, best first) and
+    mask narrowed to every matching row.
+    """
+    results = (await ready_search_index()).search(q, candidates=mask, limit=limit, offset=offset)
+    matches = results.matches[:len(mask)]
+    narrowed = np.zeros_like(mask)
+    narrowed[:len(matches)] = matches
+    return results, narrowed
+
+def listing_facets(mask, investment_type: Optional[str] = None):
+    """Facet histograms for the rows in mask; pass None to count the whole inventory"""
+    recommendation = recommendation_column(investment_type)
+    facets = INVENTORY.facet_counts(mask, ("city", "state", "property_type", "neighborhood_quality", recommendation))
+    facets["investment_recommendation"] = facets.pop(recommendation)
+    return facets
+
+def listing_payloads(rows, investment_type: Optional[str] = None, scores=None):
+    """Listings with analysis for rows, counting how many analyses were cached"""
+    computed = INVENTORY.lazy_analyses
+    if scores is None:
+        payloads = [listing_with_analysis(row, investment_type) for row in rows]
+    else:
+        payloads = [listing_with_analysis(row, investment_type, search_score=round(score, 4)) for row, score in zip(rows, scores)]
+    computed = INVENTORY.lazy_analyses - computed
+    if computed:
+        CACHE_REQUESTS.inc("analysis", "miss", amount=computed)
+    CACHE_REQUESTS.inc("analysis", "hit", amount=len(payloads) - computed)
+    return payloads
+
+def json_response(content):
+    """Render a handler result as JSON, timed as the serialization stage
+    
+    Payloads here are plain dicts, lists and numbers, so they skip FastAPI's
+    generic encoder and go straight to json.dumps.
+    """
+    with span("serialization"):
+        return JSONResponse(content)
+
+# Admission control for the expensive read endpoints: at most ADMISSION_LIMIT
+# computations run at once, ADMISSION_QUEUE more wait up to ADMISSION_TIMEOUT
+# seconds for a turn, and the rest are shed with 503. Requests sharing a
+# computation through the single-flight layer below take one slot between them.
+ADMISSION = AdmissionGate(
+    int(os.environ.get("ADMISSION_LIMIT", 8)),
+    int(os.environ.get("ADMISSION_QUEUE", 64)),
+    float(os.environ.get("ADMISSION_TIMEOUT", 10.0)),
+)
+ADMISSION_SHED = REGISTRY.counter("admission_shed_total", "Expensive requests refused by admission control", ("reason",))
+REGISTRY.gauge("admission_active", "Expensive computations running", function=lambda: ADMISSION.active)
+REGISTRY.gauge("admission_waiting", "Expensive computations waiting for admission", function=lambda: ADMISSION.waiting)
+
+async def admitted(compute):
+    """Await compute() once admission control lets it start; 503 if it is shed"""
+    try:
+        async with ADMISSION.slot():
+            return await compute()
+    except Overloaded as e:
+        ADMISSION_SHED.inc(e.reason)
+        headers = {"Retry-After": str(math.ceil(ADMISSION.timeout / 2))}
+        raise HTTPException(status_code=503, detail="Server busy, retry shortly", headers=headers)
+
+# Single-flight for the expensive read endpoints: identical requests in flight
+# together share one computation, and for COALESCE_WINDOW seconds after it
+# finishes, identical requests against the same inventory version get its
+# result instead of recomputing it (0 shares only in-flight computations).
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", 0.5))
+COALESCED = REGISTRY.counter(
+    "coalesced_requests_total", "Expensive requests by whether they computed or shared a result", ("result",)
+)
+FLIGHTS = SingleFlight(COALESCE_WINDOW, observe=COALESCED.inc)
+
+def request_key(params: Dict) -> tuple:
+    """Hashable, order-independent form of a handler's parameters; unset ones are left out"""
+    items = []
+    for name, value in params.items():
+        if isinstance(value, BaseModel):
+            value = json.dumps(value.dict(), sort_keys=True, default=str)
+        if value is not None:
+            items.append((name, value))
+    return tuple(sorted(items))
+
+def shared_response(result):
+    """A response of its own for each caller sharing a result
+    
+    Middleware adds headers to a response in place, so callers must not be
+    handed the same Response object.
+    """
+    if not isinstance(result, Response):
+        return result
+    response = Response(result.body, result.status_code, media_type=result.media_type)
+    response.raw_headers = list(result.raw_headers)
+    return response
+
+def coalesced(route: str, extra=None):
+    """Share one computation between identical requests to an endpoint
+    
+    Requests are identical when they have the same parameters and see the
+    same inventory version; extra, if given, returns any other state the
+    result depends on. The computation runs under admission control. The
+    handler's signature is kept for FastAPI.
+    """
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def wrapper(**params):
+            key = (route, INVENTORY.version, extra() if extra is not None else None, request_key(params))
+            return shared_response(await FLIGHTS.run(key, lambda: admitted(lambda: handler(**params))))
+        return wrapper
+    return decorate
+
+# CPU-heavy request work (listing payloads with their analyses, market
+# aggregation, rendering large responses) runs in a pool of OFFLOAD_WORKERS
+# processes when it covers at least OFFLOAD_MIN_ROWS listings, so the event
+# loop stays free for other requests. Pool workers map the published snapshot
+# holding the current inventory rather than receiving listings, and send back
+# the rendered body. Changes still waiting for their background snapshot are
+# published first. The work runs inline when the pool is off (0 workers),
+# persistence is off, or no snapshot matches the inventory. The pool
+# is spawned at startup only if the inventory already holds OFFLOAD_MIN_ROWS
+# listings, and otherwise on the first request big enough to use it, so small
+# deployments and tests never start worker processes.
+OFFLOAD_WORKERS = int(os.environ.get("OFFLOAD_WORKERS", 2))
+OFFLOAD_MIN_ROWS = int(os.environ.get("OFFLOAD_MIN_ROWS", 2000))
+OFFLOADED = REGISTRY.counter("offload_calls_total", "Heavy request work by where it ran", ("where",))
+
+def offload_worker_start():
+    """Pool worker initializer: the worker only reads snapshots it is given"""
+    global _inventory_opened
+    _inventory_opened = True
+
+OFFLOAD = Offloader(OFFLOAD_WORKERS, OFFLOAD_MIN_ROWS, offload_worker_start)
+
+def published_snapshot(inventory=None, version: Optional[int] = None) -> Optional[str]:
+    """Path of a published snapshot holding exactly inventory (the current one) as of version, if any"""
+    if SNAPSHOT_STORE is None:
+        return None
+    inventory = INVENTORY if inventory is None else inventory
+    version = inventory.version if version is None else version
+    snapshot = inventory.snapshot
+    if snapshot is not None and snapshot.header.get("change_version", 0) == version:
+        return snapshot.path
+    if _published is not None and _published[0] is inventory and _published[1] == version:
+        return _published[2]
+    return None
+
+def render_in_worker(path: str, fn, *args):
+    """Run in a pool worker: JSON body of fn(*args) over the snapshot at path, and the counters it bumped"""
+    global INVENTORY
+    if INVENTORY.snapshot is None or INVENTORY.snapshot.path != path:
+        INVENTORY = open_inventory_snapshot(Snapshot(path))
+    counts = REGISTRY.counts()
+    body = json_response(fn(*args)).body
+    return body, REGISTRY.counts_since(counts)
+
+def render_inline(inventory, fn, *args):
+    """json_response(fn(*args)) with fn reading inventory as INVENTORY"""
+    global INVENTORY
+    current, INVENTORY = INVENTORY, inventory
+    try:
+        return json_response(fn(*args))
+    finally:
+        INVENTORY = current
+
+async def offload_json(rows: int, fn, *args):
+    """json_response(fn(*args)), computed in the process pool when it covers rows listings
+    
+    fn must be a module-level function reading the inventory through INVENTORY.
+    Unpublished changes are published from a frozen copy first and the pool
+    renders that; if it cannot, the copy is rendered here instead.
+    """
+    inventory = INVENTORY
+    path = None
+    if OFFLOAD.wants(rows):
+        path = published_snapshot()
+        if path is None and _pending_snapshot is not None:
+            source, inventory = inventory, inventory.freeze()
+            await flush_inventory_snapshot(inventory)
+            path = published_snapshot(source, inventory.version)
+    if path is not None:
+        try:
+            with span("offload"):
+                body, counts = await OFFLOAD.run(render_in_worker, path, fn, *args)
+        except (BrokenProcessPool, OSError) as e:
+            # e.g. the snapshot was pruned before the worker mapped it
+            logger.warning("Running %s inline: %s", fn.__name__, e)
+        else:
+            REGISTRY.add_counts(counts)
+            OFFLOADED.inc("pool")
+            return Response(body, media_type="application/json")
+    OFFLOADED.inc("inline")
+    return render_inline(inventory, fn, *args)
+
+def listings_content(content: Dict, investment_type: Optional[str], listings: Dict) -> Dict:
+    """content with each key of listings, a (rows, scores) pair, filled in with those listings"""
+    with span("analysis"):
+        for key, (rows, scores) in listings.items():
+            content[key] = listing_payloads(rows.tolist(), investment_type, scores)
+    return content
+
+# Listing streams (Server-Sent Events): each subscriber gets new and repriced
+# listings matching its filter. One watcher task per worker wakes on local
+# writes, polls for snapshots published by other workers every STREAM_POLL
+# seconds, and sends keepalives every STREAM_KEEPALIVE seconds. Each stream
+# buffers at most STREAM_BUFFER events, and a worker accepts STREAM_LIMIT streams.
+STREAM_BUFFER = int(os.environ.get("STREAM_BUFFER", 100))
+STREAM_LIMIT = int(os.environ.get("STREAM_LIMIT", 10000))
+STREAM_POLL = float(os.environ.get("STREAM_POLL", 1.0))
+STREAM_KEEPALIVE = float(os.environ.get("STREAM_KEEPALIVE", 15.0))
+SUBSCRIPTIONS = SubscriptionHub(STREAM_BUFFER, STREAM_LIMIT)
+_listings_changed = asyncio.Event()
+# (inventory, change version, price per row) as of the last broadcast, while anyone is subscribed
+_stream_state = None
+
+def notify_listing_changes():
+    """Wake the stream watcher after an inventory write"""
+    _listings_changed.set()
+
+def ensure_stream_state():
+    """Start tracking prices from the current version before the first subscriber is added"""
+    global _stream_state
+    if _stream_state is None:
+        _stream_state = (INVENTORY, INVENTORY.version, INVENTORY.column("price").copy())
+
+def broadcast_listing_changes():
+    """Queue the listings created or repriced since the last broadcast for matching subscribers"""
+    global _stream_state
+    if not SUBSCRIPTIONS.count:
+        _stream_state = None
+        return
+    if _stream_state is None:
+        ensure_stream_state()
+        return
+    inventory = INVENTORY
+    version = inventory.version
+    tracked, since, prices = _stream_state
+    if version < since:
+        # A different inventory (reseeded snapshot); start over from here
+        _stream_state = None
+        ensure_stream_state()
+        return
+    if version == since:
+        return
+    
+    rows = inventory.changed_rows(since)
+    rows = rows[inventory.alive[rows]]
+    current = inventory.column("price")[rows]
+    new = inventory.created[rows] > since
+    renumbered = inventory.compacted_at != tracked.compacted_at
+    if renumbered:
+        # A compaction renumbered the rows; find the listings' old rows by id
+        old_rows = (tracked.row_for(inventory.rows[row]["id"]) for row in rows.tolist())
+        old_rows = np.array([-1 if row is None else row for row in old_rows], dtype=np.int64)
+    else:
+        old_rows = rows
+    known = ~new & (old_rows >= 0) & (old_rows < len(prices))
+    repriced = np.zeros(len(rows), dtype=bool)
+    repriced[known] = current[known] != prices[old_rows[known]]
+    previous = {row: float(prices[old]) for row, old in zip(rows[repriced].tolist(), old_rows[repriced].tolist())}
+    if renumbered:
+        prices = inventory.column("price").copy()
+    else:
+        if inventory.size > len(prices):
+            prices = np.concatenate([prices, np.zeros(inventory.size - len(prices))])
+        prices[rows] = current
+    _stream_state = (inventory, version, prices)
+    
+    pushed = rows[new | repriced]
+    frames = {}
+    overflows = 0
+    for key in list(SUBSCRIPTIONS.groups):
+        criteria = PropertyFilter(**dict(key))
+        investment_type = criteria.investment_type
+        batch = []
+        for row in pushed[listing_matches(pushed, criteria)].tolist():
+            frame = frames.get((row, investment_type))
+            if frame is None:
+                event = {"type": "repriced" if row in previous else "new", "listing": listing_with_analysis(row, investment_type)}
+                if row in previous:
+                    event["previous_price"] = previous[row]
+                frame = frames[(row, investment_type)] = encode_event("listing", event, int(inventory.versions[row]))
+            batch.append((frame, int(inventory.versions[row])))
+        if batch:
+            STREAM_EVENTS.inc("listing", amount=len(batch) * len(SUBSCRIPTIONS.groups[key]))
+            overflows += SUBSCRIPTIONS.publish(key, batch)
+    SUBSCRIPTIONS.advance(version)
+    if overflows:
+        STREAM_RESYNCS.inc(amount=overflows)
+
+async def watch_listing_changes():
+    """Push listing changes to stream subscribers and keep idle streams alive"""
+    loop = asyncio.get_running_loop()
+    next_keepalive = loop.time() + STREAM_KEEPALIVE
+    while True:
+        try:
+            await asyncio.wait_for(_listings_changed.wait(), STREAM_POLL)
+        except asyncio.TimeoutError:
+            pass
+        _listings_changed.clear()
+        try:
+            if SUBSCRIPTIONS.count and SHARED_SNAPSHOTS and SNAPSHOT_STORE.changed():
+                attach_snapshot()
+            broadcast_listing_changes()
+        except Exception:
+            logger.exception("Failed to push listing changes to streams")
+        if loop.time() >= next_keepalive:
+            SUBSCRIPTIONS.keepalive()
+            next_keepalive = loop.time() + STREAM_KEEPALIVE
+
+def smtp_send(to_email: str, subject: str, body: str):
+    """Deliver an HTML email over SMTP; blocking, and imports the mail modules on first use"""
+    import smtplib
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    
+    msg = MIMEMultipart()
+    msg['From'] = EMAIL_CONFIG["from_email"] or EMAIL_CONFIG["email_user"]
+    msg['To'] = to_email
+    msg['Subject'] = subject
+    
+    msg.attach(MIMEText(body, 'html'))
+    
+    server = smtplib.SMTP(EMAIL_CONFIG["smtp_server"], EMAIL_CONFIG["smtp_port"])
+    server.starttls()
+    server.login(EMAIL_CONFIG["email_user"], EMAIL_CONFIG["email_password"])
+    text = msg.as_string()
+    server.sendmail(EMAIL_CONFIG["email_user"], to_email, text)
+    server.quit()
+
 async def send_email_alert(to_email: str, subject: str, body: str):
     """Send email alert"""
     try:
         if not EMAIL_CONFIG["email_user"] or not EMAIL_CONFIG["email_password"]:
-            print("Email configuration not complete, skipping email send")
+            logger.warning("Email configuration not complete, skipping email send")
+            EMAIL_SENDS.inc("skipped")
             return False
-            
-        msg = MIMEMultipart()
-        msg['From'] = EMAIL_CONFIG["from_email"] or EMAIL_CONFIG["email_user"]
-        msg['To'] = to_email
-        msg['Subject'] = subject
-        
-        msg.attach(MIMEText(body, 'html'))
         
-        server = smtplib.SMTP(EMAIL_CONFIG["smtp_server"], EMAIL_CONFIG["smtp_port"])
-        server.starttls()
-        server.login(EMAIL_CONFIG["email_user"], EMAIL_CONFIG["email_password"])
-        text = msg.as_string()
-        server.sendmail(EMAIL_CONFIG["email_user"], to_email, text)
-        server.quit()
+        # The SMTP conversation blocks, so keep it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, smtp_send, to_email, subject, body)
         
+        EMAIL_SENDS.inc("sent")
         return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
+    except Exception:
+        logger.exception("Error sending email to %s", to_email)
+        EMAIL_SENDS.inc("failed")
         return False
 
+async def deliver_queued_email_alert(to_email: str, subject: str, body: str):
+    """Background task for a queued alert; keeps the queue depth and send latency metrics"""
+    start = time.perf_counter()
+    try:
+        return await send_email_alert(to_email, subject, body)
+    finally:
+        EMAIL_LATENCY.observe(time.perf_counter() - start)
+        EMAIL_QUEUE.dec()
+
 # API Endpoints
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "message": "Real Estate Investment API is running"}
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of this worker's request and pipeline metrics"""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/properties")
+@coalesced("/api/properties")
 async def get_properties(
-    min_price: Optional[int] = None,
-    max_price: Optional[int] = None,
-    city: Optional[str] = None,
-    state: Optional[str] = None,
-    min_bedrooms: Optional[int] = None,
-    property_type: Optional[str] = None,
-    investment_type: Optional[str] = None
+    criteria: PropertyFilter = Depends(),
+    q: Optional[str] = None,
+    facets: bool = False,
+    limit: Optional[int] = None,
+    offset: int = 0
 ):
-    """Get properties with optional filtering"""
-    filtered_properties = MOCK_PROPERTIES.copy()
-    
-    # Apply filters
-    if min_price:
-        filtered_properties = [p for p in filtered_properties if p["price"] >= min_price]
-    if max_price:
-        filtered_properties = [p for p in filtered_properties if p["price"] <= max_price]
-    if city:
-        filtered_properties = [p for p in filtered_properties if p["city"].lower() == city.lower()]
-    if state:
-        filtered_properties = [p for p in filtered_properties if p["state"].lower() == state.lower()]
-    if min_bedrooms:
-        filtered_properties = [p for p in filtered_properties if p["bedrooms"] >= min_bedrooms]
-    if property_type:
-        filtered_properties = [p for p in filtered_properties if p["property_type"].lower() == property_type.lower()]
-    
-    # Add investment analysis to each property
-    for prop in filtered_properties:
-        flip_analysis = calculate_flip_analysis(prop)
-        rental_analysis = calculate_rental_analysis(prop)
-        
-        prop["flip_analysis"] = flip_analysis
-        prop["rental_analysis"] = rental_analysis
+    """Get properties with optional filtering and full-text search
+    
+    Full-text results are paged, SEARCH_PAGE_SIZE at a time unless limit
+    says otherwise; filtered listings without q are all returned unless a
+    limit is given. count is the size of this page and total the number of
+    matches.
+    """
+    if q and limit is None:
+        limit = SEARCH_PAGE_SIZE
+    if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    if offset < 0:
+        raise HTTPException(status_code=400, detail="offset must not be negative")
+    
+    with span("filter"):
+        mask = listing_mask(criteria)
         
-        # Overall recommendation
-        if investment_type == "flip":
-            prop["investment_recommendation"] = flip_analysis["recommendation"]
-        elif investment_type == "rental":
-            prop["investment_recommendation"] = rental_analysis["recommendation"]
+        # Full-text search over address, description and listing agent, ranked by relevance
+        if q:
+            results, mask = await search_rows(mask, q, limit, offset)
+            rows, scores, total = results.ids, results.scores.tolist(), results.total
         else:
-            # Both - recommend based on better option
-            flip_good = flip_analysis["meets_70_rule"] and flip_analysis["estimated_roi"] > 15
-            rental_good = rental_analysis["meets_1_percent_rule"] and rental_analysis["cash_on_cash_return"] > 8
-            
-            if flip_good and rental_good:
-                prop["investment_recommendation"] = "Good for Both"
-            elif flip_good:
-                prop["investment_recommendation"] = "Good Flip"
-            elif rental_good:
-                prop["investment_recommendation"] = "Good Rental"
-            else:
-                prop["investment_recommendation"] = "Review Required"
+            rows, scores = np.flatnonzero(mask), None
+            total = len(rows)
+            if limit is not None or offset:
+                rows = rows[offset:None if limit is None else offset + limit]
+    ROWS_SCANNED.inc("/api/properties", amount=INVENTORY.size)
+    ROWS_RETURNED.inc("/api/properties", amount=len(rows))
     
-    return {"properties": filtered_properties, "count": len(filtered_properties)}
+    response = {"properties": None, "count": len(rows), "total": total, "version": INVENTORY.version}
+    if q:
+        response["prefix_truncated"] = results.truncated
+    if facets:
+        with span("aggregation"):
+            response["facets"] = listing_facets(mask, criteria.investment_type)
+    return await offload_json(len(rows), listings_content, response, criteria.investment_type, {"properties": (rows, scores)})
+
+@app.get("/api/changes")
+@coalesced("/api/changes")
+async def get_changes(since: int = 0, criteria: PropertyFilter = Depends()):
+    """Listings added, updated or removed since a change version
+    
+    Pass the version of the last /api/properties or /api/changes response as
+    since, with the same filters. Changed listings that match come back in
+    full; removed lists the ids of listings that matched at since and have
+    been deleted or no longer match. With since=0, a version this inventory
+    never reached, or one older than its change history goes back, every
+    matching listing is returned under added with reset set, and the client
+    should replace what it holds.
+    """
+    version = INVENTORY.version
+    reset = since <= 0 or since > version or since < INVENTORY.horizon
+    with span("filter"):
+        mask = listing_mask(criteria)
+        if reset:
+            added, updated, gone = np.flatnonzero(mask), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        else:
+            changed = INVENTORY.changed_rows(since)
+            matching = mask[changed]
+            live = changed[matching]
+            created = INVENTORY.created[live] > since
+            added, updated, gone = live[created], live[~created], changed[~matching]
+            # Only listings the client had, as they were at since
+            gone = gone[listing_matches(gone, criteria, as_of=since)]
+    
+    removed = []
+    if len(gone):
+        # A listing removed and then added again is reported once, as added
+        current = {INVENTORY.rows[row]["id"] for row in np.concatenate((added, updated)).tolist()}
+        for row in gone.tolist():
+            property_id = INVENTORY.rows[row]["id"] if INVENTORY.alive[row] else INVENTORY.removed_id(row)
+            if property_id is not None and property_id not in current:
+                current.add(property_id)
+                removed.append(property_id)
+    ROWS_SCANNED.inc("/api/changes", amount=INVENTORY.size)
+    ROWS_RETURNED.inc("/api/changes", amount=len(added) + len(updated))
+    
+    response = {
+        "version": version,
+        "since": since,
+        "reset": reset,
+        "added": None,
+        "updated": None,
+        "removed": removed
+    }
+    listings = {"added": (added, None), "updated": (updated, None)}
+    return await offload_json(len(added) + len(updated), listings_content, response, criteria.investment_type, listings)
+
+@app.get("/api/stream/listings")
+async def stream_listings(criteria: PropertyFilter = Depends(), last_event_id: Optional[str] = Header(None)):
+    """Server-Sent Events of new and repriced listings matching a filter
+    
+    Takes the /api/properties filters. Events are "listing" (type new or
+    repriced, the listing with its analysis, and previous_price for
+    repricings) with the change version as the event id, and "resync" when
+    the client fell too far behind or reconnects with a Last-Event-ID older
+    than the inventory: it should then catch up with /api/changes?since=.
+    The stream opens with a "ready" event carrying the current version.
+    """
+    if SUBSCRIPTIONS.full():
+        raise HTTPException(status_code=503, detail="Too many open listing streams")
+    ensure_stream_state()
+    version = INVENTORY.version
+    key = tuple(sorted((name, value) for name, value in criteria.dict().items() if value is not None))
+    if last_event_id and last_event_id.isdigit() and int(last_event_id) < version:
+        first = encode_event("resync", {"since": int(last_event_id)})
+    else:
+        first = encode_event("ready", {"version": version})
+    return StreamingResponse(
+        SUBSCRIPTIONS.stream(key, version, first),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/facets")
+@coalesced("/api/facets")
+async def get_facets(criteria: PropertyFilter = Depends(), q: Optional[str] = None):
+    """Facet counts (city, state, type, bedrooms, price bucket, recommendation) for a filter"""
+    # investment_type only picks which recommendation is counted; a flag
+    # filters whenever it is set, even to false
+    filters = criteria.dict()
+    del filters["investment_type"]
+    if not q and not any(value is not None if isinstance(value, bool) else value for value in filters.values()):
+        # Unfiltered: answered from the counters kept on write
+        mask = None
+    else:
+        with span("filter"):
+            mask = listing_mask(criteria)
+            if q:
+                _, mask = await search_rows(mask, q, limit=0)
+    
+    with span("aggregation"):
+        count = len(INVENTORY) if mask is None else int(mask.sum())
+        response = {"facets": listing_facets(mask, criteria.investment_type), "count": count}
+    return json_response(response)
+
+@app.get("/api/deals/top")
+@coalesced("/api/deals/top")
+async def get_top_deals(
+    metric: str = "estimated_roi",
+    k: int = 20,
+    weights: Optional[str] = None,
+    criteria: PropertyFilter = Depends()
+):
+    """Best K deals by a precomputed metric or a weighted composite score
+    
+    weights takes "metric:weight" pairs, e.g. "estimated_roi:0.6,cash_on_cash_return:0.4";
+    metrics are standardized across the filtered listings before weighting.
+    """
+    if k < 1 or k > 1000:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 1000")
+    
+    with span("filter"):
+        mask = listing_mask(criteria)
+    
+    if weights:
+        parsed_weights = {}
+        for pair in weights.split(","):
+            name, _, weight = pair.partition(":")
+            name = name.strip()
+            if name not in METRIC_COLUMNS:
+                raise HTTPException(status_code=400, detail=f"Unknown metric '{name}'")
+            try:
+                parsed_weights[name] = float(weight) if weight else 1.0
+            except ValueError:
+                parsed_weights[name] = math.nan
+            if not math.isfinite(parsed_weights[name]):
+                raise HTTPException(status_code=400, detail=f"Invalid weight for '{name}'")
+        scores = INVENTORY.composite_score(parsed_weights, mask)
+        metric = "composite"
+    elif metric in METRIC_COLUMNS:
+        parsed_weights = None
+        scores = INVENTORY.column(metric)
+    else:
+        raise HTTPException(status_code=400, detail=f"Unknown metric '{metric}'. Available: {', '.join(METRIC_COLUMNS)}")
+    
+    with span("ranking"):
+        rows = INVENTORY.top_k(scores, mask, k)
+    with span("analysis"):
+        deals = [
+            listing_with_analysis(row, criteria.investment_type, rank=rank, score=round(float(scores[row]), 4) + 0.0)
+            for rank, row in enumerate(rows, start=1)
+        ]
+    ROWS_SCANNED.inc("/api/deals/top", amount=INVENTORY.size)
+    ROWS_RETURNED.inc("/api/deals/top", amount=len(deals))
+    
+    return json_response({
+        "metric": metric,
+        "weights": parsed_weights,
+        "deals": deals,
+        "count": len(deals),
+        "total_matches": int(mask.sum())
+    })
+
+@app.get("/api/search/suggest")
+async def search_suggest(prefix: str, limit: int = 10):
+    """Type-ahead completions for the property search box"""
+    if not 1 <= limit <= 50:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 50")
+    return {"prefix": prefix, "suggestions": (await ready_search_index()).suggest(prefix, limit)}
 
 @app.get("/api/properties/{property_id}")
 async def get_property(property_id: str):
     """Get detailed property information"""
-    property_data = next((p for p in MOCK_PROPERTIES if p["id"] == property_id), None)
+    property_data = INVENTORY.get(property_id)
     
     if not property_data:
         raise HTTPException(status_code=404, detail="Property not found")
     
     # Add detailed analysis
-    flip_analysis = calculate_flip_analysis(property_data)
-    rental_analysis = calculate_rental_analysis(property_data)
-    
-    property_data["flip_analysis"] = flip_analysis
-    property_data["rental_analysis"] = rental_analysis
-    
-    return property_data
+    return {**property_data, **INVENTORY.analysis(property_id)}
 
 @app.post("/api/analysis")
 async def analyze_property(property_id: str):
     """Get detailed investment analysis for a property"""
-    property_data = next((p for p in MOCK_PROPERTIES if p["id"] == property_id), None)
+    property_data = INVENTORY.get(property_id)
     
     if not property_data:
         raise HTTPException(status_code=404, detail="Property not found")
     
-    flip_analysis = calculate_flip_analysis(property_data)
-    rental_analysis = calculate_rental_analysis(property_data)
+    analysis = INVENTORY.analysis(property_id)
+    flip_analysis = analysis["flip_analysis"]
+    rental_analysis = analysis["rental_analysis"]
     
     # Determine overall recommendation
     flip_good = flip_analysis["meets_70_rule"] and flip_analysis["estimated_roi"] > 15
@@ -634,7 +1719,8 @@ async def send_property_alert(background_tasks: BackgroundTasks, email: str, pro
     """
     
     # Send email in background
-    background_tasks.add_task(send_email_alert, email, subject, html_body)
+    EMAIL_QUEUE.inc()
+    background_tasks.add_task(deliver_queued_email_alert, email, subject, html_body)
     
     return {"message": "Alert email queued for sending"}
 
@@ -647,13 +1733,7 @@ async def calculate_deal(input_data: DealCalculatorInput):
     down_payment = input_data.purchase_price * (input_data.down_payment_percent / 100)
     
     # Monthly payment calculation
-    monthly_rate = input_data.interest_rate / 100 / 12
-    num_payments = input_data.loan_term_years * 12
-    
-    if monthly_rate > 0:
-        monthly_payment = loan_amount * (monthly_rate * (1 + monthly_rate)**num_payments) / ((1 + monthly_rate)**num_payments - 1)
-    else:
-        monthly_payment = loan_amount / num_payments
+    monthly_payment = monthly_mortgage_payment(loan_amount, input_data.interest_rate, input_data.loan_term_years)
     
     # Cash flow analysis
     monthly_cash_flow = input_data.monthly_rent - monthly_payment - input_data.estimated_expenses
@@ -697,85 +1777,351 @@ async def calculate_deal(input_data: DealCalculatorInput):
         "flip_analysis": flip_analysis
     }
 
-@app.get("/api/market-analysis")
-async def get_market_analysis(city: Optional[str] = None, state: Optional[str] = None):
-    """Get market analysis for cities"""
+def compute_market_aggregates(inventory):
+    """Per-market listings and summary metrics, grouped over the inventory's columns
     
-    # Aggregate market data from properties
-    market_data = {}
+    Returns the market analysis records keyed by "City, ST" and the summary
+    list served by /api/markets, both in the order of each market's first
+    listing. A record's "properties" holds the rows of its listings;
+    market_listings decodes them for the markets actually returned.
+    """
+    n = inventory.size
+    city_codes, state_codes = inventory.codes["city"][:n], inventory.codes["state"][:n]
+    live = np.flatnonzero(inventory.alive[:n] & (city_codes >= 0) & (state_codes >= 0))
+    city_codes, state_codes = city_codes[live], state_codes[live]
+    state_count = len(inventory.labels["state"])
+    market_keys = city_codes.astype(np.int64) * state_count + state_codes
+    keys, first, groups = np.unique(market_keys, return_index=True, return_inverse=True)
+    # Renumber the groups by first appearance
+    order = np.argsort(first, kind="stable")
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+    groups, keys, first = position[groups], keys[order], live[first[order]]
+    market_count = len(keys)
+    
+    price, rent, sqft = (inventory.column(name)[live] for name in ("price", "estimated_rent", "sqft"))
+    counts = np.bincount(groups, minlength=market_count)
+    price_totals = np.bincount(groups, price, market_count).tolist()
+    rent_totals = np.bincount(groups, rent, market_count).tolist()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        per_sqft_totals = np.bincount(groups, price / sqft, market_count).tolist()
+    property_types = inventory.codes["property_type"][:n][live]
+    type_counts = {}
+    for name in ("Single Family", "Multi Family"):
+        code = inventory.code_for("property_type", name)
+        matching = groups[property_types == code] if code is not None else groups[:0]
+        type_counts[name] = np.bincount(matching, minlength=market_count).tolist()
+    market_rows = np.split(live[np.argsort(groups, kind="stable")], np.cumsum(counts)[:-1])
+    
+    # Market list averages are taken over every listing in the same city
+    city_count = len(inventory.labels["city"])
+    city_listings = np.bincount(city_codes, minlength=city_count).tolist()
+    city_prices = np.bincount(city_codes, price, city_count).tolist()
+    city_rents = np.bincount(city_codes, rent, city_count).tolist()
     
-    for prop in MOCK_PROPERTIES:
-        key = f"{prop['city']}, {prop['state']}"
-        if key not in market_data:
-            market_data[key] = {
-                "city": prop["city"],
-                "state": prop["state"],
-                "properties": [],
-                "market_trends": prop["market_trends"]
+    market_data = {}
+    markets = []
+    for i, key in enumerate(keys.tolist()):
+        city_code = key // state_count
+        city, state = inventory.labels["city"][city_code], inventory.labels["state"][key % state_count]
+        market_trends = inventory.rows[int(first[i])]["market_trends"]
+        count = int(counts[i])
+        avg_price = price_totals[i] / count
+        avg_rent = rent_totals[i] / count
+        single_family, multi_family = type_counts["Single Family"][i], type_counts["Multi Family"][i]
+        market_data[f"{city}, {state}"] = {
+            "city": city,
+            "state": state,
+            "properties": market_rows[i],
+            "market_trends": market_trends,
+            "total_properties": count,
+            "avg_price": avg_price,
+            "avg_rent": avg_rent,
+            "avg_price_per_sqft": per_sqft_totals[i] / count,
+            "avg_rent_yield": (avg_rent * 12 / avg_price) * 100,
+            "property_type_breakdown": {
+                "single_family": single_family,
+                "multi_family": multi_family,
+                "single_family_percent": (single_family / count) * 100,
+                "multi_family_percent": (multi_family / count) * 100
             }
-        market_data[key]["properties"].append(prop)
-    
-    # Calculate aggregated metrics
-    for market in market_data.values():
-        props = market["properties"]
-        market["total_properties"] = len(props)
-        market["avg_price"] = sum(p["price"] for p in props) / len(props)
-        market["avg_rent"] = sum(p["estimated_rent"] for p in props) / len(props)
-        market["avg_price_per_sqft"] = sum(p["price"] / p["sqft"] for p in props) / len(props)
-        market["avg_rent_yield"] = (market["avg_rent"] * 12 / market["avg_price"]) * 100
-        
-        # Property type breakdown
-        single_family = len([p for p in props if p["property_type"] == "Single Family"])
-        multi_family = len([p for p in props if p["property_type"] == "Multi Family"])
-        
-        market["property_type_breakdown"] = {
-            "single_family": single_family,
-            "multi_family": multi_family,
-            "single_family_percent": (single_family / len(props)) * 100,
-            "multi_family_percent": (multi_family / len(props)) * 100
         }
+        markets.append({
+            "city": city,
+            "state": state,
+            "property_count": count,
+            "avg_price": int(city_prices[city_code] // city_listings[city_code]),
+            "avg_rent": int(city_rents[city_code] // city_listings[city_code]),
+            "market_trends": market_trends
+        })
     
-    # Filter by city/state if provided
-    if city or state:
-        filtered_markets = {}
-        for key, market in market_data.items():
-            if city and city.lower() != market["city"].lower():
-                continue
-            if state and state.lower() != market["state"].lower():
-                continue
-            filtered_markets[key] = market
-        market_data = filtered_markets
+    return market_data, markets
+
+def market_listings(inventory, market):
+    """A market analysis record with the listings of its rows"""
+    return {**market, "properties": [inventory.rows[row] for row in market["properties"].tolist()]}
+
+# Daily per-market history (see market_history.py), logged next to the
+# inventory snapshots. A snapshot of every market is recorded at startup and
+# after each midnight. The market endpoints derive trends from it; markets
+# with fewer than MARKET_HISTORY_WINDOW days of history (the rolling window
+# the figures are averaged over) keep the static market_trends of their
+# listings, and growth rates need MARKET_HISTORY_MIN_DAYS of history.
+MARKET_HISTORY = MarketHistory(os.path.join(SNAPSHOT_DIR, "market-history.log") if SNAPSHOT_DIR else None)
+MARKET_HISTORY_WINDOW = 30
+MARKET_HISTORY_MIN_DAYS = int(os.environ.get("MARKET_HISTORY_MIN_DAYS", 60))
+# Lower bounds of annual appreciation (percent) for each price_trend label
+PRICE_TRENDS = ((10, "Rapidly Increasing"), (6, "Increasing"), (2, "Slowly Increasing"), (-2, "Stable"))
+_history_trends = None
+
+def market_snapshot(inventory):
+    """Per-market median price, rent and days on market, and listing count, over live listings"""
+    n = inventory.size
+    alive = inventory.alive[:n] & (inventory.codes["city"][:n] >= 0) & (inventory.codes["state"][:n] >= 0)
+    state_count = len(inventory.labels["state"])
+    market_keys = inventory.codes["city"][:n][alive].astype(np.int64) * state_count + inventory.codes["state"][:n][alive]
+    keys, groups = np.unique(market_keys, return_inverse=True)
+    metrics = (("median_price", "price"), ("median_rent", "estimated_rent"), ("median_days_on_market", "days_on_market"))
+    medians = {metric: group_medians(groups, inventory.column(column)[alive], len(keys)) for metric, column in metrics}
+    counts = np.bincount(groups, minlength=len(keys))
+    snapshot = {}
+    for i, key in enumerate(keys.tolist()):
+        city, state = inventory.labels["city"][key // state_count], inventory.labels["state"][key % state_count]
+        snapshot[f"{city}, {state}"] = {metric: float(values[i]) for metric, values in medians.items()}
+        snapshot[f"{city}, {state}"]["listings"] = float(counts[i])
+    return snapshot
+
+def record_market_history(day: Optional[int] = None, inventory=None) -> bool:
+    """Append a day's market snapshot (today by default) unless the history already has it
     
-    return {
-        "markets": list(market_data.values()),
+    The snapshot is of inventory, or by default the latest published version
+    with shared snapshots and this worker's inventory otherwise. A persisted
+    history is appended under the store lock through a MarketHistory of its
+    own, which MARKET_HISTORY picks up on its next refresh, so this can run
+    on a worker thread given a frozen inventory.
+    """
+    day = day_number(datetime.now().date()) if day is None else day
+    history = MarketHistory(MARKET_HISTORY.path) if MARKET_HISTORY.path else MARKET_HISTORY
+    with SNAPSHOT_STORE.lock() if SNAPSHOT_STORE is not None else nullcontext():
+        history.refresh()
+        if history.last_day is not None and history.last_day >= day:
+            return False
+        if inventory is None:
+            snapshot = SNAPSHOT_STORE.open(mark_seen=False) if SHARED_SNAPSHOTS else None
+            inventory = open_inventory_snapshot(snapshot) if snapshot is not None else INVENTORY
+        history.append(day, market_snapshot(inventory))
+    return True
+
+async def record_market_history_daily():
+    """Record the market snapshot now and again after every midnight"""
+    while True:
+        try:
+            if SNAPSHOT_STORE is None:
+                record_market_history()
+            else:
+                inventory = None if SHARED_SNAPSHOTS else INVENTORY.freeze()
+                await asyncio.get_running_loop().run_in_executor(None, record_market_history, None, inventory)
+        except Exception:
+            logger.exception("Failed to record market history")
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((midnight - now).total_seconds() + 1)
+
+def market_history_trends():
+    """Trends per market derived from the history, recomputed when it grows"""
+    global _history_trends
+    MARKET_HISTORY.refresh()
+    if _history_trends is not None and _history_trends[0] == MARKET_HISTORY.records:
+        CACHE_REQUESTS.inc("market_history", "hit")
+        return _history_trends[1]
+    CACHE_REQUESTS.inc("market_history", "miss")
+    with span("trends"):
+        trends = MARKET_HISTORY.trends(window=MARKET_HISTORY_WINDOW, min_days=MARKET_HISTORY_MIN_DAYS)
+    _history_trends = (MARKET_HISTORY.records, trends)
+    return trends
+
+def market_history_version():
+    """Records in the market history, which the market endpoints' trends depend on"""
+    MARKET_HISTORY.refresh()
+    return MARKET_HISTORY.records
+
+def price_trend(appreciation_rate: float) -> str:
+    for threshold, label in PRICE_TRENDS:
+        if appreciation_rate > threshold:
+            return label
+    return "Declining"
+
+def with_history_trends(markets, trends):
+    """Market records with market_trends overlaid by the figures derived from history
+    
+    Only markets with a full rolling window of history are overlaid. Listing
+    figures replaced by derived ones stay available under listing_<name>.
+    """
+    merged = []
+    for market in markets:
+        derived = trends.get(f"{market['city']}, {market['state']}")
+        if derived is not None and derived["history_days"] >= MARKET_HISTORY_WINDOW:
+            derived = dict(derived)
+            if "appreciation_rate" in derived:
+                derived["price_trend"] = price_trend(derived["appreciation_rate"])
+            listed = market["market_trends"]
+            market_trends = {**listed, **derived, "source": "history"}
+            market_trends.update((f"listing_{name}", listed[name]) for name in derived if name in listed)
+            market = {**market, "market_trends": market_trends}
+        merged.append(market)
+    return merged
+
+_market_aggregates = None
+
+def cached_market_aggregates():
+    """Market aggregates for the current inventory if they are cached, else None"""
+    cached = _market_aggregates
+    if cached is not None and cached[0] is INVENTORY and cached[1] == INVENTORY.version:
+        return cached[2]
+    return None
+
+def market_aggregates(route: str):
+    """Market aggregates for the current inventory, recomputed only after it changes"""
+    global _market_aggregates
+    cached = cached_market_aggregates()
+    if cached is not None:
+        CACHE_REQUESTS.inc("market_aggregates", "hit")
+        return cached
+    CACHE_REQUESTS.inc("market_aggregates", "miss")
+    inventory = INVENTORY
+    version = inventory.version
+    with span("aggregation"):
+        aggregates = compute_market_aggregates(inventory)
+    ROWS_SCANNED.inc(route, amount=len(inventory))
+    _market_aggregates = (inventory, version, aggregates)
+    return aggregates
+
+@app.get("/api/market-analysis")
+@coalesced("/api/market-analysis", extra=market_history_version)
+async def get_market_analysis(
+    city: Optional[str] = None, state: Optional[str] = None, history: Optional[str] = None, periods: int = 24
+):
+    """Get market analysis for cities
+    
+    market_trends are derived from the daily market history once a market has
+    a full rolling window of it, keeping the listing figures as listing_<name>.
+    Pass history=day, week or month to also get each market's median price,
+    rent, days on market and listing count for the last periods buckets.
+    """
+    if history is not None and history not in HISTORY_RESOLUTIONS:
+        available = ", ".join(HISTORY_RESOLUTIONS)
+        raise HTTPException(status_code=400, detail=f"Unknown history resolution '{history}'. Available: {available}")
+    # With the aggregates cached in this process, only the listings of the
+    # markets returned are left to render
+    cached = cached_market_aggregates()
+    if cached is None:
+        rows = len(INVENTORY)
+    else:
+        rows = sum(market["total_properties"] for market in select_markets(cached[0], city, state).values())
+    return await offload_json(rows, market_analysis_content, city, state, history, periods)
+
+def select_markets(market_data: Dict, city: Optional[str], state: Optional[str]) -> Dict:
+    """Market analysis records for a city and/or state, or all of them"""
+    if not (city or state):
+        return market_data
+    filtered_markets = {}
+    for key, market in market_data.items():
+        if city and city.lower() != market["city"].lower():
+            continue
+        if state and state.lower() != market["state"].lower():
+            continue
+        filtered_markets[key] = market
+    return filtered_markets
+
+def market_analysis_content(city: Optional[str], state: Optional[str], history: Optional[str], periods: int) -> Dict:
+    market_data, _ = market_aggregates("/api/market-analysis")
+    market_data = select_markets(market_data, city, state)
+    ROWS_RETURNED.inc("/api/market-analysis", amount=sum(market["total_properties"] for market in market_data.values()))
+    
+    with span("analysis"):
+        market_data = {key: market_listings(INVENTORY, market) for key, market in market_data.items()}
+    response = {
+        "markets": with_history_trends(market_data.values(), market_history_trends()),
         "total_markets": len(market_data)
     }
+    if history is not None:
+        with span("trends"):
+            response["history"] = MARKET_HISTORY.series(history, periods, list(market_data))
+    return response
 
 @app.get("/api/markets")
+@coalesced("/api/markets", extra=market_history_version)
 async def get_markets():
     """Get available markets/cities"""
-    markets = {}
-    for prop in MOCK_PROPERTIES:
-        city_state = f"{prop['city']}, {prop['state']}"
-        if city_state not in markets:
-            markets[city_state] = {
-                "city": prop["city"],
-                "state": prop["state"],
-                "property_count": 0,
-                "avg_price": 0,
-                "avg_rent": 0,
-                "market_trends": prop["market_trends"]
-            }
-        markets[city_state]["property_count"] += 1
-    
-    # Calculate averages
-    for market in markets.values():
-        city_props = [p for p in MOCK_PROPERTIES if p["city"] == market["city"]]
-        market["avg_price"] = sum(p["price"] for p in city_props) // len(city_props)
-        market["avg_rent"] = sum(p["estimated_rent"] for p in city_props) // len(city_props)
+    # From cached aggregates only the summary list is left to render
+    return await offload_json(len(INVENTORY) if cached_market_aggregates() is None else 0, markets_content)
+
+def markets_content() -> Dict:
+    _, markets = market_aggregates("/api/markets")
+    return {"markets": with_history_trends(markets, market_history_trends())}
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency guarding the admin endpoints"""
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+def require_profiler():
+    if PROFILER is None:
+        raise HTTPException(
+            status_code=404, detail="Profiling is disabled; start the server with PROFILING=1 and ADMIN_TOKEN set"
+        )
+    return PROFILER
+
+@app.get("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def get_profiling(profiler: Profiler = Depends(require_profiler)):
+    """Current sampling settings of this worker and the stored profiles"""
+    return {"settings": profiler.settings(), "profiles": profiler.store.list()}
+
+@app.post("/api/admin/profiling", dependencies=[Depends(require_admin)])
+async def configure_profiling(settings: ProfilingSettings, profiler: Profiler = Depends(require_profiler)):
+    """Profile a sampled fraction of this worker's traffic, up to limit requests
     
-    return {"markets": list(markets.values())}
+    A single request can be profiled on any worker instead by sending it with
+    "X-Profile: cprofile" (or "sampling") and the admin token.
+    """
+    if settings.mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(PROFILE_MODES)}")
+    if not 0 <= settings.sample_rate <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    if settings.limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    profiler.configure(settings.sample_rate, settings.mode, settings.path_prefix, settings.limit)
+    return {"settings": profiler.settings()}
+
+@app.get("/api/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str, profiler: Profiler = Depends(require_profiler)):
+    """Metadata of a stored profile"""
+    meta = profiler.store.get(profile_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return meta
+
+@app.get("/api/admin/profiles/{profile_id}/download", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: Optional[str] = None, profiler: Profiler = Depends(require_profiler)):
+    """Download a profile as pstats (cprofile), txt (cprofile summary) or collapsed stacks (sampling)"""
+    meta = profiler.store.get(profile_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    format = format or meta["files"][0]
+    if format not in meta["files"]:
+        raise HTTPException(status_code=400, detail=f"Available formats: {', '.join(meta['files'])}")
+    media_type = "application/octet-stream" if format == "pstats" else "text/plain"
+    return FileResponse(profiler.store.path(profile_id, format), media_type=media_type, filename=f"profile-{profile_id}.{format}")
+
+@app.delete("/api/admin/profiles", dependencies=[Depends(require_admin)])
+async def clear_profiles(profiler: Profiler = Depends(require_profiler)):
+    """Delete every stored profile"""
+    return {"deleted": profiler.store.clear()}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    if WORKERS > 1:
+        # Each worker imports the app itself and maps the shared snapshot
+        uvicorn.run("server:app", host="0.0.0.0", port=8001, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
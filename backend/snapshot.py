@@ -0,0 +1,700 @@
+"""Immutable, memory-mapped inventory snapshots shared between worker processes
+
+A snapshot is a single file:
+
+    magic (8 bytes) | header length (uint64) | JSON header | aligned arrays
+
+The header lists every array by dtype, byte offset and length. Arrays are
+read with np.frombuffer straight out of the mapping, so opening a snapshot
+costs one small JSON parse no matter how many listings it holds, and every
+process that maps the same file shares the same physical pages.
+
+Listing fields are stored column by column: numbers as int64/float64,
+strings (and nested values as JSON) as int32 indexes into one deduplicated
+string table. Rows are decoded only when a handler actually returns them.
+
+Format 2 adds the lookup structures that would otherwise be rebuilt on
+every start: a sorted id-hash index for lookups by property id and, per
+categorical column, the rows grouped by code for building bitmaps. It also
+carries the inventory's change log: the change version in the header, per-row
+last-written and created versions, the ids of removed rows, and the
+inventory's change history (before-images of replaced and removed rows).
+Snapshots written before the change log existed open with every version at
+0, and ones written before the change history with its horizon at their
+change version.
+
+A full rewrite may compact dead rows out, renumbering the rows after them;
+compacted_at in the header records the change version when that last
+happened, so anything keyed by row number can tell it is stale.
+"""
+import fcntl
+import functools
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MAGIC = b"REINVSNP"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sQ")
+
+# Number of published versions kept on disk. Older files are unlinked; any
+# worker still mapping one keeps reading it until it swaps to a newer version.
+KEEP_VERSIONS = 2
+
+_MISSING = object()
+
+
+# Re-encode every row instead of patching the previous snapshot once more
+# than this fraction of rows has changed
+INCREMENTAL_LIMIT = 0.25
+
+# Patching appends new strings to the previous string table and leaves the
+# ones no row refers to any more in place. Once more than this fraction of
+# the table is unreferenced, every row is re-encoded to compact it.
+DEAD_STRINGS_LIMIT = 0.25
+
+# Publishing with compaction drops the dead rows of listings removed before
+# the change history's horizon, once more than this fraction of rows can go
+DEAD_ROWS_LIMIT = 0.25
+
+# Decoded listings a snapshot-backed inventory keeps around; older ones are
+# decoded again from the mapped file when next read
+ROW_CACHE_SIZE = 4096
+
+_FILL = {"int": 0, "float": 0.0, "bool": 0, "str": -1, "json": -1}
+_DTYPES = {"int": np.int64, "float": np.float64, "bool": np.uint8, "str": np.int32, "json": np.int32}
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def id_hash(property_id: str) -> int:
+    """Stable 64-bit hash of a property id (Python's hash() is salted per process)"""
+    return int.from_bytes(hashlib.blake2b(property_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class _StringTable:
+    def __init__(self, base: Optional["Snapshot"] = None):
+        self.index: Dict[str, int] = {}
+        if base is None:
+            self.chunks: List[bytes] = []
+            self.offsets = [0]
+        else:
+            # Keep the previous table as-is and append; strings are not
+            # deduplicated against it, and replaced ones stay behind until
+            # a full encode (see DEAD_STRINGS_LIMIT)
+            self.chunks = [bytes(base.array("strings:blob"))]
+            self.offsets = base.array("strings:offsets").tolist()
+
+    def add(self, value: str) -> int:
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.offsets) - 1
+            data = value.encode("utf-8")
+            self.chunks.append(data)
+            self.offsets.append(self.offsets[-1] + len(data))
+        return i
+
+    def dead_bytes(self, fields: List[Dict], arrays: Dict[str, np.ndarray], removed_ids: np.ndarray) -> int:
+        """Bytes of strings that no field value or removed id refers to"""
+        lengths = np.diff(np.asarray(self.offsets, dtype=np.int64))
+        referenced = np.zeros(len(lengths), dtype=bool)
+        for field in fields:
+            if field["kind"] in ("str", "json"):
+                name = field["name"]
+                referenced[arrays[f"field:{name}"][arrays[f"state:{name}"] == 1]] = True
+        referenced[removed_ids] = True
+        return int(lengths[~referenced].sum())
+
+
+def _field_kind(values) -> str:
+    kinds = set()
+    for value in values:
+        if value is _MISSING or value is None:
+            continue
+        if isinstance(value, bool):
+            kinds.add("bool")
+        elif isinstance(value, int):
+            kinds.add("int")
+        elif isinstance(value, float):
+            kinds.add("float")
+        elif isinstance(value, str):
+            kinds.add("str")
+        else:
+            kinds.add("json")
+    if not kinds:
+        return "null"
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds <= {"int", "float"}:
+        return "float"
+    return "json"
+
+
+def _fits(kind: str, value) -> bool:
+    if value is None:
+        return True
+    if kind == "int":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if kind == "float":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if kind == "bool":
+        return isinstance(value, bool)
+    if kind == "str":
+        return isinstance(value, str)
+    return kind == "json"
+
+
+def _encode_value(kind: str, value, strings: _StringTable):
+    if kind == "str":
+        return strings.add(value)
+    if kind == "json":
+        return strings.add(json.dumps(value, separators=(",", ":")))
+    return value
+
+
+def _encode_changed_fields(rows: "SnapshotRows", size: int, strings: _StringTable):
+    """Patch the base snapshot's field columns with the rows written since
+
+    Returns None when a changed row does not fit the existing field kinds
+    (a new key, or a value of a different type); the caller then falls back
+    to a full encode.
+    """
+    base = rows.snapshot
+    kinds = {field["name"]: field["kind"] for field in base.fields}
+    columns, states = {}, {}
+    for name, kind in kinds.items():
+        state = np.zeros(size, dtype=np.uint8)
+        state[:base.size] = base.array(f"state:{name}")
+        states[name] = state
+        if kind != "null":
+            column = np.full(size, _FILL[kind], dtype=_DTYPES[kind])
+            column[:base.size] = base.array(f"field:{name}")
+            columns[name] = column
+
+    for i in sorted(rows.dirty):
+        row = rows.written[i]
+        if row is None:
+            for state in states.values():
+                state[i] = 0
+            continue
+        if not kinds.keys() >= row.keys():
+            return None
+        for name, kind in kinds.items():
+            value = row.get(name, _MISSING)
+            if value is _MISSING:
+                states[name][i] = 0
+            elif value is None:
+                states[name][i] = 2
+            elif _fits(kind, value):
+                states[name][i] = 1
+                columns[name][i] = _encode_value(kind, value, strings)
+            else:
+                return None
+
+    arrays = {}
+    for name in kinds:
+        if name in columns:
+            arrays[f"field:{name}"] = columns[name]
+        arrays[f"state:{name}"] = states[name]
+    return [dict(field) for field in base.fields], arrays
+
+
+def _encode_fields(rows, size: int, strings: _StringTable):
+    """Column-encode the listing dicts; returns (field specs, arrays)"""
+    rows = [rows[i] for i in range(size)]
+    names: Dict[str, None] = {}
+    for row in rows:
+        if row is not None:
+            names.update(dict.fromkeys(row))
+
+    fields, arrays = [], {}
+    for name in names:
+        values = [row.get(name, _MISSING) if row is not None else _MISSING for row in rows]
+        kind = _field_kind(values)
+        present = np.fromiter((v is not _MISSING for v in values), dtype=bool, count=size)
+        is_null = [v is None for v in values]
+        if kind == "int":
+            column = np.fromiter((v if isinstance(v, int) else 0 for v in values), dtype=np.int64, count=size)
+        elif kind == "float":
+            column = np.fromiter((v if isinstance(v, (int, float)) else 0 for v in values), dtype=np.float64, count=size)
+        elif kind == "bool":
+            column = np.fromiter((v is True for v in values), dtype=np.uint8, count=size)
+        elif kind == "str":
+            column = np.fromiter((strings.add(v) if isinstance(v, str) else -1 for v in values), dtype=np.int32, count=size)
+        elif kind == "json":
+            encoded = (json.dumps(v, separators=(",", ":")) if v is not _MISSING and v is not None else None for v in values)
+            column = np.fromiter((strings.add(v) if v is not None else -1 for v in encoded), dtype=np.int32, count=size)
+        else:
+            column = None
+        # 0 = missing, 1 = present, 2 = explicit None
+        state = present.astype(np.uint8) + np.fromiter(is_null, dtype=bool, count=size).astype(np.uint8)
+        fields.append({"name": name, "kind": kind})
+        if column is not None:
+            arrays[f"field:{name}"] = column
+        arrays[f"state:{name}"] = state
+    return fields, arrays
+
+
+def _id_hashes(rows, size: int, alive: np.ndarray) -> np.ndarray:
+    """Per-row id hashes, reusing the base snapshot's for unchanged rows"""
+    if isinstance(rows, SnapshotRows):
+        base = rows.snapshot
+        hashes = np.zeros(size, dtype=np.uint64)
+        hashes[:base.size] = base.array("index:id_hash")
+        changed = sorted(rows.dirty)
+    else:
+        hashes = np.zeros(size, dtype=np.uint64)
+        changed = range(size)
+    for i in changed:
+        row = rows.written[i] if isinstance(rows, SnapshotRows) else rows[i]
+        hashes[i] = id_hash(row["id"]) if row is not None and alive[i] else 0
+    return hashes
+
+
+def _encode_removed_ids(
+    removed: Dict[int, str], removed_rows: np.ndarray, strings: _StringTable, base: Optional["Snapshot"] = None
+) -> np.ndarray:
+    """String indexes of the removed ids, reusing the base snapshot's entries for rows it already had removed"""
+    known = dict(zip(base._removed_rows.tolist(), base._removed_ids.tolist())) if base is not None else {}
+    return np.array([known[row] if row in known else strings.add(removed[row]) for row in removed_rows.tolist()], dtype=np.int32)
+
+
+def _compacted_rows(inventory) -> Optional[np.ndarray]:
+    """Rows to keep if enough dead rows can be dropped (see DEAD_ROWS_LIMIT), else None
+
+    A dead row can go once its removal is older than the change history's
+    horizon: clients asking for changes since before then are sent every
+    listing again, so nothing needs the removed id any more.
+    """
+    n = inventory.size
+    droppable = ~inventory.alive[:n] & (inventory.versions[:n] <= inventory.horizon)
+    if not droppable.any() or droppable.sum() <= n * DEAD_ROWS_LIMIT:
+        return None
+    return np.flatnonzero(~droppable)
+
+
+def write_snapshot(inventory, path: str, version: int, compact: bool = False):
+    """Serialize an inventory to path atomically (write to a temp file, then rename)
+
+    A snapshot-backed inventory with few changed rows is written by patching
+    the base snapshot's arrays instead of re-encoding every listing, unless
+    that would leave too much of the string table unreferenced. With compact,
+    a full rewrite that drops dead rows is done instead when enough of them
+    can go; the rows written then no longer line up with inventory's.
+    """
+    n = inventory.size
+    rows = inventory.rows
+    alive = inventory.alive[:n]
+    removed = inventory.removed_ids()
+    history = inventory.history.entries()
+    keep = _compacted_rows(inventory) if compact else None
+    # Row selector for the per-row arrays
+    take = slice(0, n)
+    compacted_at = inventory.compacted_at
+    if keep is not None:
+        renumber = np.full(n, -1, dtype=np.int64)
+        renumber[keep] = np.arange(len(keep))
+        rows = [rows[i] for i in keep.tolist()]
+        alive = alive[keep]
+        removed = {int(renumber[row]): property_id for row, property_id in removed.items() if renumber[row] >= 0}
+        logged = renumber[history["row"]] >= 0
+        history = {key: array[logged] for key, array in history.items()}
+        history["row"] = renumber[history["row"]]
+        take = keep
+        n = len(keep)
+        compacted_at = inventory.version
+    removed_rows = np.array(sorted(removed), dtype=np.int32)
+    encoded = None
+    if keep is None and isinstance(rows, SnapshotRows) and len(rows.dirty) <= n * INCREMENTAL_LIMIT:
+        strings = _StringTable(rows.snapshot)
+        encoded = _encode_changed_fields(rows, n, strings)
+        if encoded is not None:
+            removed_ids = _encode_removed_ids(removed, removed_rows, strings, rows.snapshot)
+            if strings.dead_bytes(*encoded, removed_ids) > DEAD_STRINGS_LIMIT * strings.offsets[-1]:
+                encoded = None
+    if encoded is None:
+        strings = _StringTable()
+        encoded = _encode_fields(rows, n, strings)
+        removed_ids = _encode_removed_ids(removed, removed_rows, strings)
+    fields, arrays = encoded
+
+    arrays["alive"] = alive
+    for name, column in inventory.columns.items():
+        arrays[f"column:{name}"] = column[take]
+    for name, codes in inventory.codes.items():
+        codes = codes[take]
+        order = np.argsort(codes, kind="stable").astype(np.int32)
+        arrays[f"code:{name}"] = codes
+        arrays[f"index:{name}:order"] = order
+        bounds = np.searchsorted(codes[order], np.arange(len(inventory.labels[name]) + 1))
+        arrays[f"index:{name}:bounds"] = bounds.astype(np.int64)
+
+    arrays["changes:version"] = inventory.versions[take]
+    arrays["changes:created"] = inventory.created[take]
+    arrays["changes:removed_rows"] = removed_rows
+    arrays["changes:removed_ids"] = removed_ids
+    for key, array in history.items():
+        arrays[f"history:{key}"] = array
+
+    hashes = _id_hashes(rows, n, alive)
+    live_rows = np.flatnonzero(alive)
+    id_order = live_rows[np.argsort(hashes[live_rows], kind="stable")].astype(np.int32)
+    arrays["index:id_hash"] = hashes
+    arrays["index:id_order"] = id_order
+    arrays["index:id_sorted"] = hashes[id_order]
+    arrays["strings:offsets"] = np.asarray(strings.offsets, dtype=np.int64)
+    arrays["strings:blob"] = np.frombuffer(b"".join(strings.chunks), dtype=np.uint8)
+
+    # Lay the arrays out after the header. The header size depends on the
+    # offsets it records, so size it with placeholders plus room for digits.
+    layout = {key: [array.dtype.str, 0, int(array.size)] for key, array in arrays.items()}
+    header = {
+        "format": FORMAT_VERSION,
+        "version": version,
+        "change_version": inventory.version,
+        "history_horizon": inventory.horizon,
+        "compacted_at": compacted_at,
+        "size": n,
+        "fields": fields,
+        "columns": list(inventory.columns),
+        "categorical": {name: inventory.labels[name] for name in inventory.codes},
+        "arrays": layout,
+    }
+    data_start = PREAMBLE.size + len(json.dumps(header).encode("utf-8")) + 20 * len(arrays)
+    offset = data_start
+    for key, array in arrays.items():
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        layout[key][1] = offset
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode("utf-8")
+    assert PREAMBLE.size + len(header_bytes) <= data_start
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".snapshot-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(PREAMBLE.pack(MAGIC, len(header_bytes)))
+            f.write(header_bytes)
+            for key, array in arrays.items():
+                f.write(b"\0" * (layout[key][1] - f.tell()))
+                f.write(np.ascontiguousarray(array).tobytes())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+class Snapshot:
+    """Read-only view of a snapshot file; arrays are zero-copy over the mapping"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < PREAMBLE.size:
+                raise SnapshotError(f"{path} is truncated")
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREAMBLE.unpack_from(self.mmap, 0)
+        if magic != MAGIC:
+            raise SnapshotError(f"{path} is not an inventory snapshot")
+        try:
+            self._open(header_length)
+        except (ValueError, KeyError, TypeError, IndexError) as e:
+            # A damaged header: bad JSON, missing keys, arrays past the end
+            raise SnapshotError(f"{path} has a corrupt header: {e!r}") from e
+
+    def _open(self, header_length: int):
+        self.header = json.loads(self.mmap[PREAMBLE.size:PREAMBLE.size + header_length])
+        if self.header["format"] != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot format {self.header['format']}")
+        self.version = self.header["version"]
+        self.size = self.header["size"]
+        self.fields = self.header["fields"]
+        self._string_offsets = self.array("strings:offsets")
+        self._blob_offset = self.header["arrays"]["strings:blob"][1]
+        self._field_arrays = {
+            field["name"]: (
+                field["kind"],
+                self.array(f"field:{field['name']}") if field["kind"] != "null" else None,
+                self.array(f"state:{field['name']}"),
+            )
+            for field in self.fields
+        }
+        self._json_cache: Dict[int, object] = {}
+        self._id_sorted = self.array("index:id_sorted")
+        self._id_order = self.array("index:id_order")
+        if "changes:removed_rows" in self.header["arrays"]:
+            self._removed_rows = self.array("changes:removed_rows")
+            self._removed_ids = self.array("changes:removed_ids")
+        else:
+            self._removed_rows = self._removed_ids = np.zeros(0, dtype=np.int32)
+
+    def array(self, key: str) -> np.ndarray:
+        dtype, offset, count = self.header["arrays"][key]
+        return np.frombuffer(self.mmap, dtype=np.dtype(dtype), count=count, offset=offset)
+
+    def string(self, index: int) -> str:
+        start = self._blob_offset + int(self._string_offsets[index])
+        end = self._blob_offset + int(self._string_offsets[index + 1])
+        return self.mmap[start:end].decode("utf-8")
+
+    def strings(self, field: str) -> List[Optional[str]]:
+        """Decode one string field for every row"""
+        _, column, state = self._field_arrays[field]
+        return [self.string(i) if s == 1 else None for i, s in zip(column.tolist(), state.tolist())]
+
+    def find_row(self, property_id: str) -> Optional[int]:
+        """Row of a live listing by id: binary search on the hash index, then verify"""
+        _, ids, state = self._field_arrays["id"]
+        target = np.uint64(id_hash(property_id))
+        i = int(np.searchsorted(self._id_sorted, target))
+        while i < len(self._id_sorted) and self._id_sorted[i] == target:
+            row = int(self._id_order[i])
+            if state[row] == 1 and self.string(int(ids[row])) == property_id:
+                return row
+            i += 1
+        return None
+
+    def change_log(self):
+        """(change version, per-row last-written versions, per-row created versions)"""
+        if "changes:version" not in self.header["arrays"]:
+            zeros = np.zeros(self.size, dtype=np.int64)
+            return 0, zeros, zeros
+        return self.header["change_version"], self.array("changes:version"), self.array("changes:created")
+
+    def change_history(self):
+        """(horizon, ChangeHistory arrays by key) as written; no arrays before the history existed"""
+        if "history_horizon" not in self.header:
+            return self.header.get("change_version", 0), {}
+        prefix = "history:"
+        arrays = {key[len(prefix):]: self.array(key) for key in self.header["arrays"] if key.startswith(prefix)}
+        return self.header["history_horizon"], arrays
+
+    def removed_id(self, row: int) -> Optional[str]:
+        """Id of the listing removed from a dead row, if it was removed while logged"""
+        i = int(np.searchsorted(self._removed_rows, row))
+        if i < len(self._removed_rows) and self._removed_rows[i] == row:
+            return self.string(int(self._removed_ids[i]))
+        return None
+
+    def removed_ids(self) -> Dict[int, str]:
+        return {row: self.string(i) for row, i in zip(self._removed_rows.tolist(), self._removed_ids.tolist())}
+
+    def categorical_index(self, name: str):
+        """(rows ordered by code, per-code bounds into that order) for a categorical column"""
+        return self.array(f"index:{name}:order"), self.array(f"index:{name}:bounds")
+
+    def row(self, i: int) -> Dict:
+        """Rebuild the listing dict stored at row i"""
+        row = {}
+        for name, (kind, column, state) in self._field_arrays.items():
+            s = state[i]
+            if s == 0:
+                continue
+            if s == 2 or kind == "null":
+                row[name] = None
+            elif kind == "int":
+                row[name] = int(column[i])
+            elif kind == "float":
+                row[name] = float(column[i])
+            elif kind == "bool":
+                row[name] = bool(column[i])
+            elif kind == "str":
+                row[name] = self.string(int(column[i]))
+            else:
+                index = int(column[i])
+                value = self._json_cache.get(index, _MISSING)
+                if value is _MISSING:
+                    value = self._json_cache[index] = json.loads(self.string(index))
+                row[name] = value
+        return row
+
+
+class SnapshotRows:
+    """Row store for a snapshot-backed inventory
+
+    Behaves like the inventory's list of listing dicts, decoding rows from
+    the snapshot on access and keeping local writes on top. Only the
+    ROW_CACHE_SIZE most recently read rows stay decoded, so a scan over
+    every listing does not leave the whole snapshot decoded in memory.
+    Written rows are tracked so the next snapshot can patch just those.
+    """
+
+    def __init__(self, snapshot: Snapshot, alive: np.ndarray, cache_size: int = ROW_CACHE_SIZE):
+        self.snapshot = snapshot
+        self.alive = alive
+        self.size = snapshot.size
+        # Rows written since the snapshot, None once removed
+        self.written: Dict[int, Optional[Dict]] = {}
+        self._decode = functools.lru_cache(maxsize=cache_size)(snapshot.row)
+
+    @property
+    def dirty(self):
+        return self.written.keys()
+
+    def copy(self) -> "SnapshotRows":
+        rows = SnapshotRows.__new__(SnapshotRows)
+        rows.snapshot = self.snapshot
+        rows.alive = self.alive
+        rows.size = self.size
+        rows.written = dict(self.written)
+        # Both copies decode the same snapshot, so they can share its cache
+        rows._decode = self._decode
+        return rows
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i: int):
+        item = self.written.get(i, _MISSING)
+        if item is _MISSING:
+            if not 0 <= i < self.size:
+                raise IndexError(i)
+            item = self._decode(i) if self.alive[i] else None
+        return item
+
+    def __setitem__(self, i: int, value):
+        self.written[i] = value
+
+    def __iter__(self):
+        return (self[i] for i in range(self.size))
+
+    def append(self, value):
+        self.written[self.size] = value
+        self.size += 1
+
+
+class SnapshotStore:
+    """Directory of versioned snapshots plus a CURRENT pointer
+
+    Publishing writes inventory-<version>.snap and then atomically replaces
+    CURRENT, so readers always see either the old or the new version in
+    full. Writers serialize on an flock'd LOCK file. Versions found to be
+    unreadable are renamed to inventory-<version>.snap.corrupt, and their
+    numbers are never reused. The directory is created the first time the
+    lock is taken, so a store that is never written leaves no trace.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.current_path = os.path.join(directory, "CURRENT")
+        self.lock_path = os.path.join(directory, "LOCK")
+        self._seen = None
+
+    def path_for(self, version: int) -> str:
+        return os.path.join(self.directory, f"inventory-{version}.snap")
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def current_version(self) -> int:
+        try:
+            with open(self.current_path) as f:
+                content = f.read().strip()
+        except FileNotFoundError:
+            return 0
+        try:
+            return int(content or 0)
+        except ValueError:
+            raise SnapshotError(f"{self.current_path} does not hold a version number") from None
+
+    def versions(self) -> List[int]:
+        """Versions with a snapshot file on disk, newest first"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = (re.fullmatch(r"inventory-(\d+)\.snap", name) for name in names)
+        return sorted((int(match.group(1)) for match in found if match), reverse=True)
+
+    def recover(self) -> Optional[int]:
+        """Point CURRENT at the newest readable version after the current one failed to open
+
+        Unreadable versions are moved aside. Returns the version now current,
+        or None if no readable version is left. The caller must hold lock().
+        """
+        for version in self.versions():
+            path = self.path_for(version)
+            try:
+                Snapshot(path)
+            except SnapshotError:
+                os.replace(path, f"{path}.corrupt")
+                continue
+            self._set_current(version)
+            return version
+        return None
+
+    def _set_current(self, version: int):
+        fd, tmp_path = tempfile.mkstemp(prefix=".current-", dir=self.directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(str(version))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, self.current_path)
+
+    def changed(self) -> bool:
+        """Cheap check (one stat call) for whether CURRENT moved since the last open"""
+        try:
+            st = os.stat(self.current_path)
+        except FileNotFoundError:
+            return False
+        return (st.st_ino, st.st_mtime_ns) != self._seen
+
+    def publish(self, inventory, compact: bool = False) -> int:
+        """Write inventory as the next version; the caller must hold lock()
+
+        Pass compact only if the caller switches to the published version
+        afterwards, since compacting renumbers rows (see write_snapshot).
+        """
+        version = self.current_version() + 1
+        while os.path.exists(f"{self.path_for(version)}.corrupt"):
+            version += 1
+        write_snapshot(inventory, self.path_for(version), version, compact)
+        self._set_current(version)
+
+        for old in range(version - KEEP_VERSIONS, 0, -1):
+            try:
+                os.unlink(self.path_for(old))
+            except FileNotFoundError:
+                break
+        return version
+
+    def open(self, mark_seen: bool = True) -> Optional[Snapshot]:
+        """Map the current version, or None if nothing has been published
+
+        Unless mark_seen is false, changed() reports False until CURRENT moves
+        again; a caller that is not swapping its inventory to the result
+        should pass False.
+        """
+        for _ in range(3):
+            try:
+                st = os.stat(self.current_path)
+                version = self.current_version()
+                snapshot = Snapshot(self.path_for(version)) if version else None
+            except FileNotFoundError:
+                # CURRENT moved on and pruned the version we read; try again
+                if not os.path.exists(self.current_path):
+                    return None
+                continue
+            if mark_seen:
+                self._seen = (st.st_ino, st.st_mtime_ns)
+            return snapshot
+        raise SnapshotError(f"Could not open a stable snapshot in {self.directory}")
@@ -0,0 +1,125 @@
+"""Server-Sent Event subscriptions for pushing listings to connected clients
+
+Subscribers are grouped by their normalized filter, so a change is matched
+once per distinct filter however many clients share it. Each subscription has
+a bounded queue: when a client reads slower than events arrive and its queue
+fills, the pending events are dropped and replaced with a single "resync"
+event carrying the last version it actually received, after which the client should
+catch up through /api/changes. Keepalives are queued for idle subscribers by
+one periodic sweep rather than a timer per connection, so an idle connection
+costs a queue and a suspended task.
+"""
+import asyncio
+import json
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+KEEPALIVE = (b": keepalive\n\n", None)
+
+
+def encode_event(event: str, data, event_id: Optional[int] = None) -> bytes:
+    """One SSE frame; data is serialized as compact JSON"""
+    frame = f"event: {event}\n"
+    if event_id is not None:
+        frame += f"id: {event_id}\n"
+    return (frame + f"data: {json.dumps(data, separators=(',', ':'))}\n\n").encode("utf-8")
+
+
+class Subscription:
+    __slots__ = ("key", "queue", "version", "sent", "dropped")
+
+    def __init__(self, key: Tuple, version: int, buffer_size: int):
+        self.key = key
+        # (frame, change version or None) pairs waiting to be written
+        self.queue: asyncio.Queue = asyncio.Queue(buffer_size)
+        # Last change version queued, and the last one written to the client
+        self.version = version
+        self.sent = version
+        self.dropped = 0
+
+    def offer(self, frame: bytes, version: int) -> bool:
+        """Queue a frame without waiting; on overflow fall back to a resync
+
+        Returns False if the queue overflowed.
+        """
+        queued = True
+        try:
+            self.queue.put_nowait((frame, version))
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait((encode_event("resync", {"since": self.sent}), None))
+            queued = False
+        self.version = version
+        return queued
+
+
+class SubscriptionHub:
+    """Live subscriptions of this worker, grouped by filter key"""
+
+    def __init__(self, buffer_size: int = 100, limit: int = 10000):
+        self.buffer_size = buffer_size
+        self.limit = limit
+        self.groups: Dict[Tuple, Set[Subscription]] = {}
+        self.count = 0
+
+    def full(self) -> bool:
+        return self.count >= self.limit
+
+    def subscribe(self, key: Tuple, version: int) -> Subscription:
+        subscription = Subscription(key, version, self.buffer_size)
+        self.groups.setdefault(key, set()).add(subscription)
+        self.count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        group = self.groups.get(subscription.key)
+        if group is None or subscription not in group:
+            return
+        group.discard(subscription)
+        if not group:
+            del self.groups[subscription.key]
+        self.count -= 1
+
+    def publish(self, key: Tuple, frames: Iterable[Tuple[bytes, int]]) -> int:
+        """Queue (frame, version) pairs for every subscriber of key; returns the overflow count"""
+        frames = list(frames)
+        overflows = 0
+        for subscription in self.groups.get(key, ()):
+            for frame, version in frames:
+                if version > subscription.version and not subscription.offer(frame, version):
+                    overflows += 1
+        return overflows
+
+    def advance(self, version: int):
+        """Mark every subscriber as up to date with version once its queue drains"""
+        for group in self.groups.values():
+            for subscription in group:
+                subscription.version = max(subscription.version, version)
+                if subscription.queue.empty():
+                    subscription.sent = subscription.version
+
+    def keepalive(self):
+        """Queue a keepalive comment for subscribers with nothing pending"""
+        for group in self.groups.values():
+            for subscription in group:
+                if subscription.queue.empty():
+                    subscription.queue.put_nowait(KEEPALIVE)
+
+    async def stream(self, key: Tuple, version: int, first: Optional[bytes] = None):
+        """Frames for one connection until the client goes away
+
+        The subscription is registered when the response starts iterating,
+        so a connection dropped before then never leaves one behind.
+        """
+        subscription = self.subscribe(key, version)
+        try:
+            if first is not None:
+                yield first
+            while True:
+                frame, version = await subscription.queue.get()
+                if version is not None:
+                    subscription.sent = version
+                yield frame
+        finally:
+            self.unsubscribe(subscription)
@@ -0,0 +1,373 @@
+"""Offline load test for the API endpoints
+
+Loads a synthetic inventory, then drives each endpoint at a set of
+concurrency levels, either in-process through the ASGI interface (no network,
+measures the app alone) or over HTTP against a local uvicorn started on the
+same snapshot. Reports throughput and latency percentiles, and can save the
+run as a baseline and flag regressions against it.
+
+    python benchmarks/load_test.py --size 20000 --concurrency 1,16 --save-baseline
+    python benchmarks/load_test.py --size 20000 --concurrency 1,16   # compare
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from synthetic import BACKEND_DIR, MARKETS, generate_properties, import_server, load_listings
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "load-baseline.json")
+
+# A request is (method, path, query params, JSON body)
+Request = Tuple[str, str, Dict, Optional[Dict]]
+
+
+def property_queries(rng: random.Random, ids: List[str]) -> Request:
+    city, state, _, median = rng.choice(MARKETS)
+    params = rng.choice([
+        {"city": city, "max_price": int(median * 0.8)},
+        {"state": state, "min_bedrooms": 4},
+        {"city": city, "property_type": "Multi Family", "investment_type": "rental"},
+        {"min_price": int(median), "max_price": int(median * 1.05), "investment_type": "flip"},
+        {"q": f"renovated {city}", "max_price": int(median)},
+    ])
+    return "GET", "/api/properties", params, None
+
+
+def deal_inputs(rng: random.Random, ids: List[str]) -> Request:
+    price = rng.randint(60, 600) * 1000
+    body = {
+        "purchase_price": price,
+        "down_payment_percent": rng.choice([3.5, 10, 20, 25]),
+        "interest_rate": round(rng.uniform(4, 9), 2),
+        "loan_term_years": rng.choice([15, 30]),
+        "monthly_rent": int(price * rng.uniform(0.006, 0.012)),
+        "estimated_expenses": int(price * 0.003),
+        "repair_costs": rng.randint(0, 60) * 1000,
+        "arv": int(price * rng.uniform(1.1, 1.6)) if rng.random() < 0.5 else None,
+    }
+    return "POST", "/api/calculate-deal", {}, body
+
+
+SCENARIOS: Dict[str, Callable[[random.Random, List[str]], Request]] = {
+    "properties": property_queries,
+    "property": lambda rng, ids: ("GET", f"/api/properties/{rng.choice(ids)}", {}, None),
+    "analysis": lambda rng, ids: ("POST", "/api/analysis", {"property_id": rng.choice(ids)}, None),
+    "calculate-deal": deal_inputs,
+    "market-analysis": lambda rng, ids: ("GET", "/api/market-analysis", {"city": rng.choice(MARKETS)[0]}, None),
+    "markets": lambda rng, ids: ("GET", "/api/markets", {}, None),
+    # A burst on one popular page: every client sends the same query
+    "popular": lambda rng, ids: ("GET", "/api/properties", {"city": MARKETS[0][0], "facets": "true"}, None),
+}
+
+
+class ASGIDriver:
+    """Calls the app's ASGI entry point directly, one scope per request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def connect(self):
+        return None
+
+    async def close(self, connection):
+        pass
+
+    async def request(self, connection, method: str, path: str, params: Dict, body: Optional[Dict]) -> int:
+        payload = json.dumps(body).encode() if body is not None else b""
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urllib.parse.urlencode(params).encode(),
+            "root_path": "",
+            "headers": [
+                (b"host", b"benchmark"), (b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        status = 0
+        finished = asyncio.Event()
+        delivered = False
+
+        async def receive():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await finished.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and not message.get("more_body"):
+                finished.set()
+
+        await self.app(scope, receive, send)
+        finished.set()
+        return status
+
+
+class HTTPDriver:
+    """Minimal keep-alive HTTP/1.1 client, one connection per concurrent worker
+
+    Written against asyncio streams so the client stays on one thread and
+    adds as little of its own overhead to the measurements as possible.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+
+    async def connect(self):
+        return await asyncio.open_connection(self.host, self.port)
+
+    async def close(self, connection):
+        _, writer = connection
+        writer.close()
+
+    async def request(self, connection, method: str, path: str, params: Dict, body: Optional[Dict]) -> int:
+        reader, writer = connection
+        payload = json.dumps(body).encode() if body is not None else b""
+        target = f"{path}?{urllib.parse.urlencode(params)}" if params else path
+        writer.write(
+            f"{method} {urllib.parse.quote(target, safe='/?=&%+')} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int((await reader.readline()).strip(), 16)
+                await reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await reader.readexactly(int(headers.get("content-length", 0)))
+        return status
+
+
+async def run_level(driver, scenario, ids: List[str], concurrency: int, requests: int, warmup: int, seed: int) -> Dict:
+    """Issue requests split over concurrency workers and summarize latencies"""
+    rng = random.Random(seed)
+    plan = [scenario(rng, ids) for _ in range(warmup + requests)]
+    latencies: List[float] = []
+    errors = 0
+
+    async def worker(connection, todo: List[Request], record: bool):
+        nonlocal errors
+        for method, path, params, body in todo:
+            start = time.perf_counter()
+            try:
+                status = await driver.request(connection, method, path, params, body)
+            except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+                status = 0
+            if record:
+                latencies.append(time.perf_counter() - start)
+                errors += status >= 400 or status == 0
+
+    connections = [await driver.connect() for _ in range(concurrency)]
+    try:
+        await asyncio.gather(*(worker(c, plan[i:warmup:concurrency], False) for i, c in enumerate(connections)))
+        measured = plan[warmup:]
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(c, measured[i::concurrency], True) for i, c in enumerate(connections)))
+        elapsed = time.perf_counter() - started
+    finally:
+        for connection in connections:
+            await driver.close(connection)
+
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]) if len(ms) else (0.0, 0.0, 0.0)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(float(ms.mean()), 3) if len(ms) else 0.0,
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(snapshot_dir: str, workers: int) -> Tuple[subprocess.Popen, int]:
+    """Run uvicorn on the benchmark snapshot and wait until it answers"""
+    port = free_port()
+    env = dict(os.environ, SNAPSHOT_DIR=snapshot_dir, WEB_CONCURRENCY=str(workers))
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        cwd=BACKEND_DIR, env=env,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with status {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1) as s:
+                s.sendall(b"GET /api/health HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                if s.recv(64).startswith(b"HTTP/1.1 200"):
+                    return process, port
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("uvicorn did not come up within 60s")
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Describe every result that got slower than the baseline by more than tolerance"""
+    regressions = []
+    for key, current in results.items():
+        previous = baseline.get("results", {}).get(key)
+        if previous is None:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {previous['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+        if previous["throughput"] and current["throughput"] < previous["throughput"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {previous['throughput']:.1f}/s -> {current['throughput']:.1f}/s")
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{key}: errors {previous['errors']} -> {current['errors']}")
+    return regressions
+
+
+def print_table(results: Dict):
+    print(f"{'transport:endpoint:concurrency':<40} {'req/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for key, r in results.items():
+        print(f"{key:<40} {r['throughput']:>10.1f} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['errors']:>7}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=10000, help="synthetic listings to load")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--endpoints", default=",".join(SCENARIOS), help="comma-separated subset of: " + ", ".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,8,32", help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each level")
+    parser.add_argument("--transport", default="inprocess,http", help="inprocess, http or both")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the http transport")
+    parser.add_argument("--output", help="write the full results as JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file to save to or compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown before a result counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = set(endpoints) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",")]
+    transports = [t for t in args.transport.split(",") if t]
+
+    server = import_server()
+    properties = generate_properties(args.size, args.seed)
+    started = time.perf_counter()
+    load_listings(server, properties)
+    print(f"Loaded {len(server.INVENTORY)} listings in {time.perf_counter() - started:.1f}s")
+    ids = [p["id"] for p in properties]
+
+    results = {}
+    for transport in transports:
+        process = None
+        if transport == "inprocess":
+            driver = ASGIDriver(server.app)
+        elif transport == "http":
+            process, port = start_server(server.SNAPSHOT_DIR, args.workers)
+            driver = HTTPDriver("127.0.0.1", port)
+        else:
+            raise SystemExit(f"Unknown transport: {transport}")
+        try:
+            for endpoint in endpoints:
+                for level in levels:
+                    key = f"{transport}:{endpoint}:c{level}"
+                    level_run = run_level(driver, SCENARIOS[endpoint], ids, level, args.requests, args.warmup, args.seed)
+                    results[key] = asyncio.run(level_run)
+                    print(f"  {key}: {results[key]['throughput']:.1f} req/s, p95 {results[key]['p95_ms']:.2f}ms")
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "size": len(server.INVENTORY),
+            "seed": args.seed,
+            "requests": args.requests,
+            "workers": args.workers,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    print()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("size") != report["meta"]["size"]:
+        print(f"\nBaseline was recorded with {baseline['meta'].get('size')} listings; comparisons may not be meaningful")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Micro-benchmarks for the analysis math, filter chain and market aggregations
+
+Each benchmark runs at every requested inventory size (or, for the market
+history ones, every --history-days length) and is repeated until it has taken
+at least --min-time seconds (or --max-repeats runs), so small sizes get stable
+numbers and large ones still finish. Results are printed as a table and can
+be written as JSON for comparing before/after an optimization.
+
+    python benchmarks/micro.py --sizes 1000,10000,100000 --output before.json
+    python benchmarks/micro.py --sizes 1000,10000,100000 --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+from synthetic import MARKETS, generate_properties, import_server, iter_market_history, load_listings
+
+# Filter combinations run on every call of the filter benchmarks
+FILTERS = [
+    {"city": "Atlanta", "max_price": 200000},
+    {"state": "TX", "min_bedrooms": 4},
+    {"property_type": "Multi Family", "investment_type": "rental", "recommendation": "Good Rental"},
+    {"min_price": 150000, "max_price": 160000, "meets_70_rule": True},
+]
+
+
+def measure(fn: Callable[[], object], min_time: float, max_repeats: int) -> List[float]:
+    """Wall-clock durations of repeated calls to fn"""
+    timings = []
+    while not timings or (sum(timings) < min_time and len(timings) < max_repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def analysis_benchmarks(server, properties: List[Dict]) -> Dict[str, Callable[[], object]]:
+    rng = random.Random(0)
+    loans = [(rng.randint(50, 800) * 1000, rng.uniform(3, 9), rng.choice([15, 30])) for _ in properties]
+
+    def flip():
+        for p in properties:
+            server.calculate_flip_analysis(p)
+
+    def rental():
+        for p in properties:
+            server.calculate_rental_analysis(p)
+
+    def amortization():
+        for loan, rate, years in loans:
+            server.monthly_mortgage_payment(loan, rate, years)
+
+    return {"flip_analysis": flip, "rental_analysis": rental, "amortization": amortization}
+
+
+def inventory_benchmarks(server, loop: asyncio.AbstractEventLoop) -> Dict[str, Callable[[], object]]:
+    # Only the mask: bitmap and column predicates
+    def filter_mask():
+        for params in FILTERS:
+            server.listing_mask(server.PropertyFilter(**params))
+
+    # The full get_properties handler: mask plus building each listing payload
+    def filter_chain():
+        for params in FILTERS:
+            loop.run_until_complete(server.get_properties(criteria=server.PropertyFilter(**params)))
+
+    # The aggregation itself, and the endpoints built on it. They would
+    # serve a cached copy until the inventory changes, so it is dropped
+    # before every call to time their whole work.
+    def market_aggregates():
+        server.compute_market_aggregates(server.INVENTORY)
+
+    def market_analysis():
+        server._market_aggregates = None
+        loop.run_until_complete(server.get_market_analysis())
+
+    def markets():
+        server._market_aggregates = None
+        loop.run_until_complete(server.get_markets())
+
+    return {
+        "filter_mask": filter_mask,
+        "filter_chain": filter_chain,
+        "market_aggregates": market_aggregates,
+        "market_analysis": market_analysis,
+        "markets": markets,
+    }
+
+
+def history_benchmarks(history) -> Dict[str, Callable[[], object]]:
+    # Rolling-window trends over the tail of the history, and series read
+    # from the pre-rolled monthly buckets and from the raw days
+    def market_trends():
+        history.trends()
+
+    def history_monthly():
+        history.series("month", 60)
+
+    def history_daily():
+        history.series("day", 365)
+
+    return {"market_trends": market_trends, "history_monthly": history_monthly, "history_daily": history_daily}
+
+
+def load_history(server, days: int, seed: int):
+    """In-memory market history of days daily snapshots for every synthetic market"""
+    history = server.MarketHistory()
+    for day, snapshot in iter_market_history(days, seed):
+        history.append(day, snapshot)
+    return history
+
+
+def load_inventory(server, properties: List[Dict]):
+    """Replace the server's inventory with exactly these listings"""
+    server.INVENTORY = server.Inventory(server.analyze_listing, server.listing_categories)
+    load_listings(server, properties)
+
+
+def print_table(results: List[Dict], previous: Dict):
+    header = f"{'benchmark':<18} {'rows':>9} {'runs':>5} {'median ms':>11} {'ns/row':>10}"
+    print(header + (f" {'vs before':>10}" if previous else ""))
+    for r in results:
+        line = f"{r['benchmark']:<18} {r['rows']:>9} {r['repeats']:>5} {r['median_s'] * 1000:>11.3f} {r['ns_per_row']:>10.1f}"
+        before = previous.get((r["benchmark"], r["rows"]))
+        if before:
+            line += f" {before['median_s'] / r['median_s']:>9.2f}x"
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated row counts, e.g. 1000,10000,100000,1000000")
+    parser.add_argument("--history-days", default="365,1825,3650", help="comma-separated market history lengths in days")
+    parser.add_argument("--only", help="comma-separated subset of benchmarks to run")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-time", type=float, default=0.5, help="keep repeating a benchmark until it has run this long")
+    parser.add_argument("--max-repeats", type=int, default=50)
+    parser.add_argument("--output", help="write results as JSON here")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of the table")
+    parser.add_argument("--compare", help="earlier --output file to report speedups against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    sizes = [int(float(s)) for s in args.sizes.split(",")]
+    only = set(args.only.split(",")) if args.only else None
+
+    # No persistence: the benchmarks swap inventories freely
+    server = import_server("")
+    # Measure each call's own work rather than a result shared from the last one
+    server.FLIGHTS.window = 0
+    # One loop for every async handler call, so its setup is not timed
+    loop = asyncio.new_event_loop()
+    results = []
+
+    def run(benchmarks: Dict[str, Callable[[], object]], size: int):
+        for name, fn in benchmarks.items():
+            if only and name not in only:
+                continue
+            timings = measure(fn, args.min_time, args.max_repeats)
+            median = statistics.median(timings)
+            results.append({
+                "benchmark": name,
+                "rows": size,
+                "repeats": len(timings),
+                "min_s": min(timings),
+                "median_s": median,
+                "mean_s": statistics.fmean(timings),
+                "ns_per_row": median / size * 1e9,
+            })
+            if not args.json:
+                print(f"  {name} @ {size}: {median * 1000:.3f} ms", file=sys.stderr)
+
+    for size in sizes:
+        properties = generate_properties(size, args.seed)
+        load_inventory(server, properties)
+        run({**analysis_benchmarks(server, properties), **inventory_benchmarks(server, loop)}, size)
+    # History sizes are market-days: days times the number of markets
+    for days in (int(float(d)) for d in args.history_days.split(",")):
+        run(history_benchmarks(load_history(server, days, args.seed)), days * len(MARKETS))
+    loop.close()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return 0
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {(r["benchmark"], r["rows"]): r for r in json.load(f)["results"]}
+    print_table(results, previous)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""Startup cost of the backend: module import, inventory open, first request
+
+Every measurement runs in a fresh interpreter so nothing is already
+imported. The first run seeds the snapshot directory; later runs map it, as a
+restarted worker would. -X importtime output from one extra run is summarized
+to show which packages dominate the import.
+
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+from synthetic import BACKEND_DIR
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+server.ensure_inventory()
+opened = time.perf_counter()
+from fastapi.testclient import TestClient
+client = TestClient(server.app)
+ready = time.perf_counter()
+client.get("/api/properties/" + next(server.INVENTORY.properties())["id"])
+answered = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "open_s": opened - imported, "first_request_s": answered - ready}))
+"""
+
+
+def run_probe(env) -> dict:
+    probe = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True)
+    return json.loads(probe.stdout.strip().splitlines()[-1])
+
+
+def import_breakdown(env, top: int) -> list:
+    """Cumulative import time per top-level package, largest first"""
+    command = [sys.executable, "-X", "importtime", "-c", "import server"]
+    stderr = subprocess.run(command, cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True).stderr
+    totals = defaultdict(int)
+    children = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip())) // 2
+        # Children are listed before their parent; keep the direct imports
+        # of server so nested modules are not counted twice
+        if depth == 1:
+            children.append((name.strip(), int(cumulative)))
+        elif depth == 0:
+            if name.strip() == "server":
+                for child, us in children:
+                    totals[child.split(".")[0]] += us
+            children = []
+    return sorted(({"package": name, "ms": round(us / 1000, 1)} for name, us in totals.items()), key=lambda r: -r["ms"])[:top]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="packages to show in the import breakdown")
+    parser.add_argument("--json", action="store_true", help="print JSON instead of text")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as snapshot_dir:
+        env = dict(os.environ, SNAPSHOT_DIR=snapshot_dir)
+        first = run_probe(env)
+        runs = [run_probe(env) for _ in range(args.runs)]
+        breakdown = import_breakdown(env, args.top)
+
+    report = {
+        "first_boot": first,
+        "restart_median": {key: statistics.median(run[key] for run in runs) for key in first},
+        "import_breakdown": breakdown,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+
+    print(f"{'':<16} {'import':>9} {'open':>9} {'first req':>10}")
+    for label, timings in (("first boot", report["first_boot"]), ("restart median", report["restart_median"])):
+        import_ms, open_ms, request_ms = (timings[key] * 1000 for key in ("import_s", "open_s", "first_request_s"))
+        print(f"{label:<16} {import_ms:>7.1f}ms {open_ms:>7.1f}ms {request_ms:>8.1f}ms")
+    print("\nImport time by top-level package:")
+    for row in breakdown:
+        print(f"  {row['package']:<24} {row['ms']:>8.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+"""Synthetic inventories shaped like the listings in backend/server.py
+
+Listings are generated deterministically from a seed so benchmark runs are
+comparable, and carry every field of the MOCK_PROPERTIES schema including
+per-market trends. import_server() imports the backend app against a
+throwaway snapshot directory so runs never touch backend/data.
+"""
+import asyncio
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import uuid
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+
+# (city, state, zip prefix, median price)
+MARKETS = [
+    ("Atlanta", "GA", "303", 240000),
+    ("Phoenix", "AZ", "850", 330000),
+    ("Cleveland", "OH", "441", 110000),
+    ("Memphis", "TN", "381", 140000),
+    ("Jacksonville", "FL", "322", 230000),
+    ("Birmingham", "AL", "352", 130000),
+    ("Indianapolis", "IN", "462", 180000),
+    ("Kansas City", "MO", "641", 190000),
+    ("San Antonio", "TX", "782", 220000),
+    ("Houston", "TX", "770", 250000),
+    ("Dallas", "TX", "752", 310000),
+    ("Columbus", "OH", "432", 200000),
+    ("Detroit", "MI", "482", 90000),
+    ("Tampa", "FL", "336", 300000),
+    ("Charlotte", "NC", "282", 290000),
+    ("Raleigh", "NC", "276", 320000),
+    ("Nashville", "TN", "372", 360000),
+    ("Louisville", "KY", "402", 170000),
+    ("Oklahoma City", "OK", "731", 160000),
+    ("Tulsa", "OK", "741", 150000),
+    ("Little Rock", "AR", "722", 140000),
+    ("St. Louis", "MO", "631", 150000),
+    ("Pittsburgh", "PA", "152", 160000),
+    ("Baltimore", "MD", "212", 190000),
+]
+PROPERTY_TYPES = [("Single Family", 70), ("Multi Family", 20), ("Townhouse", 6), ("Condo", 4)]
+GRADES = ["A", "A-", "B+", "B", "B-", "C+", "C"]
+STREETS = [
+    "Peachtree", "Maple", "Oak", "Cedar", "Elm", "Pine", "Lake", "Hill", "Park", "Main", "Desert View", "River", "Sunset",
+    "Highland", "Walnut", "Forest",
+]
+SUFFIXES = ["St", "Ave", "Dr", "Rd", "Ln", "Blvd", "Way", "Ct"]
+AGENTS = [
+    "Sarah Johnson", "Mike Rodriguez", "Linda Thompson", "Robert Davis", "Jennifer Wilson", "David Brown", "Michael Chen",
+    "Lisa Rodriguez", "Robert Kim", "Angela Moore", "James Carter", "Priya Patel",
+]
+PITCHES = [
+    "Solid investment opportunity in a growing market.",
+    "Great rental potential close to schools and transit.",
+    "Needs cosmetic updates, strong flip candidate.",
+    "Turnkey property with long-term tenants in place.",
+    "Value-add opportunity in an improving neighborhood.",
+    "Recently renovated with new roof and HVAC.",
+]
+IMAGES = [
+    "https://images.unsplash.com/photo-1568605114967-8130f3a36994?w=500",
+    "https://images.unsplash.com/photo-1570129477492-45c003edd2be?w=500",
+    "https://images.unsplash.com/photo-1564013799919-ab600027ffc6?w=500",
+]
+
+
+def market_trends(rng: random.Random) -> Dict:
+    appreciation = round(rng.uniform(1.0, 13.0), 1)
+    if appreciation > 10:
+        price_trend = "Rapidly Increasing"
+    elif appreciation > 6:
+        price_trend = "Increasing"
+    elif appreciation > 3:
+        price_trend = "Slowly Increasing"
+    else:
+        price_trend = "Stable"
+    return {
+        "appreciation_rate": appreciation,
+        "market_type": rng.choice(["Buyer's Market", "Balanced Market", "Seller's Market"]),
+        "days_on_market_avg": rng.randint(20, 80),
+        "price_trend": price_trend,
+        "rental_demand": rng.choice(["Moderate", "High", "Very High", "Extremely High"]),
+    }
+
+
+def iter_properties(count: int, seed: int = 0, markets: Optional[int] = None) -> Iterator[Dict]:
+    """Yield count synthetic listings; the same seed yields the same listings"""
+    rng = random.Random(seed)
+    chosen = MARKETS[:markets] if markets else MARKETS
+    trends = {(city, state): market_trends(rng) for city, state, _, _ in chosen}
+    types = [name for name, _ in PROPERTY_TYPES]
+    weights = [weight for _, weight in PROPERTY_TYPES]
+
+    for i in range(count):
+        city, state, zip_prefix, median = rng.choice(chosen)
+        property_type = rng.choices(types, weights)[0]
+        multi = property_type == "Multi Family"
+        bedrooms = rng.randint(4, 8) if multi else rng.randint(1, 5)
+        price = int(median * rng.lognormvariate(0, 0.35) * (1.8 if multi else 1.0)) // 500 * 500
+        zipcode = f"{zip_prefix}{rng.randint(0, 99):02d}"
+        address = f"{rng.randint(100, 9999)} {rng.choice(STREETS)} {rng.choice(SUFFIXES)} #{i}, {city}, {state} {zipcode}"
+        yield {
+            "id": str(uuid.uuid5(uuid.NAMESPACE_URL, address)),
+            "address": address,
+            "city": city,
+            "state": state,
+            "zipcode": zipcode,
+            "price": price,
+            "bedrooms": bedrooms,
+            "bathrooms": max(1, bedrooms - rng.randint(0, 2)),
+            "sqft": bedrooms * rng.randint(380, 650),
+            "property_type": property_type,
+            "year_built": rng.randint(1920, 2022),
+            "estimated_rent": int(price * rng.uniform(0.006, 0.013)),
+            "estimated_arv": int(price * rng.uniform(1.05, 1.7)),
+            "estimated_repair_cost": int(price * rng.uniform(0.02, 0.25)) // 100 * 100,
+            "neighborhood_quality": rng.choice(GRADES),
+            "days_on_market": rng.randint(1, 180),
+            "property_taxes": int(price * rng.uniform(0.008, 0.022)),
+            "hoa_fees": rng.choice([0, 0, 0, 50, 120, 250]),
+            "image_url": rng.choice(IMAGES),
+            "description": f"{rng.choice(PITCHES)} {bedrooms} bed {property_type.lower()} in {city}.",
+            "listing_agent": rng.choice(AGENTS),
+            "listing_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "market_trends": dict(trends[(city, state)]),
+        }
+
+
+def generate_properties(count: int, seed: int = 0, markets: Optional[int] = None) -> List[Dict]:
+    """List form of iter_properties"""
+    return list(iter_properties(count, seed, markets))
+
+
+def iter_market_history(
+    days: int, seed: int = 0, markets: Optional[int] = None, end_day: int = 20000
+) -> Iterator[Tuple[int, Dict]]:
+    """Yield (day number, snapshot) pairs of daily market metrics ending at end_day
+
+    Each market's median price compounds at its own appreciation rate with
+    some day-to-day noise; rent, days on market and listing counts drift
+    around market-specific levels.
+    """
+    rng = random.Random(seed)
+    chosen = MARKETS[:markets] if markets else MARKETS
+    growth = {city: rng.uniform(-0.02, 0.12) for city, _, _, _ in chosen}
+    for day in range(end_day - days + 1, end_day + 1):
+        years = (day - end_day) / 365
+        snapshot = {}
+        for city, state, _, median in chosen:
+            price = median * (1 + growth[city]) ** years * rng.uniform(0.98, 1.02)
+            snapshot[f"{city}, {state}"] = {
+                "median_price": price,
+                "median_rent": price * 0.009 * rng.uniform(0.97, 1.03),
+                "median_days_on_market": rng.uniform(25, 70),
+                "listings": float(rng.randint(200, 2000)),
+            }
+        yield day, snapshot
+
+
+def import_server(snapshot_dir: Optional[str] = None):
+    """Import backend/server.py with persistence pointed at snapshot_dir
+
+    A temporary directory, removed at exit, is used when none is given.
+    Per-client rate limits are off unless set in the environment, since
+    benchmarks send far more requests from one address than a client may.
+    Must run before anything else imports the server module, since it reads
+    its settings at import time.
+    """
+    if "server" in sys.modules:
+        return sys.modules["server"]
+    if snapshot_dir is None:
+        snapshot_dir = tempfile.mkdtemp(prefix="bench-snapshots-")
+        atexit.register(shutil.rmtree, snapshot_dir, ignore_errors=True)
+    os.environ["SNAPSHOT_DIR"] = snapshot_dir
+    for lane in ("LOOKUP", "SEARCH", "ALERTS"):
+        os.environ.setdefault(f"RATE_{lane}", "0")
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+    import server
+    return server
+
+
+def load_listings(server, properties: List[Dict]):
+    """Bulk-load listings into an imported server and publish its snapshot before returning"""
+    async def load():
+        await server.load_properties(properties)
+        await server.flush_inventory_snapshot()
+    asyncio.run(load())
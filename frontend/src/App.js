@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 
 function App() {
@@ -34,11 +34,33 @@ function App() {
   });
   const [calculatorResult, setCalculatorResult] = useState(null);
 
+  // Change version and query of the loaded property list, for polling deltas
+  const syncState = useRef({ version: 0, query: '' });
+  // Push stream of new and repriced listings, and the pending sync it triggered
+  const streamRef = useRef(null);
+  const syncTimer = useRef(null);
+  // Time before which polling holds off after the server asked it to
+  const retryAt = useRef(0);
+
   const backendUrl = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+  const syncInterval = 30000;
+
+  // Hold off polling for the Retry-After of a refused request (429, 503),
+  // or one sync interval when the server gave none
+  const backOff = (response) => {
+    const seconds = parseFloat(response.headers.get('Retry-After'));
+    retryAt.current = Date.now() + (seconds >= 0 ? seconds * 1000 : syncInterval);
+  };
 
   useEffect(() => {
     fetchProperties();
     fetchMarkets();
+    const timer = setInterval(syncProperties, syncInterval);
+    return () => {
+      clearInterval(timer);
+      clearTimeout(syncTimer.current);
+      if (streamRef.current) streamRef.current.close();
+    };
   }, []);
 
   const fetchProperties = async () => {
@@ -50,8 +72,16 @@ function App() {
       });
       
       const response = await fetch(`${backendUrl}/api/properties?${queryParams}`);
+      if (!response.ok) {
+        // Keep showing, and syncing, the list already loaded
+        backOff(response);
+        console.error('Error fetching properties:', response.status);
+        return;
+      }
       const data = await response.json();
       setProperties(data.properties || []);
+      syncState.current = { version: data.version || 0, query: queryParams.toString() };
+      openStream(queryParams.toString());
     } catch (error) {
       console.error('Error fetching properties:', error);
     } finally {
@@ -59,9 +89,65 @@ function App() {
     }
   };
 
+  // Listen for listings pushed for the current filters; bursts of events
+  // collapse into one delta sync
+  const openStream = (query) => {
+    if (streamRef.current) streamRef.current.close();
+    const stream = new EventSource(`${backendUrl}/api/stream/listings?${query}`);
+    const scheduleSync = () => {
+      if (syncTimer.current) return;
+      syncTimer.current = setTimeout(() => {
+        syncTimer.current = null;
+        syncProperties();
+      }, Math.max(500, retryAt.current - Date.now()));
+    };
+    stream.addEventListener('listing', scheduleSync);
+    stream.addEventListener('resync', scheduleSync);
+    streamRef.current = stream;
+  };
+
+  // Apply only the listings added, updated or removed since the last load
+  const syncProperties = async () => {
+    const { version, query } = syncState.current;
+    if (!version || Date.now() < retryAt.current) return;
+    try {
+      const response = await fetch(`${backendUrl}/api/changes?since=${version}${query ? `&${query}` : ''}`);
+      if (!response.ok) {
+        // The list and version stay as they were, so the next sync picks up from here
+        backOff(response);
+        console.error('Error syncing properties:', response.status);
+        return;
+      }
+      const data = await response.json();
+      // The filters were resubmitted while this was in flight
+      if (syncState.current.query !== query) return;
+      syncState.current = { version: data.version, query };
+      if (data.reset) {
+        setProperties(data.added);
+      } else if (data.added.length || data.updated.length || data.removed.length) {
+        const removed = new Set(data.removed);
+        const changed = new Map([...data.updated, ...data.added].map(property => [property.id, property]));
+        setProperties(prev => {
+          const kept = prev.filter(property => !removed.has(property.id)).map(property => changed.get(property.id) || property);
+          const present = new Set(kept.map(property => property.id));
+          return [...kept, ...[...changed.values()].filter(property => !present.has(property.id))];
+        });
+      } else {
+        return;
+      }
+      fetchMarkets();
+    } catch (error) {
+      console.error('Error syncing properties:', error);
+    }
+  };
+
   const fetchMarkets = async () => {
     try {
       const response = await fetch(`${backendUrl}/api/market-analysis`);
+      if (!response.ok) {
+        console.error('Error fetching markets:', response.status);
+        return;
+      }
       const data = await response.json();
       setMarkets(data.markets || []);
     } catch (error) {
@@ -0,0 +1,121 @@
+"""Fixtures shared by the backend tests
+
+The backend modules import each other flat, as server.py does, so backend/
+goes on sys.path. server.py reads its settings at import time, so it is
+imported once per session against a temporary snapshot directory; tests that
+write listings give them a city of their own so they do not see each other's.
+"""
+import os
+import random
+import sys
+import uuid
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+MARKETS = [
+    ("Atlanta", "GA"), ("Phoenix", "AZ"), ("Cleveland", "OH"), ("Memphis", "TN"), ("Jacksonville", "FL"), ("Houston", "TX"),
+]
+PROPERTY_TYPES = ["Single Family", "Single Family", "Single Family", "Multi Family", "Townhouse", "Condo"]
+GRADES = ["A", "A-", "B+", "B", "B-", "C+"]
+STREETS = ["Peachtree St", "Maple Ave", "Oak Dr", "Cedar Ln", "Elm Ct", "Lake Rd"]
+
+
+def make_listings(count: int, city: str = None, seed: int = 0, **fields):
+    """Listings shaped like MOCK_PROPERTIES with fresh ids, optionally all in one made-up city"""
+    rng = random.Random(seed)
+    listings = []
+    for i in range(count):
+        market, state = rng.choice(MARKETS)
+        property_type = rng.choice(PROPERTY_TYPES)
+        bedrooms = rng.randint(4, 8) if property_type == "Multi Family" else rng.randint(1, 5)
+        price = rng.randrange(60000, 600000, 500)
+        zipcode = f"{rng.randint(10000, 99999)}"
+        listing = {
+            "id": str(uuid.uuid4()),
+            "address": f"{rng.randint(100, 9999)} {rng.choice(STREETS)} #{i}, {city or market}, {state} {zipcode}",
+            "city": city or market,
+            "state": state,
+            "zipcode": zipcode,
+            "price": price,
+            "bedrooms": bedrooms,
+            "bathrooms": max(1, bedrooms - rng.randint(0, 2)),
+            "sqft": bedrooms * rng.randint(380, 650),
+            "property_type": property_type,
+            "year_built": rng.randint(1920, 2022),
+            "estimated_rent": int(price * rng.uniform(0.006, 0.013)),
+            "estimated_arv": int(price * rng.uniform(1.05, 1.7)),
+            "estimated_repair_cost": int(price * rng.uniform(0.02, 0.25)) // 100 * 100,
+            "neighborhood_quality": rng.choice(GRADES),
+            "days_on_market": rng.randint(1, 180),
+            "property_taxes": int(price * rng.uniform(0.008, 0.022)),
+            "hoa_fees": rng.choice([0, 0, 50, 250]),
+            "image_url": "https://images.unsplash.com/photo-1568605114967-8130f3a36994?w=500",
+            "description": f"{bedrooms} bed {property_type.lower()} in {city or market}.",
+            "listing_agent": rng.choice(["Sarah Johnson", "Mike Rodriguez", "Linda Thompson"]),
+            "listing_date": f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "market_trends": {
+                "appreciation_rate": 6.5,
+                "market_type": "Balanced Market",
+                "days_on_market_avg": 40,
+                "price_trend": "Increasing",
+                "rental_demand": "High",
+            },
+        }
+        listing.update(fields)
+        listings.append(listing)
+    return listings
+
+
+def simple_analysis(listing):
+    """Stand-in for server.analyze_listing with every field the inventory columns read"""
+    price = listing["price"]
+    rent = listing.get("estimated_rent") or 0
+    return {
+        "flip_analysis": {
+            "estimated_roi": (listing.get("estimated_arv", price) - price) / price * 100,
+            "profit_margin": 0.0,
+            "net_profit": listing.get("estimated_arv", price) - price,
+            "meets_70_rule": price <= 0.7 * listing.get("estimated_arv", price),
+        },
+        "rental_analysis": {
+            "cash_on_cash_return": rent * 12 / price * 100,
+            "cap_rate": 0.0,
+            "monthly_cash_flow": rent - price * 0.006,
+            "annual_cash_flow": (rent - price * 0.006) * 12,
+            "rent_to_price_ratio": rent / price * 100,
+            "meets_1_percent_rule": rent >= price * 0.01,
+        },
+    }
+
+
+@pytest.fixture
+def unique_city():
+    return f"Testville {uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    os.environ["SNAPSHOT_DIR"] = str(tmp_path_factory.mktemp("snapshots"))
+    os.environ["OFFLOAD_WORKERS"] = "0"
+    import server
+    return server
+
+
+@pytest.fixture(scope="session")
+def client(server):
+    from fastapi.testclient import TestClient
+
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def write(client):
+    """Run one of the server's write functions on the test client's loop"""
+    def write(fn, *args):
+        return client.portal.call(fn, *args)
+    return write
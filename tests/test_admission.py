@@ -0,0 +1,166 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import admission
+from admission import AdmissionGate, Overloaded, RateLimitMiddleware, RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    limiter = RateLimiter(rate=2, burst=3)
+    assert [limiter.acquire("a") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    assert limiter.acquire("b") == 0
+    clock[0] += 0.5
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+    clock[0] += 60
+    assert [limiter.acquire("a") for _ in range(4)][:3] == [0, 0, 0]
+
+
+def test_least_recently_seen_clients_are_forgotten(clock):
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2)
+    for client in ("a", "b", "a", "c"):
+        limiter.acquire(client)
+    assert list(limiter.buckets) == ["a", "c"]
+
+
+def test_admission_gate_queues_then_sheds():
+    async def scenario():
+        gate = AdmissionGate(limit=1, queue=1, timeout=0.05)
+        order = []
+
+        async def hold(name, release):
+            async with gate.slot():
+                order.append(name)
+                await release.wait()
+
+        first_done, second_done = asyncio.Event(), asyncio.Event()
+        first = asyncio.ensure_future(hold("first", first_done))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(hold("second", second_done))
+        await asyncio.sleep(0)
+        assert (gate.active, gate.waiting) == (1, 1)
+
+        with pytest.raises(Overloaded) as shed:
+            async with gate.slot():
+                pass
+        assert shed.value.reason == "queue_full"
+
+        first_done.set()
+        await first
+        await asyncio.sleep(0)
+        # The freed slot went straight to the waiter
+        assert order == ["first", "second"] and gate.active == 1
+
+        with pytest.raises(Overloaded) as shed:
+            async with gate.slot():
+                pass
+        assert shed.value.reason == "timeout"
+        assert gate.waiting == 0
+
+        second_done.set()
+        await second
+        assert gate.active == 0
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        gate = AdmissionGate(limit=1, queue=5, timeout=10)
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate.slot():
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(hold())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert gate.waiting == 0
+        release.set()
+        await holder
+        assert gate.active == 0
+    asyncio.run(scenario())
+
+
+def middleware(client_header="X-Forwarded-For", proxy_hops=0):
+    return RateLimitMiddleware(None, {}, lambda method, path: None, client_header, proxy_hops)
+
+
+def scope(peer="10.0.0.1", *forwarded):
+    return {"client": (peer, 1234), "headers": [(b"x-forwarded-for", value.encode()) for value in forwarded]}
+
+
+def test_client_is_taken_from_the_trusted_proxies_entry():
+    assert middleware().client_of(scope("10.0.0.1", "1.1.1.1")) == "10.0.0.1"
+    one_hop = middleware(proxy_hops=1)
+    assert one_hop.client_of(scope("10.0.0.1", "6.6.6.6, 1.1.1.1")) == "1.1.1.1"
+    assert one_hop.client_of(scope("10.0.0.1", "6.6.6.6", "1.1.1.1")) == "1.1.1.1"
+    assert one_hop.client_of(scope("10.0.0.1")) == "10.0.0.1"
+    two_hops = middleware(proxy_hops=2)
+    assert two_hops.client_of(scope("10.0.0.1", "6.6.6.6, 1.1.1.1, 10.0.0.2")) == "1.1.1.1"
+    assert two_hops.client_of(scope("10.0.0.1", "1.1.1.1")) == "10.0.0.1"
+    assert middleware(client_header="", proxy_hops=1).client_of(scope("10.0.0.1", "1.1.1.1")) == "10.0.0.1"
+
+
+def test_middleware_answers_429_per_client_and_lane():
+    app = FastAPI()
+
+    @app.get("/limited")
+    async def limited():
+        return {}
+
+    @app.get("/free")
+    async def free():
+        return {}
+
+    refused = []
+    app.add_middleware(
+        RateLimitMiddleware, limiters={"search": RateLimiter(rate=0.1, burst=2)},
+        lane_of=lambda method, path: "search" if path == "/limited" else None,
+        client_header="X-Forwarded-For", proxy_hops=1, on_limited=refused.append,
+    )
+    client = TestClient(app)
+    alice, bob = {"X-Forwarded-For": "1.1.1.1"}, {"X-Forwarded-For": "2.2.2.2"}
+    assert [client.get("/limited", headers=alice).status_code for _ in range(3)] == [200, 200, 429]
+    response = client.get("/limited", headers=alice)
+    assert response.status_code == 429
+    assert 1 <= int(response.headers["Retry-After"]) <= 10
+    assert client.get("/limited", headers=bob).status_code == 200
+    assert client.get("/free", headers=alice).status_code == 200
+    assert client.options("/limited", headers=alice).status_code != 429
+    assert refused == ["search", "search"]
+
+
+def test_server_lanes_and_defaults(server):
+    assert server.request_lane("GET", "/api/properties") == "search"
+    assert server.request_lane("POST", "/api/send-alert") == "alerts"
+    assert server.request_lane("GET", "/api/properties/abc") == "lookup"
+    for path in ("/api/health", "/api/admin/profiling", "/metrics"):
+        assert server.request_lane("GET", path) is None
+    # Every lane is off unless configured, and then the middleware is not installed
+    assert server.RATE_LIMITERS == {}
+    assert RateLimitMiddleware not in [m.cls for m in server.app.user_middleware]
+    assert server.TRUSTED_PROXY_HOPS == 0
+
+
+def test_expensive_requests_are_shed_when_the_gate_is_full(client, server, monkeypatch, unique_city):
+    monkeypatch.setattr(server, "ADMISSION", AdmissionGate(limit=0, queue=0, timeout=1))
+    response = client.get("/api/properties", params={"city": unique_city})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert client.get("/api/health").status_code == 200
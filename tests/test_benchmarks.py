@@ -0,0 +1,87 @@
+"""Smoke runs of the benchmark scripts at toy sizes
+
+Each runs in its own interpreter, since the scripts import the server with
+settings of their own.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.synthetic import MARKETS
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+
+def run_script(name, *args, tmp_path):
+    env = {**os.environ, "OFFLOAD_WORKERS": "0"}
+    env.pop("SNAPSHOT_DIR", None)
+    return subprocess.run(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, name), *args],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=300,
+    )
+
+
+def test_load_test_drives_every_endpoint(tmp_path):
+    output = tmp_path / "load.json"
+    result = run_script(
+        "load_test.py", "--size", "300", "--concurrency", "1,4", "--requests", "8", "--warmup", "2",
+        "--transport", "inprocess", "--output", str(output), "--baseline", str(tmp_path / "baseline.json"),
+        tmp_path=tmp_path,
+    )
+    assert result.returncode == 0, result.stderr
+    report = json.loads(output.read_text())
+    assert report["meta"]["size"] >= 300
+    results = report["results"]
+    endpoints = {"properties", "popular", "property", "analysis", "calculate-deal", "market-analysis", "markets"}
+    assert {key.split(":")[1] for key in results} == endpoints
+    for key, level in results.items():
+        assert level["requests"] == 8, key
+        assert level["errors"] == 0, key
+
+
+def test_saved_baseline_is_compared_against(tmp_path):
+    baseline = str(tmp_path / "baseline.json")
+    args = ("--size", "100", "--concurrency", "1", "--requests", "4", "--warmup", "1", "--transport", "inprocess")
+    args += ("--endpoints", "property", "--baseline", baseline)
+    assert run_script("load_test.py", *args, "--save-baseline", tmp_path=tmp_path).returncode == 0
+    assert os.path.exists(baseline)
+    # A generous tolerance keeps timing noise from failing the comparison
+    result = run_script("load_test.py", *args, "--tolerance", "100", tmp_path=tmp_path)
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_micro_benchmarks_cover_every_size(tmp_path):
+    first, second = tmp_path / "first.json", tmp_path / "second.json"
+    args = ("--sizes", "200,400", "--history-days", "20", "--min-time", "0", "--max-repeats", "1")
+    assert run_script("micro.py", *args, "--json", "--output", str(first), tmp_path=tmp_path).returncode == 0
+    results = json.loads(first.read_text())["results"]
+    for name in {r["benchmark"] for r in results}:
+        # Inventory benchmarks run at each size, market history ones per market-day
+        rows = {r["rows"] for r in results if r["benchmark"] == name}
+        assert rows in ({200, 400}, {20 * len(MARKETS)}), name
+    assert all(r["repeats"] == 1 and r["median_s"] > 0 for r in results)
+
+    result = run_script("micro.py", *args, "--output", str(second), "--compare", str(first), tmp_path=tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert len(json.loads(second.read_text())["results"]) == len(results)
+
+
+def test_mortgage_payment_used_by_the_deal_calculator(client, server):
+    assert round(server.monthly_mortgage_payment(200000, 6.0, 30), 2) == 1199.10
+    assert server.monthly_mortgage_payment(120000, 0, 10) == 1000
+    deal = {"purchase_price": 250000, "down_payment_percent": 20, "interest_rate": 6.0, "loan_term_years": 30,
+            "monthly_rent": 2000, "estimated_expenses": 300}
+    response = client.post("/api/calculate-deal", json=deal).json()
+    assert response["monthly_payment"] == 1199.1
+    assert response["monthly_cash_flow"] == 500.9
+
+
+def test_startup_benchmark_reports_each_phase(tmp_path):
+    result = run_script("startup.py", "--runs", "1", "--json", tmp_path=tmp_path)
+    assert result.returncode == 0, result.stderr
+    report = json.loads(result.stdout)
+    for phase in ("first_boot", "restart_median"):
+        assert set(report[phase]) == {"import_s", "open_s", "first_request_s"}
+        assert all(seconds > 0 for seconds in report[phase].values())
+    assert any(item["package"] == "fastapi" for item in report["import_breakdown"])
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from bitmap import ARRAY_LIMIT, CHUNK_SIZE, Bitmap
+from inventory import Inventory
+
+from tests.conftest import make_listings, simple_analysis
+
+SIZE = 3 * CHUNK_SIZE
+
+
+def random_rows(seed, count):
+    return np.unique(np.random.default_rng(seed).integers(0, SIZE, count))
+
+
+@pytest.fixture(params=[(100, 200), (100, 30000), (30000, 60000)], ids=["sparse", "mixed", "dense"])
+def pair(request):
+    a, b = request.param
+    return random_rows(1, a), random_rows(2, b)
+
+
+def test_round_trips_through_rows_and_masks(pair):
+    rows = pair[1]
+    bitmap = Bitmap.from_rows(rows)
+    assert bitmap.rows().tolist() == rows.tolist()
+    assert len(bitmap) == len(rows)
+    mask = bitmap.to_mask(SIZE)
+    assert np.flatnonzero(mask).tolist() == rows.tolist()
+    assert Bitmap.from_mask(mask).rows().tolist() == rows.tolist()
+    assert np.flatnonzero(bitmap.to_mask(CHUNK_SIZE)).tolist() == rows[rows < CHUNK_SIZE].tolist()
+
+
+def test_set_operations_match_python_sets(pair):
+    a, b = pair
+    left, right = Bitmap.from_rows(a), Bitmap.from_rows(b)
+    sa, sb = set(a.tolist()), set(b.tolist())
+    assert (left & right).rows().tolist() == sorted(sa & sb)
+    assert (left | right).rows().tolist() == sorted(sa | sb)
+    assert (left - right).rows().tolist() == sorted(sa - sb)
+    assert (right - left).rows().tolist() == sorted(sb - sa)
+
+
+def test_containers_switch_between_array_and_bitset():
+    bitmap = Bitmap.from_rows(np.arange(ARRAY_LIMIT))
+    assert bitmap.containers[0].dtype == np.uint16
+    bitmap.add(ARRAY_LIMIT)
+    assert bitmap.containers[0].dtype == np.uint64
+    # A bitset is only re-checked once one of its words empties
+    for row in range(64):
+        bitmap.discard(row)
+    assert bitmap.containers[0].dtype == np.uint16
+    assert len(bitmap) == ARRAY_LIMIT + 1 - 64
+    for row in range(64, ARRAY_LIMIT + 1):
+        bitmap.discard(row)
+    assert not bitmap.containers
+
+
+def test_add_discard_and_membership():
+    bitmap = Bitmap()
+    for row in (5, CHUNK_SIZE + 7, 5):
+        bitmap.add(row)
+    assert len(bitmap) == 2
+    assert 5 in bitmap and CHUNK_SIZE + 7 in bitmap
+    assert 6 not in bitmap and 2 * CHUNK_SIZE not in bitmap
+    copy = bitmap.copy()
+    bitmap.discard(5)
+    bitmap.discard(6)
+    assert 5 not in bitmap
+    assert 5 in copy
+    assert len(Bitmap.from_rows([])) == 0
+    assert Bitmap().rows().tolist() == []
+
+
+def expected_mask(listings, inventory, **predicates):
+    """Brute-force version of filter_mask over the listings, one row each"""
+    keep = np.zeros(inventory.size, dtype=bool)
+    analyses = [simple_analysis(listing) for listing in listings]
+    for listing, analysis in zip(listings, analyses):
+        ok = True
+        for name, expression in predicates.get("categories", {}).items():
+            values = [v.strip() for v in expression.split(",")]
+            include = [v for v in values if v and not v.startswith("!")]
+            exclude = [v[1:] for v in values if v.startswith("!")]
+            ok &= (not include or listing[name] in include) and listing[name] not in exclude
+        for name, value in predicates.get("flags", {}).items():
+            section = "flip_analysis" if name == "meets_70_rule" else "rental_analysis"
+            ok &= analysis[section][name] == value
+        keep[inventory.row_for(listing["id"])] = ok
+    return keep
+
+
+@pytest.mark.parametrize("predicates", [
+    {"categories": {"state": "GA,FL"}},
+    {"categories": {"property_type": "!Multi Family"}},
+    {"categories": {"state": "GA,FL,!FL"}},
+    {"categories": {"state": "!GA,!TX", "neighborhood_quality": "A,B+,A-"}},
+    {"categories": {"state": "Nowhere"}},
+    {"categories": {"state": "!Nowhere"}},
+    {"flags": {"meets_70_rule": True}},
+    {"flags": {"meets_1_percent_rule": False}, "categories": {"property_type": "Single Family,Condo"}},
+])
+def test_filter_mask_matches_brute_force(predicates):
+    listings = make_listings(300)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    for listing in listings[:20]:
+        inventory.remove(listing["id"])
+    live = listings[20:]
+
+    mask = inventory.filter_mask(categories=predicates.get("categories"), flags=predicates.get("flags"))
+    assert mask.tolist() == expected_mask(live, inventory, **predicates).tolist()
+    rows = np.arange(inventory.size)
+    subset = inventory.filter_rows(rows, categories=predicates.get("categories"), flags=predicates.get("flags"))
+    assert subset.tolist() == mask.tolist()
+
+
+def test_bulk_loads_build_the_same_bitmaps():
+    listings = make_listings(200)
+    bulk, one_by_one = Inventory(simple_analysis), Inventory(simple_analysis)
+    bulk.extend(listings)
+    for listing in listings:
+        one_by_one.upsert(listing)
+    for name, bitmaps in one_by_one.bitmaps.items():
+        assert [b.rows().tolist() for b in bulk.bitmaps[name]] == [b.rows().tolist() for b in bitmaps], name
+    for name, bitmap in one_by_one.flags.items():
+        assert bulk.flags[name].rows().tolist() == bitmap.rows().tolist(), name
+
+
+def test_bitmaps_follow_updates():
+    listings = make_listings(10, state="GA")
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    inventory.upsert({**listings[0], "state": "FL"})
+    assert inventory.filter_mask(state="FL").sum() == 1
+    assert inventory.filter_mask(state="GA").sum() == 9
+    inventory.remove(listings[1]["id"])
+    assert inventory.filter_mask(state="GA").sum() == 8
+    assert inventory.filter_mask(state="!FL").sum() == 8
+
+
+def test_properties_filters_on_analysis_fields(client, write, server, unique_city):
+    listings = make_listings(20, city=unique_city)
+    write(server.load_properties, listings)
+    quality = listings[0]["neighborhood_quality"]
+    expected = {p["id"] for p in listings if p["neighborhood_quality"] == quality}
+
+    params = {"city": unique_city, "neighborhood_quality": quality}
+    response = client.get("/api/properties", params=params).json()
+    assert {p["id"] for p in response["properties"]} == expected
+    for value in (True, False):
+        response = client.get("/api/properties", params={"city": unique_city, "meets_1_percent_rule": value}).json()
+        assert all(p["rental_analysis"]["meets_1_percent_rule"] is value for p in response["properties"])
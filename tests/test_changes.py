@@ -0,0 +1,171 @@
+import numpy as np
+import pytest
+
+import inventory as inventory_module
+from inventory import ChangeHistory, Inventory
+from snapshot import Snapshot, SnapshotStore
+
+from tests.conftest import make_listings, simple_analysis
+
+
+def test_change_history_finds_the_first_entry_after_a_version():
+    history = ChangeHistory()
+    history.record(3, row=0, alive=True, codes={"state": 1}, columns={"price": 100.0})
+    history.record(5, row=1, alive=True, codes={"state": 2}, columns={"price": 200.0})
+    history.record(7, row=0, alive=True, codes={"state": 3}, columns={"price": 300.0})
+
+    rows = np.array([0, 1, 2])
+    assert history.as_of(rows, 2).tolist() == [0, 1, -1]
+    assert history.as_of(rows, 3).tolist() == [2, 1, -1]
+    assert history.as_of(rows, 7).tolist() == [-1, -1, -1]
+    entries = history.as_of(rows[:2], 4)
+    assert history.values("column:price", entries).tolist() == [300.0, 200.0]
+    assert history.values("code:city", entries).tolist() == [-1, -1]
+
+
+def test_change_history_trims_and_moves_its_horizon():
+    history = ChangeHistory(limit=2)
+    for version in range(1, 5):
+        history.record(version, row=version, alive=True, codes={}, columns={})
+    assert history.horizon == 0 and history.count == 4
+    history.record(5, row=5, alive=True, codes={}, columns={})
+    assert history.horizon == 3
+    assert history.entries()["version"].tolist() == [4, 5]
+
+    copy = history.copy()
+    history.record(6, row=6, alive=True, codes={}, columns={})
+    assert copy.count == 2
+
+
+def test_writes_bump_the_change_version():
+    listings = make_listings(3)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    since = inventory.version
+    assert inventory.changed_rows(since).size == 0
+
+    inventory.upsert({**listings[2], "price": 1})
+    inventory.remove(listings[0]["id"])
+    added = inventory.upsert(make_listings(1, seed=1)[0])
+    assert inventory.version == since + 3
+    assert inventory.changed_rows(since).tolist() == [2, 0, added]
+    assert inventory.created[added] == inventory.version
+    assert inventory.removed_id(0) == listings[0]["id"]
+
+    frozen = inventory.freeze()
+    assert frozen.version == inventory.version
+    assert np.array_equal(frozen.changed_rows(since), inventory.changed_rows(since))
+
+
+def test_filter_rows_as_of_an_earlier_version():
+    listings = make_listings(3, state="GA", price=100000)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    since = inventory.version
+    inventory.upsert({**listings[0], "price": 500000})
+    inventory.upsert({**listings[1], "state": "FL"})
+    inventory.remove(listings[2]["id"])
+    added = inventory.upsert(make_listings(1, state="GA", price=100000)[0])
+
+    rows = np.array([0, 1, 2, added])
+    now = inventory.filter_rows(rows, max_price=200000, state="GA")
+    before = inventory.filter_rows(rows, max_price=200000, state="GA", as_of=since)
+    assert now.tolist() == [False, False, False, True]
+    assert before.tolist() == [True, True, True, False]
+
+
+def changes(client, since, city, **params):
+    return client.get("/api/changes", params={"since": since, "city": city, **params}).json()
+
+
+def test_changes_report_what_the_client_has_to_update(client, write, server, unique_city):
+    cheap, pricey, other, doomed, flapping = make_listings(5, city=unique_city, price=100000)
+    write(server.load_properties, [cheap, pricey, other, doomed, flapping])
+    since = server.INVENTORY.version
+
+    write(server.upsert_property, {**pricey, "price": 900000})
+    write(server.upsert_property, {**other, "state": "ZZ"})
+    write(server.remove_property, doomed["id"])
+    write(server.remove_property, flapping["id"])
+    write(server.upsert_property, flapping)
+    fresh = make_listings(1, city=unique_city, price=100000)[0]
+    write(server.upsert_property, fresh)
+
+    response = changes(client, since, unique_city, max_price=200000)
+    assert response["reset"] is False
+    assert response["version"] == server.INVENTORY.version
+    assert {p["id"] for p in response["added"]} == {fresh["id"], flapping["id"]}
+    assert [p["id"] for p in response["updated"]] == [other["id"]]
+    assert sorted(response["removed"]) == sorted([pricey["id"], doomed["id"]])
+
+    # Listings that never matched the filter are not reported as removed
+    response = changes(client, since, unique_city, state="ZZ")
+    assert [p["id"] for p in response["updated"]] == [other["id"]]
+    assert response["removed"] == []
+
+    assert changes(client, response["version"], unique_city) == {
+        "version": response["version"], "since": response["version"], "reset": False, "added": [], "updated": [], "removed": [],
+    }
+
+
+@pytest.mark.parametrize("since", [0, -1, 10 ** 9])
+def test_unknown_versions_reset(client, write, server, unique_city, since):
+    write(server.load_properties, make_listings(2, city=unique_city))
+    response = changes(client, since, unique_city)
+    assert response["reset"] is True
+    assert len(response["added"]) == 2
+    assert response["removed"] == []
+
+
+def test_properties_carry_the_version(client, server):
+    assert client.get("/api/properties", params={"limit": 1}).json()["version"] == server.INVENTORY.version
+
+
+@pytest.fixture
+def short_history(server, monkeypatch):
+    """A fresh server inventory whose change history keeps only a few entries"""
+    monkeypatch.setattr(inventory_module, "CHANGE_HISTORY", 2)
+    inventory = Inventory(server.analyze_listing, server.listing_categories)
+    monkeypatch.setattr(server, "INVENTORY", inventory)
+    monkeypatch.setattr(server, "_market_aggregates", None)
+    for name in ("_stream_state", "_published"):
+        monkeypatch.setattr(server, name, getattr(server, name))
+    return inventory
+
+
+def test_versions_older_than_the_horizon_reset(client, short_history, unique_city):
+    listings = make_listings(6, city=unique_city)
+    short_history.extend(listings)
+    since = short_history.version
+    short_history.remove(listings[0]["id"])
+    assert changes(client, since, unique_city)["removed"] == [listings[0]["id"]]
+
+    for listing in listings[1:]:
+        short_history.upsert({**listing, "price": listing["price"] + 1})
+    assert short_history.horizon > since
+    response = changes(client, since, unique_city)
+    assert response["reset"] is True
+    assert len(response["added"]) == 5
+
+
+def test_compaction_drops_dead_rows_behind_the_horizon(server, short_history, tmp_path, monkeypatch):
+    listings = make_listings(8)
+    short_history.extend(listings)
+    for listing in listings[:4]:
+        short_history.remove(listing["id"])
+    for listing in listings[4:]:
+        short_history.upsert({**listing, "price": listing["price"] + 1})
+    assert short_history.horizon >= short_history.versions[:4].max()
+
+    monkeypatch.setattr(server, "SNAPSHOT_STORE", SnapshotStore(str(tmp_path / "store")))
+    compacted = server.publish_snapshot(short_history.freeze(), short_history)
+    assert compacted is not None
+    assert compacted.size == 4
+    assert compacted.compacted_at == short_history.version
+    assert compacted.removed_ids() == {}
+    assert sorted(p["id"] for p in compacted.properties()) == sorted(p["id"] for p in listings[4:])
+    assert compacted.get(listings[5]["id"])["price"] == listings[5]["price"] + 1
+
+    # Nothing left to compact: the next publish keeps the rows as they are
+    assert server.publish_snapshot(compacted.freeze(), compacted) is None
+    assert Snapshot(server.SNAPSHOT_STORE.path_for(2)).size == 4
@@ -0,0 +1,110 @@
+import asyncio
+
+import pytest
+
+from coalesce import SingleFlight
+
+from tests.conftest import make_listings
+
+
+class Work:
+    """Counts computations and finishes them only when released"""
+
+    def __init__(self, result="done"):
+        self.calls = 0
+        self.release = asyncio.Event()
+        self.result = result
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_concurrent_callers_share_one_computation():
+    async def scenario():
+        outcomes = []
+        flights = SingleFlight(observe=outcomes.append)
+        work = Work()
+        callers = [asyncio.ensure_future(flights.run("key", work)) for _ in range(3)]
+        other = asyncio.ensure_future(flights.run("other", Work("other")))
+        await asyncio.sleep(0)
+        work.release.set()
+        assert await asyncio.gather(*callers) == ["done"] * 3
+        assert work.calls == 1
+        assert outcomes == ["leader", "joined", "joined", "leader"]
+        assert list(flights.flights) == ["other"]
+        other.cancel()
+    asyncio.run(scenario())
+
+
+def test_exceptions_are_shared_and_not_remembered():
+    async def scenario():
+        flights = SingleFlight(window=10)
+        work = Work(ValueError("boom"))
+        callers = [asyncio.ensure_future(flights.run("key", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        work.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert work.calls == 1
+        assert not flights.recent and not flights.flights
+    asyncio.run(scenario())
+
+
+def test_recent_results_are_reused_within_the_window():
+    async def scenario():
+        outcomes = []
+        flights = SingleFlight(window=0.05, max_recent=2, observe=outcomes.append)
+        work = Work()
+        work.release.set()
+        assert await flights.run("key", work) == "done"
+        assert await flights.run("key", work) == "done"
+        assert work.calls == 1 and outcomes[-1] == "recent"
+
+        await asyncio.sleep(0.06)
+        await flights.run("key", work)
+        assert work.calls == 2
+
+        for key in ("a", "b", "c"):
+            await flights.run(key, work)
+        assert list(flights.recent) == ["b", "c"]
+
+        flights.window = 0
+        await flights.run("d", work)
+        assert "d" not in flights.recent
+    asyncio.run(scenario())
+
+
+def test_a_caller_giving_up_does_not_cancel_the_others():
+    async def scenario():
+        flights = SingleFlight()
+        work = Work()
+        impatient = asyncio.ensure_future(flights.run("key", work))
+        patient = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0)
+        impatient.cancel()
+        await asyncio.sleep(0)
+        work.release.set()
+        assert await patient == "done"
+        with pytest.raises(asyncio.CancelledError):
+            await impatient
+    asyncio.run(scenario())
+
+
+def test_identical_requests_share_results_until_the_inventory_changes(client, write, server, unique_city):
+    write(server.load_properties, make_listings(3, city=unique_city))
+    counts = server.COALESCED.values
+    params = {"city": unique_city}
+
+    first = client.get("/api/properties", params=params)
+    recent = counts.get(("recent",), 0)
+    second = client.get("/api/properties", params=params)
+    assert counts[("recent",)] == recent + 1
+    assert second.json() == first.json()
+
+    write(server.upsert_property, make_listings(1, city=unique_city)[0])
+    assert client.get("/api/properties", params=params).json()["count"] == 4
+    assert counts[("recent",)] == recent + 1
@@ -0,0 +1,67 @@
+import numpy as np
+
+from inventory import Inventory
+
+from tests.conftest import make_listings, simple_analysis
+
+
+def test_top_k_returns_best_rows_in_mask_first():
+    inventory = Inventory(simple_analysis)
+    inventory.extend(make_listings(50))
+    scores = inventory.column("estimated_roi")
+    mask = inventory.alive[:inventory.size].copy()
+    mask[::2] = False
+
+    rows = inventory.top_k(scores, mask, 5)
+    expected = np.flatnonzero(mask)[np.argsort(-scores[mask], kind="stable")][:5]
+    assert rows == expected.tolist()
+    assert inventory.top_k(scores, mask, 0) == []
+    assert len(inventory.top_k(scores, mask, 1000)) == int(mask.sum())
+
+
+def test_composite_score_standardizes_metrics():
+    inventory = Inventory(simple_analysis)
+    inventory.extend(make_listings(30))
+    score = inventory.composite_score({"estimated_roi": 1.0})
+    roi = inventory.column("estimated_roi")
+    assert np.allclose(score, (roi - roi.mean()) / roi.std())
+
+
+def test_removed_rows_stay_out_of_filters():
+    listings = make_listings(10, state="GA")
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    inventory.remove(listings[0]["id"])
+    inventory.upsert({**listings[1], "state": "FL"})
+    assert inventory.filter_mask(state="ga").sum() == 8
+    assert inventory.filter_mask(state="FL").sum() == 1
+    assert inventory.filter_mask(state="Nowhere").sum() == 0
+    assert len(list(inventory.properties())) == len(inventory) == 9
+
+
+def test_top_deals_by_metric(client, write, server, unique_city):
+    write(server.load_properties, make_listings(12, city=unique_city))
+    response = client.get("/api/deals/top", params={"metric": "cap_rate", "k": 5, "city": unique_city}).json()
+    assert response["count"] == 5
+    assert response["total_matches"] == 12
+    assert [deal["rank"] for deal in response["deals"]] == [1, 2, 3, 4, 5]
+    scores = [deal["score"] for deal in response["deals"]]
+    assert scores == sorted(scores, reverse=True)
+    assert all(deal["city"] == unique_city for deal in response["deals"])
+
+
+def test_top_deals_by_weighted_score(client, write, server, unique_city):
+    write(server.load_properties, make_listings(12, city=unique_city))
+    weights = "estimated_roi:0.6,cash_on_cash_return:0.4"
+    response = client.get("/api/deals/top", params={"weights": weights, "k": 3, "city": unique_city}).json()
+    assert response["metric"] == "composite"
+    assert response["weights"] == {"estimated_roi": 0.6, "cash_on_cash_return": 0.4}
+    assert response["count"] == 3
+
+
+def test_top_deals_rejects_bad_parameters(client):
+    assert client.get("/api/deals/top", params={"k": 0}).status_code == 400
+    assert client.get("/api/deals/top", params={"metric": "vibes"}).status_code == 400
+    assert client.get("/api/deals/top", params={"weights": "vibes:1"}).status_code == 400
+    for weight in ("lots", "nan", "inf", "-inf"):
+        assert client.get("/api/deals/top", params={"weights": f"cap_rate:{weight}"}).status_code == 400
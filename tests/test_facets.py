@@ -0,0 +1,73 @@
+import numpy as np
+
+from inventory import PRICE_BUCKETS, Inventory
+
+from tests.conftest import make_listings, simple_analysis
+
+
+def counts(facet):
+    return {item["value"]: item["count"] for item in facet}
+
+
+def test_facet_counts_match_a_row_by_row_count():
+    listings = make_listings(60)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    inventory.remove(listings[0]["id"])
+    live = listings[1:]
+
+    unfiltered = inventory.facet_counts()
+    cities = {p["city"] for p in live}
+    assert counts(unfiltered["city"]) == {city: sum(p["city"] == city for p in live) for city in cities}
+    assert sum(counts(unfiltered["bedrooms"]).values()) == len(live)
+    assert sum(counts(unfiltered["price_bucket"]).values()) == len(live)
+    assert [item["value"] for item in unfiltered["price_bucket"]] == [label for _, label in PRICE_BUCKETS]
+
+    mask = inventory.filter_mask(min_bedrooms=3)
+    filtered = inventory.facet_counts(mask)
+    selected = [p for p in live if p["bedrooms"] >= 3]
+    bedrooms = {p["bedrooms"] for p in selected}
+    assert sum(counts(filtered["property_type"]).values()) == len(selected)
+    assert counts(filtered["bedrooms"]) == {b: sum(p["bedrooms"] == b for p in selected) for b in bedrooms}
+
+
+def test_write_time_counters_follow_updates():
+    listings = make_listings(5, state="GA")
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    inventory.upsert({**listings[0], "state": "FL"})
+    inventory.remove(listings[1]["id"])
+    assert counts(inventory.facet_counts()["state"]) == {"GA": 3, "FL": 1}
+    assert inventory.facet_counts()["state"] == inventory.facet_counts(inventory.alive[:inventory.size])["state"]
+
+
+def test_facets_are_sorted_by_count():
+    inventory = Inventory(simple_analysis)
+    inventory.extend(make_listings(40))
+    values = [item["count"] for item in inventory.facet_counts()["state"]]
+    assert values == sorted(values, reverse=True)
+    assert np.all(np.array(values) > 0)
+
+
+def test_facets_endpoint(client, write, server, unique_city):
+    write(server.load_properties, make_listings(10, city=unique_city, state="ZZ"))
+    response = client.get("/api/facets", params={"city": unique_city}).json()
+    assert response["count"] == 10
+    assert counts(response["facets"]["city"]) == {unique_city: 10}
+    assert counts(response["facets"]["state"]) == {"ZZ": 10}
+    assert sum(counts(response["facets"]["investment_recommendation"]).values()) == 10
+
+    unfiltered = client.get("/api/facets").json()
+    assert unfiltered["count"] == len(server.INVENTORY)
+    assert counts(unfiltered["facets"]["city"])[unique_city] == 10
+    # A flag filters when set to false too
+    for value in ("true", "false"):
+        flagged = client.get("/api/facets", params={"meets_70_rule": value}).json()
+        assert 0 < flagged["count"] < unfiltered["count"]
+
+
+def test_properties_can_include_facets(client, write, server, unique_city):
+    write(server.load_properties, make_listings(4, city=unique_city))
+    response = client.get("/api/properties", params={"city": unique_city, "facets": True}).json()
+    assert response["count"] == 4
+    assert counts(response["facets"]["city"]) == {unique_city: 4}
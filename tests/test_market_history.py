@@ -0,0 +1,146 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from market_history import RECORD, MarketHistory, annual_growth, bucket_of, day_date, day_number, rolling_mean
+
+from tests.conftest import make_listings
+
+# A Monday at the start of a month
+START = day_number(date(2024, 1, 1))
+
+
+def metrics(price, rent=1000.0, days=30.0, listings=10.0):
+    return {"median_price": price, "median_rent": rent, "median_days_on_market": days, "listings": listings}
+
+
+def test_day_numbers_and_buckets():
+    assert day_date(START) == date(2024, 1, 1)
+    days = np.arange(START, START + 40)
+    weeks = bucket_of(days, "week")
+    assert np.all(np.diff(weeks)[np.arange(39) % 7 != 6] == 0)
+    months = bucket_of(days, "month")
+    assert (months == months[0]).sum() == 31
+
+
+def test_log_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "history.log")
+    writer, reader = MarketHistory(path), MarketHistory(path)
+    writer.append(START, {"A": metrics(100.0)})
+    writer.append(START + 2, {"A": metrics(110.0), "B": metrics(50.0)})
+    assert reader.refresh()
+    assert not reader.refresh()
+    assert reader.markets == ["A", "B"]
+    assert reader.days == 3
+    assert np.isnan(reader.matrix("median_price")[1, 0])
+    assert reader.matrix("median_price")[0].tolist()[::2] == [100.0, 110.0]
+
+    with pytest.raises(ValueError):
+        writer.append(START + 2, {"A": metrics(1.0)})
+
+    # A record cut short by a crash is skipped, then overwritten by the next append
+    with open(path, "ab") as f:
+        f.write(b"\0" * (RECORD.itemsize // 2))
+    assert not reader.refresh()
+    MarketHistory(path).append(START + 3, {"A": metrics(120.0)})
+    assert reader.refresh()
+    assert reader.records == 4
+    assert reader.matrix("median_price")[0, 3] == 120.0
+
+
+def test_weekly_and_monthly_rollups_average_the_days():
+    history = MarketHistory()
+    prices = np.arange(60, dtype=float) * 10 + 1000
+    for i, price in enumerate(prices):
+        if i % 9 == 4:
+            continue
+        history.append(START + i, {"A": metrics(price)})
+    recorded = np.array([i % 9 != 4 for i in range(60)])
+
+    weeks = history.series("week")
+    assert weeks["periods"][:2] == ["2024-01-01", "2024-01-08"]
+    for week, value in enumerate(weeks["markets"]["A"]["median_price"]):
+        days = np.arange(60)[(np.arange(60) // 7 == week) & recorded]
+        assert value == round(prices[days].mean(), 2)
+
+    months = history.series("month", periods=1)
+    assert months["periods"] == ["2024-02-01"]
+    february = np.arange(31, 60)[recorded[31:]]
+    assert months["markets"]["A"]["median_price"] == [round(prices[february].mean(), 2)]
+
+    days = history.series("day", periods=10, markets=["A", "unknown"])
+    assert list(days["markets"]) == ["A"]
+    assert len(days["periods"]) == 10
+    # Day 58 was skipped
+    assert days["markets"]["A"]["median_price"][-2] is None
+    assert MarketHistory().series("week") == {"resolution": "week", "periods": [], "markets": {}}
+
+
+def test_rolling_mean_skips_missing_days():
+    values = np.array([[1.0, np.nan, 3.0, 5.0], [np.nan, np.nan, np.nan, 2.0]])
+    expected = [[1.0, 1.0, 3.0, 4.0], [np.nan, np.nan, np.nan, 2.0]]
+    assert np.allclose(rolling_mean(values, 2), expected, equal_nan=True)
+
+
+def test_annual_growth():
+    series = np.vstack([np.linspace(100, 200, 366), np.r_[np.full(300, np.nan), np.linspace(100, 110, 66)]])
+    growth = annual_growth(series, horizon=365, min_days=60)
+    assert growth[0] == pytest.approx(100.0)
+    assert growth[1] == pytest.approx((1.1 ** (365 / 65) - 1) * 100)
+    assert np.isnan(annual_growth(series[:, -30:], horizon=365, min_days=60)).all()
+
+
+def test_trends_report_growth_once_there_is_enough_history():
+    history = MarketHistory()
+    for i in range(120):
+        history.append(START + i, {"Steady": metrics(100000.0), "New": metrics(50000.0) if i >= 100 else {}})
+    trends = history.trends(window=30, horizon=365, min_days=60)
+    assert trends["Steady"]["history_days"] == 120
+    assert trends["Steady"]["appreciation_rate"] == 0.0
+    assert trends["Steady"]["median_price"] == 100000.0
+    assert trends["New"]["history_days"] == 20
+    assert "appreciation_rate" not in trends["New"]
+
+
+@pytest.fixture
+def history(server, monkeypatch):
+    """An in-memory market history in place of the server's"""
+    history = MarketHistory()
+    monkeypatch.setattr(server, "MARKET_HISTORY", history)
+    monkeypatch.setattr(server, "_history_trends", None)
+    return history
+
+
+def market(response, city):
+    return next(m for m in response["markets"] if m["city"] == city)
+
+
+def test_market_trends_come_from_history_after_a_full_window(client, write, server, history, unique_city):
+    write(server.load_properties, make_listings(4, city=unique_city, state="ZZ"))
+    today = day_number(date.today())
+    first = today - 100
+    window = server.MARKET_HISTORY_WINDOW
+    for day in range(first, first + window - 1):
+        server.record_market_history(day, server.INVENTORY)
+
+    listed = market(client.get("/api/market-analysis", params={"city": unique_city}).json(), unique_city)["market_trends"]
+    assert "source" not in listed
+
+    for day in range(first + window - 1, today + 1):
+        server.record_market_history(day, server.INVENTORY)
+    assert not server.record_market_history(today, server.INVENTORY)
+    response = client.get("/api/market-analysis", params={"city": unique_city, "history": "month", "periods": 2}).json()
+    trends = market(response, unique_city)["market_trends"]
+    assert trends["source"] == "history"
+    assert trends["history_days"] == 101
+    assert trends["listings"] == 4
+    assert trends["appreciation_rate"] == 0.0
+    assert trends["price_trend"] == "Stable"
+    assert trends["listing_days_on_market_avg"] == listed["days_on_market_avg"]
+    assert list(response["history"]["markets"]) == [f"{unique_city}, ZZ"]
+    assert len(response["history"]["periods"]) == 2
+
+    markets = client.get("/api/markets").json()["markets"]
+    assert market({"markets": markets}, unique_city)["market_trends"]["source"] == "history"
+    assert client.get("/api/market-analysis", params={"history": "decade"}).status_code == 400
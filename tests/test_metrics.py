@@ -0,0 +1,87 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import REQUESTS, STAGE_LATENCY, MetricsMiddleware, Registry, span
+
+from tests.conftest import make_listings
+
+
+def test_counter_gauge_and_histogram_render():
+    registry = Registry()
+    counter = registry.counter("jobs_total", "Jobs run", ("queue",))
+    counter.inc("fast")
+    counter.inc("fast", amount=2)
+    counter.inc('odd"name\n')
+    gauge = registry.gauge("depth", "Queue depth")
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    registry.gauge("answer", "Read at scrape time", function=lambda: 42)
+    histogram = registry.histogram("wait_seconds", "Wait", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE jobs_total counter" in lines
+    assert 'jobs_total{queue="fast"} 3' in lines
+    assert 'jobs_total{queue="odd\\"name\\n"} 1' in lines
+    assert "depth 1" in lines
+    assert "answer 42" in lines
+    assert 'wait_seconds_bucket{le="0.1"} 1' in lines
+    assert 'wait_seconds_bucket{le="1.0"} 3' in lines
+    assert 'wait_seconds_bucket{le="+Inf"} 4' in lines
+    assert "wait_seconds_sum 6.05" in lines
+    assert "wait_seconds_count 4" in lines
+
+    with pytest.raises(ValueError):
+        registry.counter("jobs_total", "Again")
+
+
+def test_counter_increments_can_be_carried_between_registries():
+    worker, parent = Registry(), Registry()
+    for registry in (worker, parent):
+        registry.counter("rows_total", "Rows", ("route",))
+    worker.metrics["rows_total"].inc("/a", amount=5)
+    before = worker.counts()
+    worker.metrics["rows_total"].inc("/a", amount=2)
+    worker.metrics["rows_total"].inc("/b")
+    parent.add_counts(worker.counts_since(before))
+    assert parent.counts() == {("rows_total", ("/a",)): 2, ("rows_total", ("/b",)): 1}
+
+
+def test_spans_are_recorded_for_sampled_requests_only():
+    def app_with(sample_rate):
+        app = FastAPI()
+
+        @app.get("/work/{item}")
+        async def work(item: str):
+            with span("thinking"):
+                return {"item": item}
+
+        app.add_middleware(MetricsMiddleware, sample_rate=sample_rate)
+        return app
+
+    key = ("/work/{item}", "thinking")
+    STAGE_LATENCY.values.pop(key, None)
+    TestClient(app_with(0.0)).get("/work/1")
+    assert key not in STAGE_LATENCY.values
+    assert REQUESTS.values[("GET", "/work/{item}", "200")] >= 1
+
+    TestClient(app_with(1.0)).get("/work/2")
+    assert sum(STAGE_LATENCY.values[key][0]) == 1
+    assert span("outside a request").__enter__() is None
+
+
+def test_metrics_endpoint_labels_routes_by_template(client, write, server):
+    listing = make_listings(1)[0]
+    write(server.upsert_property, listing)
+    client.get(f"/api/properties/{listing['id']}")
+    client.get("/api/no-such-route")
+
+    text = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/api/properties/{property_id}",status="200"}' in text
+    assert 'route="unmatched",status="404"' in text
+    assert listing["id"] not in text
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert "inventory_listings " in text
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import operator
+import os
+import subprocess
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from offload import Offloader
+
+from tests.conftest import BACKEND_DIR
+
+
+def test_only_large_enough_work_is_offloaded():
+    assert Offloader(2, 100).wants(100)
+    assert not Offloader(2, 100).wants(99)
+    assert not Offloader(0, 0).wants(10 ** 6)
+
+
+def test_pool_runs_work_and_is_replaced_when_it_breaks():
+    async def scenario():
+        offloader = Offloader(1, 0)
+        try:
+            assert offloader.pool is None
+            assert await offloader.run(operator.mul, 6, 7) == 42
+            pool = offloader.pool
+            with pytest.raises(BrokenProcessPool):
+                await offloader.run(os._exit, 1)
+            assert offloader.pool is None
+            assert await offloader.run(operator.add, 1, 2) == 3
+            assert offloader.pool is not pool
+        finally:
+            offloader.shutdown()
+        assert offloader.pool is None
+    asyncio.run(scenario())
+
+
+SCRIPT = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+sys.path.insert(0, sys.argv[2])
+from fastapi.testclient import TestClient
+from benchmarks.synthetic import generate_properties
+import server
+
+if __name__ == "__main__":
+    server.FLIGHTS.window = 0
+    report = {}
+    with TestClient(server.app) as client:
+        report["started_at_startup"] = server.OFFLOAD.pool is not None
+        listings = generate_properties(60, seed=1)
+        for listing in listings:
+            listing["city"] = "Offloadville"
+        client.portal.call(server.load_properties, listings)
+        params = {"city": "Offloadville", "limit": 100}
+        # The pending snapshot is published instead of rendering on the loop
+        unpublished = client.get("/api/properties", params=params).json()
+        report["published_for_the_pool"] = server._pending_snapshot is None and server.OFFLOADED.values[("pool",)] == 1
+        pooled = client.get("/api/properties", params=params).json()
+        misses = server.CACHE_REQUESTS.values.get(("market_aggregates", "miss"), 0)
+        markets = client.get("/api/market-analysis").json()
+        # Counters bumped in the worker are added to this process's
+        report["worker_counts_merged"] = server.CACHE_REQUESTS.values.get(("market_aggregates", "miss"), 0) == misses + 1
+        report["pool_calls"] = server.OFFLOADED.values.get(("pool",), 0)
+        server.OFFLOAD.workers = 0
+        report["same_as_inline"] = pooled == unpublished == client.get("/api/properties", params=params).json()
+        report["same_markets"] = markets == client.get("/api/market-analysis").json()
+        report["count"] = pooled["count"]
+        # Aggregates cached here leave little to render, so it is done inline
+        server.OFFLOAD.workers = 1
+        client.get("/api/markets")
+        report["cached_markets_inline"] = server.OFFLOADED.values[("pool",)] == report["pool_calls"]
+    print(json.dumps(report))
+"""
+
+
+def test_server_renders_large_responses_in_the_pool(tmp_path):
+    env = {**os.environ, "SNAPSHOT_DIR": str(tmp_path), "OFFLOAD_WORKERS": "1", "OFFLOAD_MIN_ROWS": "50"}
+    output = subprocess.run(
+        [sys.executable, "-c", SCRIPT, BACKEND_DIR, os.path.dirname(BACKEND_DIR)],
+        env=env, check=True, capture_output=True, text=True, timeout=300,
+    ).stdout
+    report = json.loads(output.strip().splitlines()[-1])
+    assert report == {
+        "started_at_startup": False,
+        "published_for_the_pool": True,
+        "pool_calls": 3,
+        "same_as_inline": True,
+        "same_markets": True,
+        "count": 60,
+        "worker_counts_merged": True,
+        "cached_markets_inline": True,
+    }
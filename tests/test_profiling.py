@@ -0,0 +1,102 @@
+import pstats
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import ProfileStore, Profiler, ProfilingMiddleware
+
+TOKEN = "let-me-profile"
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+@pytest.fixture
+def profiler(tmp_path):
+    return Profiler(ProfileStore(str(tmp_path / "profiles"), keep=3), TOKEN)
+
+
+@pytest.fixture
+def profiled(profiler):
+    app = FastAPI()
+
+    @app.get("/api/work/{n}")
+    async def work(n: int):
+        busy_wait(n / 1000)
+        return {"n": n}
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    return TestClient(app)
+
+
+def test_requests_are_profiled_only_with_the_admin_token(profiled, profiler):
+    assert "x-profile-id" not in profiled.get("/api/work/1").headers
+    assert "x-profile-id" not in profiled.get("/api/work/1", headers={"X-Profile": "cprofile", "X-Admin-Token": "guess"}).headers
+    assert "x-profile-id" not in profiled.get("/api/work/1", headers={"X-Profile": "vibes", "X-Admin-Token": TOKEN}).headers
+    assert profiler.store.list() == []
+
+    response = profiled.get("/api/work/5", headers={"X-Profile": "cprofile", "X-Admin-Token": TOKEN})
+    assert response.json() == {"n": 5}
+    meta = profiler.store.get(response.headers["x-profile-id"])
+    assert meta["route"] == "/api/work/{n}"
+    assert meta["status"] == 200
+    assert meta["files"] == ["pstats", "txt"]
+    stats = pstats.Stats(profiler.store.path(meta["id"], "pstats"))
+    assert any(name == "busy_wait" for _, _, name in stats.stats)
+    assert not profiler.active
+
+
+def test_sampling_mode_collects_collapsed_stacks(profiled, profiler):
+    response = profiled.get("/api/work/100", headers={"X-Profile": "sampling", "X-Admin-Token": TOKEN})
+    meta = profiler.store.get(response.headers["x-profile-id"])
+    assert meta["files"] == ["collapsed"]
+    assert meta["samples"] > 0
+    with open(profiler.store.path(meta["id"], "collapsed")) as f:
+        lines = f.read().splitlines()
+    assert any("busy_wait" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+
+def test_sampled_traffic_stops_after_its_limit(profiled, profiler):
+    profiler.configure(sample_rate=1.0, mode="cprofile", path_prefix="/api/", limit=2)
+    assert "x-profile-id" not in profiled.get("/health").headers
+    profiled_ids = [profiled.get("/api/work/1").headers.get("x-profile-id") for _ in range(3)]
+    assert profiled_ids[2] is None and None not in profiled_ids[:2]
+    assert profiler.settings()["sample_rate"] == 0.0
+
+
+def test_store_keeps_the_newest_profiles(profiled, profiler):
+    for _ in range(5):
+        profiled.get("/api/work/0", headers={"X-Profile": "cprofile", "X-Admin-Token": TOKEN})
+    assert len(profiler.store.list()) == 3
+    assert profiler.store.get("../../etc/passwd") is None
+    assert profiler.store.clear() == 3
+
+
+def test_admin_endpoints(client, server, profiler, monkeypatch):
+    headers = {"X-Admin-Token": TOKEN}
+    monkeypatch.setattr(server, "ADMIN_TOKEN", TOKEN)
+    assert client.get("/api/admin/profiling").status_code == 403
+    assert client.get("/api/admin/profiling", headers=headers).status_code == 404
+
+    monkeypatch.setattr(server, "PROFILER", profiler)
+    response = client.post("/api/admin/profiling", headers=headers, json={"sample_rate": 0.5, "mode": "sampling", "limit": 4})
+    assert response.json()["settings"]["remaining"] == 4
+    assert client.post("/api/admin/profiling", headers=headers, json={"mode": "vibes"}).status_code == 400
+
+    profile_id = profiler.store.save({"id": "a" * 32, "created": "2026-01-01T00:00:00"}, {"txt": b"summary"})
+    assert client.get("/api/admin/profiling", headers=headers).json()["profiles"][0]["id"] == profile_id
+    download = f"/api/admin/profiles/{profile_id}/download"
+    assert client.get(download, headers=headers).text == "summary"
+    assert client.get(download, params={"format": "pstats"}, headers=headers).status_code == 400
+    assert client.get(f"/api/admin/profiles/{'b' * 32}", headers=headers).status_code == 404
+    assert client.delete("/api/admin/profiles", headers=headers).json() == {"deleted": 1}
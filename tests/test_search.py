@@ -0,0 +1,237 @@
+import threading
+
+import numpy as np
+
+import inventory as inventory_module
+from inventory import Inventory
+from search_index import SearchIndex, tokenize
+from snapshot import SnapshotStore
+
+from tests.conftest import make_listings
+
+
+def build(docs, **kwargs):
+    index = SearchIndex(fields=("text",), **kwargs)
+    index.extend((i, {"text": text}) for i, text in enumerate(docs))
+    return index
+
+
+def test_tokenize():
+    assert tokenize("123 Oak St, Atlanta GA!") == ["123", "oak", "st", "atlanta", "ga"]
+    assert tokenize(None) == []
+
+
+def test_every_token_must_match():
+    index = build(["oak street house", "oak avenue", "maple street"])
+    assert index.search("oak street ").ids.tolist() == [0]
+    assert index.search("pine ").total == 0
+
+
+def test_bm25_ranks_by_frequency_length_and_rarity():
+    index = build(["oak oak maple", "oak maple birch", "oak maple birch cedar elm pine", "maple"])
+    # Same length, more occurrences first; same occurrences, shorter first
+    results = index.search("oak ")
+    assert results.ids.tolist() == [0, 1, 2]
+    assert np.all(np.diff(results.scores) < 0)
+    # birch is rarer than maple, so it decides the ranking
+    assert index.search("maple birch ").ids.tolist() == [1, 2]
+    assert index.search("birch ").scores[0] > index.search("maple ").scores.max()
+
+
+def test_final_token_is_a_prefix_unless_followed_by_space():
+    index = build(["peachtree road", "peach lane", "pear court"])
+    assert sorted(index.search("pea").ids.tolist()) == [0, 1, 2]
+    assert sorted(index.search("peach").ids.tolist()) == [0, 1]
+    assert index.search("peach ").ids.tolist() == [1]
+    assert index.search("peach", prefix=False).ids.tolist() == [1]
+
+
+def test_candidates_restrict_matches():
+    index = build(["oak one", "oak two", "oak three"])
+    candidates = np.array([True, False, True])
+    results = index.search("oak ", candidates=candidates)
+    assert sorted(results.ids.tolist()) == [0, 2]
+    assert results.total == 2
+    assert results.matches.tolist() == [True, False, True]
+
+
+def test_pages_are_consistent_with_ties_broken_by_id():
+    index = build(["oak"] * 7 + ["oak oak"])
+    everything = index.search("oak ").ids.tolist()
+    assert everything[0] == 7
+    assert everything[1:] == list(range(7))
+    pages = [index.search("oak ", limit=3, offset=offset).ids.tolist() for offset in (0, 3, 6)]
+    assert sum(pages, []) == everything
+    assert index.search("oak ", limit=3).total == 8
+    assert index.search("oak ", limit=0).ids.tolist() == []
+
+
+def test_updates_and_removals():
+    index = build(["oak street", "maple street"])
+    index.add(0, {"text": "birch street"})
+    assert index.search("oak ").total == 0
+    assert index.search("birch ").ids.tolist() == [0]
+    index.remove(1)
+    assert index.search("street ").ids.tolist() == [0]
+    assert "maple" not in index.vocabulary
+    index.remove(42)
+    assert len(index) == 1
+
+
+def test_extend_replaces_documents_and_keeps_vocabulary_sorted():
+    index = build(["oak", "maple"])
+    index.extend([(0, {"text": "zebra"}), (5, {"text": "apple"})])
+    assert index.vocabulary == sorted(index.vocabulary)
+    assert "oak" not in index.vocabulary
+    assert index.search("zeb").ids.tolist() == [0]
+    assert index.search("app").ids.tolist() == [5]
+
+
+def test_prefix_expansion_is_capped_to_the_most_frequent_terms():
+    docs = [f"term{i}" for i in range(10)] + ["term0"] * 5
+    index = build(docs, max_expansions=3)
+    terms = index.expand_prefix("term")
+    assert len(terms) == 3
+    assert terms[0] == "term0"
+    results = index.search("term")
+    assert results.truncated
+    assert not index.search("term0").truncated
+    assert len(index.expand_prefix("term", limit=20)) == 10
+
+
+def test_capped_expansion_is_refreshed_after_changes():
+    index = build(["term1", "term2", "term3"], max_expansions=2)
+    index.expand_prefix("term")
+    index.extend((i, {"text": "term9"}) for i in range(10, 15))
+    assert "term9" in index.expand_prefix("term")
+
+
+def test_renumbering_moves_documents_to_new_ids():
+    index = build(["oak one", "gone", "oak two", "maple", "oak three"])
+    index.renumber(np.array([0, -1, 1, 2]))
+    assert 1 in index and 4 not in index and len(index) == 3
+    assert index.search("oak ").ids.tolist() == [0, 1]
+    assert index.search("oak ", candidates=np.array([False, True])).matches.tolist() == [False, True, False]
+    assert index.search("gone ").total == 0
+    # Ids written after renumbering come after the moved ones
+    index.add(5, {"text": "oak four"})
+    index.add(1, {"text": "birch"})
+    index.renumber(np.array([0, 1, 2, 3, 4, 3]))
+    assert index.search("oak ").ids.tolist() == [0, 3]
+    assert index.search("birch ").ids.tolist() == [1]
+    index.remove(3)
+    assert index.search("oak ").ids.tolist() == [0]
+
+
+def test_suggest_ranks_by_document_count():
+    index = build(["oakland", "oak", "oak", "oakwood"])
+    suggestions = index.suggest("oa", limit=2)
+    assert suggestions[0] == {"term": "oak", "document_count": 2}
+    assert len(suggestions) == 2
+    assert index.suggest("") == []
+
+
+def test_listings_removed_during_a_background_build_are_skipped(server):
+    listings = make_listings(5, description="Porch")
+    inventory = Inventory(server.analyze_listing, server.listing_categories)
+    inventory.extend(listings)
+
+    class RemovedWhileReading(list):
+        """Rows that lose a listing once the build has started reading them"""
+        def __getitem__(self, row):
+            if inventory.alive[3]:
+                inventory.remove(listings[3]["id"])
+            return super().__getitem__(row)
+
+    inventory.rows = RemovedWhileReading(inventory.rows)
+    index, _, version, _ = server.build_search_index(inventory)
+    assert version < inventory.version
+    assert sorted(index.search("porch ").ids.tolist()) == [0, 1, 2, 4]
+
+
+def test_compaction_renumbers_the_search_index_instead_of_rebuilding_it(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory_module, "CHANGE_HISTORY", 2)
+    inventory = Inventory(server.analyze_listing, server.listing_categories)
+    monkeypatch.setattr(server, "INVENTORY", inventory)
+    monkeypatch.setattr(server, "SNAPSHOT_STORE", SnapshotStore(str(tmp_path / "store")))
+    for name in ("SEARCH_INDEX", "_indexed_compaction", "_indexed_version", "_indexed_created", "_published"):
+        monkeypatch.setattr(server, name, None if name == "SEARCH_INDEX" else getattr(server, name))
+    listings = make_listings(8, description="Veranda")
+    inventory.extend(listings)
+    index = server.search_index()
+    for listing in listings[:4]:
+        inventory.remove(listing["id"])
+    for listing in listings[4:6]:
+        inventory.upsert({**listing, "price": listing["price"] + 1})
+    server.search_index()
+    inventory.upsert({**listings[7], "description": "Sunroom"})
+
+    compacted = server.publish_snapshot(inventory.freeze(), inventory)
+    assert compacted.size < inventory.size
+    monkeypatch.setattr(server, "INVENTORY", compacted)
+    assert server.search_index() is index
+    assert server.search_index_outdated() is False
+    rows = [compacted.row_for(listing["id"]) for listing in listings[4:]]
+    assert index.search("veranda ").ids.tolist() == rows[:3]
+    assert index.search("sunroom ").ids.tolist() == rows[3:]
+    added = compacted.upsert(make_listings(1, description="Veranda")[0])
+    assert server.search_index().search("veranda ").ids.tolist() == rows[:3] + [added]
+
+
+def test_a_replaced_inventory_is_indexed_off_the_event_loop(write, server, monkeypatch):
+    inventory = Inventory(server.analyze_listing, server.listing_categories)
+    inventory.extend(make_listings(3, description="Trellis"))
+    monkeypatch.setattr(server, "INVENTORY", inventory)
+    for name in ("SEARCH_INDEX", "_indexed_compaction", "_indexed_created", "_search_build"):
+        monkeypatch.setattr(server, name, getattr(server, name))
+    monkeypatch.setattr(server, "_indexed_version", inventory.version + 1)
+    build, threads = server.build_search_index, []
+
+    def recording_build(inventory):
+        threads.append(threading.current_thread())
+        return build(inventory)
+
+    async def search():
+        return threading.current_thread(), (await server.ready_search_index()).search("trellis ").total
+
+    monkeypatch.setattr(server, "build_search_index", recording_build)
+    loop_thread, total = write(search)
+    assert total == 3
+    assert len(threads) == 1 and threads[0] is not loop_thread
+
+
+def test_properties_search_is_paged(client, write, server, unique_city):
+    listings = make_listings(8, city=unique_city, description="Quiet zanzibarish cul-de-sac")
+    write(server.load_properties, listings)
+
+    first = client.get("/api/properties", params={"q": "zanzibarish", "city": unique_city, "limit": 5}).json()
+    assert first["count"] == 5
+    assert first["total"] == 8
+    assert first["prefix_truncated"] is False
+    second = client.get("/api/properties", params={"q": "zanzibarish", "city": unique_city, "limit": 5, "offset": 5}).json()
+    assert second["count"] == 3
+    ids = [p["id"] for p in first["properties"] + second["properties"]]
+    assert sorted(ids) == sorted(listing["id"] for listing in listings)
+
+
+def test_properties_search_sees_new_and_removed_listings(client, write, server, unique_city):
+    listing = make_listings(1, city=unique_city, description="Rare quixotical bungalow")[0]
+    write(server.upsert_property, listing)
+    found = client.get("/api/properties", params={"q": "quixotical"}).json()
+    assert [p["id"] for p in found["properties"]] == [listing["id"]]
+
+    write(server.remove_property, listing["id"])
+    assert client.get("/api/properties", params={"q": "quixotical"}).json()["total"] == 0
+
+
+def test_properties_rejects_bad_pages(client):
+    assert client.get("/api/properties", params={"limit": 0}).status_code == 400
+    assert client.get("/api/properties", params={"limit": 5000}).status_code == 400
+    assert client.get("/api/properties", params={"offset": -1}).status_code == 400
+
+
+def test_suggest_endpoint(client, write, server, unique_city):
+    write(server.upsert_property, make_listings(1, city=unique_city, description="Xylophonic porch")[0])
+    response = client.get("/api/search/suggest", params={"prefix": "xylo"}).json()
+    assert response["suggestions"][0]["term"] == "xylophonic"
+    assert client.get("/api/search/suggest", params={"prefix": "x", "limit": 0}).status_code == 400
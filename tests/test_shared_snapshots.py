@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from inventory import Inventory
+from snapshot import SnapshotStore
+
+from tests.conftest import make_listings
+
+
+@pytest.fixture
+def shared(server, tmp_path, monkeypatch):
+    """Put the server in multi-worker mode over an empty store of its own"""
+    store = SnapshotStore(str(tmp_path / "shared"))
+    monkeypatch.setattr(server, "SNAPSHOT_STORE", store)
+    monkeypatch.setattr(server, "SHARED_SNAPSHOTS", True)
+    monkeypatch.setattr(server, "INVENTORY", Inventory(server.analyze_listing, server.listing_categories))
+    for name in ("SEARCH_INDEX", "_indexed_compaction", "_indexed_version", "_indexed_created", "_stream_state", "_published"):
+        monkeypatch.setattr(server, name, getattr(server, name))
+    return store
+
+
+def test_writes_from_different_workers_stack(server, shared):
+    first, second = make_listings(2)
+    published, _ = server.write_shared_snapshot([(Inventory.upsert, (first,))])
+    assert published.snapshot.version == 1
+    # Another worker still holding nothing writes on top of the latest version
+    published, _ = server.write_shared_snapshot([(Inventory.upsert, (second,))])
+    assert published.snapshot.version == 2
+    assert first["id"] in published and second["id"] in published
+
+    published, [removed] = server.write_shared_snapshot([(Inventory.remove, (first["id"],))])
+    assert removed["id"] == first["id"]
+    assert first["id"] not in published
+    assert shared.current_version() == 3
+
+
+def test_writes_that_change_nothing_are_not_published(server, shared):
+    server.write_shared_snapshot([(Inventory.upsert, (make_listings(1)[0],))])
+    _, [removed] = server.write_shared_snapshot([(Inventory.remove, ("no-such-id",))])
+    assert removed is None
+    assert shared.current_version() == 1
+
+
+def test_worker_swaps_in_its_own_and_other_workers_writes(client, write, server, shared):
+    ours, theirs = make_listings(2, description="Gazebo with a yurtlike roof")
+    write(server.upsert_property, ours)
+    assert server.INVENTORY.snapshot.version == shared.current_version() == 1
+    assert client.get(f"/api/properties/{ours['id']}").status_code == 200
+    assert client.get("/api/properties", params={"q": "yurtlike"}).json()["total"] == 1
+
+    server.write_shared_snapshot([(Inventory.upsert, (theirs,))])
+    # The next request picks the new version up before it is handled
+    assert client.get(f"/api/properties/{theirs['id']}").status_code == 200
+    assert server.INVENTORY.snapshot.version == 2
+    assert client.get("/api/properties", params={"q": "yurtlike"}).json()["total"] == 2
+
+    server.write_shared_snapshot([(Inventory.remove, (ours["id"],))])
+    assert client.get(f"/api/properties/{ours['id']}").status_code == 404
+    assert client.get("/api/properties", params={"q": "yurtlike"}).json()["total"] == 1
+
+
+def test_writes_made_together_are_published_as_one_version(write, server, shared):
+    listings = make_listings(3)
+
+    async def write_together():
+        return await asyncio.gather(
+            *(server.upsert_property(listing) for listing in listings),
+            server.load_properties([{"id": "no-price"}]),
+            server.remove_property(listings[0]["id"]),
+            return_exceptions=True,
+        )
+
+    results = write(write_together)
+    assert results[:3] == listings
+    assert isinstance(results[3], Exception)
+    assert results[4]["id"] == listings[0]["id"]
+    # One publish for the whole batch, without the write that failed
+    assert shared.current_version() == server.INVENTORY.snapshot.version == 1
+    assert [listing["id"] in server.INVENTORY for listing in listings] == [False, True, True]
+    assert "no-price" not in server.INVENTORY
@@ -0,0 +1,187 @@
+import os
+
+import numpy as np
+import pytest
+
+import inventory as inventory_module
+from inventory import Inventory
+from snapshot import KEEP_VERSIONS, PREAMBLE, Snapshot, SnapshotError, SnapshotRows, SnapshotStore, write_snapshot
+
+from tests.conftest import make_listings, simple_analysis
+
+
+def listings_with_odd_values(count):
+    listings = make_listings(count)
+    listings[0]["hoa_fees"] = None
+    listings[1]["tags"] = ["pool", {"nested": True}]
+    listings[2]["description"] = "Ünïcode façade ☀"
+    listings[3]["price"] = 123456.5
+    return listings
+
+
+def reopen(inventory, path, version=1):
+    write_snapshot(inventory, path, version)
+    return Inventory.from_snapshot(Snapshot(path), simple_analysis)
+
+
+def test_round_trip_keeps_listings_and_columns(tmp_path):
+    listings = listings_with_odd_values(40)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    removed = inventory.remove(listings[5]["id"])
+
+    opened = reopen(inventory, str(tmp_path / "one.snap"))
+    assert opened.size == inventory.size
+    assert len(opened) == len(listings) - 1
+    for listing in listings:
+        if listing is removed:
+            assert listing["id"] not in opened
+            continue
+        assert opened.get(listing["id"]) == listing
+        assert opened.row_for(listing["id"]) == inventory.row_for(listing["id"])
+        assert opened.analysis(listing["id"]) == simple_analysis(listing)
+    for name in inventory.columns:
+        assert np.array_equal(opened.column(name), inventory.column(name))
+    state = listings[0]["state"]
+    assert np.array_equal(opened.filter_mask(state=state), inventory.filter_mask(state=state))
+
+
+def test_snapshot_inventory_copies_its_columns_on_first_write(tmp_path):
+    listings = make_listings(10)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    opened = reopen(inventory, str(tmp_path / "one.snap"))
+    assert not opened.column("price").flags.writeable
+
+    opened.upsert({**listings[0], "price": 1})
+    opened.remove(listings[1]["id"])
+    added = opened.upsert(make_listings(1)[0])
+    assert added == 10
+    assert opened.filter_mask(max_price=1).tolist() == [True] + [False] * 10
+    assert len(opened) == 10
+    # The mapped file itself is untouched
+    mapped = Inventory.from_snapshot(Snapshot(str(tmp_path / "one.snap")), simple_analysis)
+    assert mapped.get(listings[0]["id"]) == listings[0]
+
+
+def test_snapshot_rows_and_analyses_are_decoded_into_bounded_caches(tmp_path, monkeypatch):
+    monkeypatch.setattr(inventory_module, "ANALYSIS_CACHE_SIZE", 8)
+    listings = make_listings(50)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    opened = reopen(inventory, str(tmp_path / "one.snap"))
+    opened.rows = SnapshotRows(opened.snapshot, opened.alive, cache_size=8)
+
+    for _ in range(2):
+        assert list(opened.properties()) == listings
+        assert [opened.analysis_at(row) for row in range(50)] == [simple_analysis(listing) for listing in listings]
+    assert opened.rows._decode.cache_info().currsize == 8
+    assert len(opened._snapshot_analyses) == 8
+    assert opened.lazy_analyses == 100
+    # Writes are kept whatever was read since
+    opened.upsert({**listings[0], "price": 1})
+    assert [opened.get(listing["id"])["price"] for listing in listings[:2]] == [1, listings[1]["price"]]
+    assert opened.rows.dirty == {0}
+
+
+def test_snapshot_inventory_is_patched_incrementally(tmp_path):
+    listings = make_listings(100)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    first = reopen(inventory, str(tmp_path / "one.snap"))
+
+    changed = {**listings[0], "price": 1, "description": "Freshly patched"}
+    first.upsert(changed)
+    first.remove(listings[1]["id"])
+    added = make_listings(1)[0]
+    first.upsert(added)
+    assert first.rows.dirty == {0, 1, 100}
+
+    second = reopen(first, str(tmp_path / "two.snap"), version=2)
+    before, after = Snapshot(str(tmp_path / "one.snap")), second.snapshot
+    # Only the changed rows were re-encoded, onto the end of the old string table
+    blob = bytes(before.array("strings:blob"))
+    assert bytes(after.array("strings:blob")[:len(blob)]) == blob
+    assert second.get(listings[0]["id"]) == changed
+    assert second.get(added["id"]) == added
+    assert listings[1]["id"] not in second
+    assert second.row_for(listings[1]["id"]) is None
+    assert second.get(listings[2]["id"]) == listings[2]
+    assert second.filter_mask(max_price=1).tolist() == [True] + [False] * 100
+
+
+def test_unreferenced_strings_are_compacted(tmp_path):
+    listings = make_listings(20)
+    inventory = Inventory(simple_analysis)
+    inventory.extend(listings)
+    inventory = reopen(inventory, str(tmp_path / "0.snap"))
+
+    sizes = []
+    for i in range(1, 30):
+        inventory.upsert({**listings[0], "description": f"{i} " + "x" * 2000})
+        inventory = reopen(inventory, str(tmp_path / f"{i}.snap"), version=i)
+        sizes.append(len(inventory.snapshot.array("strings:blob")))
+        assert inventory.get(listings[0]["id"])["description"].startswith(f"{i} ")
+    grew = sum(b > a for a, b in zip(sizes, sizes[1:]))
+    shrank = sum(b < a for a, b in zip(sizes, sizes[1:]))
+    assert grew and shrank
+    # At most one stale description is ever carried along
+    assert max(sizes) < min(sizes) + 2 * 2000
+
+
+@pytest.mark.parametrize("damage", ["truncated", "magic", "header"])
+def test_damaged_files_raise_snapshot_error(tmp_path, damage):
+    inventory = Inventory(simple_analysis)
+    inventory.extend(make_listings(5))
+    path = str(tmp_path / "bad.snap")
+    write_snapshot(inventory, path, 1)
+    with open(path, "r+b") as f:
+        if damage == "truncated":
+            f.truncate(PREAMBLE.size - 1)
+        elif damage == "magic":
+            f.write(b"NOTASNAP")
+        else:
+            f.seek(PREAMBLE.size)
+            f.write(b"{]")
+    with pytest.raises(SnapshotError):
+        Snapshot(path)
+
+
+def test_store_publishes_prunes_and_recovers(tmp_path):
+    store = SnapshotStore(str(tmp_path / "store"))
+    assert store.open() is None
+    assert not os.path.exists(store.directory)
+
+    inventory = Inventory(simple_analysis)
+    for listing in make_listings(3):
+        inventory.upsert(listing)
+        with store.lock():
+            store.publish(inventory)
+    assert store.current_version() == 3
+    assert store.versions() == list(range(3, 3 - KEEP_VERSIONS, -1))
+
+    assert store.changed()
+    assert store.open().version == 3
+    assert not store.changed()
+
+    with open(store.path_for(3), "r+b") as f:
+        f.write(b"NOTASNAP")
+    with pytest.raises(SnapshotError):
+        store.open()
+    with store.lock():
+        assert store.recover() == 2
+        assert os.path.exists(store.path_for(3) + ".corrupt")
+        # The corrupt version's number is not reused
+        assert store.publish(inventory) == 4
+    assert len(Inventory.from_snapshot(store.open(), simple_analysis)) == 3
+
+
+def test_flushed_listings_survive_a_restart(client, write, server):
+    listing = make_listings(1)[0]
+    write(server.upsert_property, listing)
+    write(server.flush_inventory_snapshot)
+
+    store = SnapshotStore(server.SNAPSHOT_DIR)
+    restarted = Inventory.from_snapshot(store.open(), simple_analysis)
+    assert restarted.get(listing["id"]) == listing
+    assert client.get(f"/api/properties/{listing['id']}").json()["id"] == listing["id"]
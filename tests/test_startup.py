@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from inventory import Inventory
+
+from tests.conftest import BACKEND_DIR, make_listings
+
+PROBE = """
+import json, os, sys
+import server
+report = {
+    "listings_after_import": len(server.INVENTORY),
+    "heavy_modules": sorted(name for name in ("motor", "smtplib", "email.mime.text") if name in sys.modules),
+    "dir_after_import": os.path.exists(os.environ["SNAPSHOT_DIR"]),
+}
+server.ensure_inventory()
+report["ids"] = sorted(p["id"] for p in server.INVENTORY.properties())
+report["dir_after_open"] = os.path.exists(os.environ["SNAPSHOT_DIR"])
+print(json.dumps(report))
+"""
+
+
+def probe(snapshot_dir):
+    env = {**os.environ, "SNAPSHOT_DIR": snapshot_dir, "OFFLOAD_WORKERS": "0", "MONGO_URL": "mongodb://localhost:1"}
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=BACKEND_DIR, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_is_cheap_and_ids_survive_restarts(tmp_path):
+    snapshot_dir = str(tmp_path / "snapshots")
+    first = probe(snapshot_dir)
+    assert first["listings_after_import"] == 0
+    assert first["heavy_modules"] == []
+    assert first["dir_after_import"] is False
+    assert first["ids"]
+    assert first["dir_after_open"] is True
+
+    second = probe(snapshot_dir)
+    assert second["ids"] == first["ids"]
+
+
+def test_market_aggregates_are_cached_until_the_inventory_changes(client, write, server, unique_city):
+    before = client.get("/api/markets").json()
+    hits = server.CACHE_REQUESTS.values.get(("market_aggregates", "hit"), 0)
+    client.get("/api/market-analysis")
+    assert server.CACHE_REQUESTS.values[("market_aggregates", "hit")] == hits + 1
+
+    write(server.load_properties, make_listings(3, city=unique_city, state="ZZ"))
+    after = client.get("/api/markets").json()
+    assert len(after["markets"]) == len(before["markets"]) + 1
+    market = client.get("/api/market-analysis", params={"city": unique_city}).json()["markets"][0]
+    assert market["total_properties"] == 3
+
+
+def test_market_aggregates_group_live_listings_by_city_and_state(server):
+    listings = make_listings(12, city="Springfield", state="IL", property_type="Single Family")
+    for listing in listings[4:8]:
+        listing.update(state="MO", property_type="Multi Family")
+    for listing in listings[8:]:
+        listing["city"] = "Shelbyville"
+    inventory = Inventory(server.analyze_listing, server.listing_categories)
+    inventory.extend(listings)
+    inventory.remove(listings[0]["id"])
+
+    market_data, markets = server.compute_market_aggregates(inventory)
+    assert list(market_data) == ["Springfield, IL", "Springfield, MO", "Shelbyville, IL"]
+    illinois = market_data["Springfield, IL"]
+    live = listings[1:4]
+    assert illinois["properties"].tolist() == [1, 2, 3]
+    assert server.market_listings(inventory, illinois)["properties"] == live
+    assert illinois["total_properties"] == 3
+    assert illinois["avg_price"] == pytest.approx(sum(p["price"] for p in live) / 3)
+    assert illinois["avg_price_per_sqft"] == pytest.approx(sum(p["price"] / p["sqft"] for p in live) / 3)
+    assert illinois["property_type_breakdown"]["single_family"] == 3
+    assert market_data["Springfield, MO"]["property_type_breakdown"]["multi_family_percent"] == 100
+
+    # The market list averages over every state a city is in
+    springfield = listings[1:8]
+    assert [m["property_count"] for m in markets] == [3, 4, 4]
+    assert markets[1]["avg_price"] == sum(p["price"] for p in springfield) // len(springfield)
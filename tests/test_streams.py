@@ -0,0 +1,113 @@
+import asyncio
+import json
+
+from subscriptions import KEEPALIVE, SubscriptionHub, encode_event
+
+from tests.conftest import make_listings
+
+
+def parse(frame):
+    """(event, id, data) of one SSE frame"""
+    fields = dict(line.split(": ", 1) for line in frame.decode().strip().splitlines())
+    return fields["event"], fields.get("id"), json.loads(fields["data"])
+
+
+def test_encode_event():
+    assert encode_event("ready", {"version": 3}) == b'event: ready\ndata: {"version":3}\n\n'
+    assert parse(encode_event("listing", {"a": [1]}, 7)) == ("listing", "7", {"a": [1]})
+
+
+def test_hub_queues_only_newer_versions_and_resyncs_on_overflow():
+    async def scenario():
+        hub = SubscriptionHub(buffer_size=2)
+        slow = hub.subscribe(("city",), version=5)
+        other = hub.subscribe(("state",), version=5)
+        assert hub.count == 2
+
+        assert hub.publish(("city",), [(b"old", 5), (b"six", 6)]) == 0
+        assert slow.queue.get_nowait() == (b"six", 6)
+        slow.sent = 6
+        assert hub.publish(("city",), [(b"seven", 7), (b"eight", 8), (b"nine", 9)]) == 1
+        # The backlog was replaced by a resync from the last version actually sent
+        frame, version = slow.queue.get_nowait()
+        assert version is None and parse(frame) == ("resync", None, {"since": 6})
+        assert slow.queue.empty() and slow.dropped == 2
+        assert other.queue.empty()
+
+        hub.advance(12)
+        assert (other.version, other.sent) == (12, 12)
+        hub.keepalive()
+        assert other.queue.get_nowait() == KEEPALIVE
+
+        hub.unsubscribe(slow)
+        hub.unsubscribe(slow)
+        assert hub.count == 1 and ("city",) not in hub.groups
+    asyncio.run(scenario())
+
+
+def test_stream_unsubscribes_when_the_client_goes_away():
+    async def scenario():
+        hub = SubscriptionHub()
+        stream = hub.stream(("key",), 1, b"hello")
+        assert hub.count == 0
+        assert await stream.__anext__() == b"hello"
+        assert hub.count == 1
+        await stream.aclose()
+        assert hub.count == 0
+    asyncio.run(scenario())
+
+
+def test_listing_stream_pushes_new_and_repriced_listings(client, write, server, unique_city):
+    first, second, elsewhere = make_listings(3, city=unique_city, price=100000)
+    elsewhere["city"] = f"{unique_city} North"
+
+    async def open_stream(criteria):
+        response = await server.stream_listings(server.PropertyFilter(**criteria), None)
+        return response.body_iterator
+
+    async def next_event(stream):
+        while True:
+            frame = await asyncio.wait_for(stream.__anext__(), 5)
+            if frame != KEEPALIVE[0]:
+                return parse(frame)
+
+    stream = client.portal.call(open_stream, {"city": unique_city})
+    event, _, data = client.portal.call(next_event, stream)
+    assert event == "ready" and data["version"] == server.INVENTORY.version
+
+    write(server.load_properties, [first, elsewhere])
+    event, event_id, data = client.portal.call(next_event, stream)
+    assert (event, data["type"], data["listing"]["id"]) == ("listing", "new", first["id"])
+    assert int(event_id) == server.INVENTORY.versions[server.INVENTORY.row_for(first["id"])]
+    assert "flip_analysis" in data["listing"]
+
+    write(server.upsert_property, {**first, "description": "Same price, new words"})
+    write(server.upsert_property, {**first, "price": 90000})
+    write(server.upsert_property, second)
+    # Neither the listing in another city nor the description change is pushed
+    events = [client.portal.call(next_event, stream)[2] for _ in range(2)]
+    assert [(e["type"], e["listing"]["id"]) for e in events] == [("repriced", first["id"]), ("new", second["id"])]
+    assert events[0]["previous_price"] == 100000
+    assert events[0]["listing"]["price"] == 90000
+
+    client.portal.call(stream.aclose)
+    assert server.SUBSCRIPTIONS.count == 0
+
+
+def test_reconnecting_behind_the_inventory_starts_with_a_resync(client, server):
+    async def first_frame(last_event_id):
+        response = await server.stream_listings(server.PropertyFilter(), last_event_id)
+        stream = response.body_iterator
+        try:
+            return parse(await stream.__anext__())
+        finally:
+            await stream.aclose()
+
+    assert client.portal.call(first_frame, "1")[0:3:2] == ("resync", {"since": 1})
+    assert client.portal.call(first_frame, str(server.INVENTORY.version))[0] == "ready"
+    assert client.portal.call(first_frame, "garbage")[0] == "ready"
+
+
+def test_streams_are_refused_once_the_worker_is_full(client, server, monkeypatch):
+    monkeypatch.setattr(server.SUBSCRIPTIONS, "limit", 0)
+    assert client.get("/api/stream/listings").status_code == 503